@@ -1,10 +1,17 @@
 import os
+import copy
+import json
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
 from enum import Enum
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, ValidationError
 import uvicorn
 from dotenv import load_dotenv
 
@@ -17,6 +24,20 @@ from logger import (
 )
 from receipt_processor import ReceiptProcessor
 from budget_planner import BudgetPlanner
+from registry import ServiceRegistry
+from metrics import metrics
+from instrumentation import set_request_id, reset_request_id, current_request_id
+from intent_classifier import IntentClassifier
+from sql_cache import SQLTemplateCache
+from sql_guard import SQLGuard
+from image_preprocess import ImagePreprocessor
+from receipt_cache import ReceiptCache
+from receipt_jobs import ReceiptJobQueue
+from receipt_upload import ReceiptUpload, UploadLimitMiddleware, UploadRejected, read_upload
+from receipt_validation import ReceiptValidator
+from text_receipts import TextReceiptParser, DEFAULT_TEMPLATES
+from chat_memory import MongoSessionStore, InMemorySessionStore, AsyncIOMotorClient
+from service_auth import UserResolver, AuthRejected, USER_HEADER
 
 # Load environment variables
 load_dotenv()
@@ -29,6 +50,129 @@ if not ANTHROPIC_API_KEY:
 # Get PostgreSQL connection string (optional)
 POSTGRES_CONNECTION = os.getenv("POSTGRESQL_URL")
 
+# Database pool settings for BudgetPlanner
+DB_POOL_OPTIONS = {
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    "max_age": float(os.getenv("DB_POOL_MAX_AGE_SECONDS", "1800")),
+    "checkout_timeout": float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT_SECONDS", "10")),
+    "statement_timeout_ms": int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+}
+
+# GET results above this many rows are summarised before reaching the prompt
+MAX_RESULT_ROWS = int(os.getenv("MAX_RESULT_ROWS", "200"))
+
+# Per-request execution budget for budget chat
+BUDGET_MAX_ITERATIONS = int(os.getenv("BUDGET_MAX_ITERATIONS", "3"))
+BUDGET_MAX_LLM_CALLS = int(os.getenv("BUDGET_MAX_LLM_CALLS", "10"))
+BUDGET_REQUEST_TIMEOUT_SECONDS = float(os.getenv("BUDGET_REQUEST_TIMEOUT_SECONDS", "60"))
+
+# Chat sessions are stored in the backend's Mongo chat_history collection when MONGODB_URL is set
+MONGODB_URL = os.getenv("MONGODB_URL")
+CHAT_MEMORY_OPTIONS = {
+    "recent_messages": int(os.getenv("CHAT_MEMORY_RECENT_MESSAGES", "6")),
+    "max_summary_words": int(os.getenv("CHAT_MEMORY_SUMMARY_WORDS", "150"))
+}
+# Without Mongo, sessions live in process memory: at most this many sessions and messages per session,
+# dropped after an idle period
+CHAT_MEMORY_MAX_SESSIONS = int(os.getenv("CHAT_MEMORY_MAX_SESSIONS", "1000"))
+CHAT_MEMORY_MAX_MESSAGES = int(os.getenv("CHAT_MEMORY_MAX_MESSAGES", "100"))
+CHAT_MEMORY_IDLE_SECONDS = float(os.getenv("CHAT_MEMORY_IDLE_SECONDS", "3600"))
+
+# Budget chat acts for the user in the X-User-ID header, trusted only with "Authorization: Bearer $RAG_SERVICE_TOKEN"
+# (sent by the backend). Without a token, RAG_SINGLE_USER_ID runs every request as that user (development only)
+RAG_SERVICE_TOKEN = os.getenv("RAG_SERVICE_TOKEN")
+RAG_SINGLE_USER_ID = int(os.environ["RAG_SINGLE_USER_ID"]) if os.getenv("RAG_SINGLE_USER_ID") else None
+
+# Batch budget chat: queries in flight per batch, and the largest accepted batch
+BUDGET_BATCH_CONCURRENCY = int(os.getenv("BUDGET_BATCH_CONCURRENCY", "8"))
+BUDGET_BATCH_MAX_ITEMS = int(os.getenv("BUDGET_BATCH_MAX_ITEMS", "500"))
+
+# Mark the shared budget chat system prompt for Anthropic prompt caching
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+
+# Budget chat routing: "structured" (one LLM call) or "sequential" (one call per routing step)
+BUDGET_ROUTER_MODE = os.getenv("BUDGET_ROUTER_MODE", "structured")
+
+# Local intent classifier tried before the LLM router (set INTENT_CLASSIFIER_ENABLED=false to disable)
+INTENT_CLASSIFIER_ENABLED = os.getenv("INTENT_CLASSIFIER_ENABLED", "true").lower() == "true"
+INTENT_CLASSIFIER_MODEL = os.getenv(
+    "INTENT_CLASSIFIER_MODEL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_model.json")
+)
+INTENT_CLASSIFIER_THRESHOLD = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.8"))
+
+# Parameterized SQL template cache (persisted across restarts)
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_PATH = os.getenv(
+    "SQL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "sql_templates.json")
+)
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "512"))
+
+# Allow-list and EXPLAIN cost check for generated SQL (limits are PostgreSQL planner estimates)
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() == "true"
+SQL_GUARD_MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "100000"))
+SQL_GUARD_MAX_ROWS = float(os.getenv("SQL_GUARD_MAX_ROWS", "100000"))
+SQL_GUARD_MAX_ATTEMPTS = int(os.getenv("SQL_GUARD_MAX_ATTEMPTS", "2"))
+
+# Receipt image preprocessing before upload (orientation, max edge, recompression)
+RECEIPT_PREPROCESS_ENABLED = os.getenv("RECEIPT_PREPROCESS_ENABLED", "true").lower() == "true"
+RECEIPT_IMAGE_OPTIONS = {
+    "max_edge": int(os.getenv("RECEIPT_IMAGE_MAX_EDGE", "1568")),
+    "image_format": os.getenv("RECEIPT_IMAGE_FORMAT", "JPEG"),
+    "quality": int(os.getenv("RECEIPT_IMAGE_QUALITY", "85")),
+    "grayscale": os.getenv("RECEIPT_IMAGE_GRAYSCALE", "false").lower() == "true",
+    "workers": int(os.getenv("RECEIPT_PREPROCESS_WORKERS", "2"))
+}
+
+# Local checks of extracted receipts (item sum vs total, date, category), repaired with a text-only prompt
+RECEIPT_VALIDATION_ENABLED = os.getenv("RECEIPT_VALIDATION_ENABLED", "true").lower() == "true"
+RECEIPT_TAX_TOLERANCE = float(os.getenv("RECEIPT_TAX_TOLERANCE", "0.15"))
+RECEIPT_MAX_REPAIRS = int(os.getenv("RECEIPT_MAX_REPAIRS", "1"))
+
+# Local parser for plaintext and emailed receipts; Claude is only called below the confidence threshold
+RECEIPT_TEXT_PARSER_ENABLED = os.getenv("RECEIPT_TEXT_PARSER_ENABLED", "true").lower() == "true"
+RECEIPT_TEXT_CONFIDENCE = float(os.getenv("RECEIPT_TEXT_CONFIDENCE", "0.8"))
+RECEIPT_TEXT_TEMPLATES = os.getenv("RECEIPT_TEXT_TEMPLATES")
+RECEIPT_TEXT_MAX_CHARS = int(os.getenv("RECEIPT_TEXT_MAX_CHARS", "50000"))
+
+# Content-addressed cache of receipt extractions (SQLite file, size-bounded LRU with a TTL)
+RECEIPT_CACHE_ENABLED = os.getenv("RECEIPT_CACHE_ENABLED", "true").lower() == "true"
+RECEIPT_CACHE_PATH = os.getenv(
+    "RECEIPT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "receipts.sqlite3")
+)
+RECEIPT_CACHE_OPTIONS = {
+    "max_bytes": int(float(os.getenv("RECEIPT_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    "ttl_seconds": float(os.getenv("RECEIPT_CACHE_TTL_HOURS", "720")) * 3600,
+    "perceptual": os.getenv("RECEIPT_CACHE_PERCEPTUAL", "false").lower() == "true",
+    "max_distance": int(os.getenv("RECEIPT_CACHE_MAX_DISTANCE", "4"))
+}
+
+# Largest accepted receipt upload
+RECEIPT_MAX_UPLOAD_BYTES = int(float(os.getenv("RECEIPT_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+
+# Multi-receipt batch uploads
+RECEIPT_BATCH_MAX_FILES = int(os.getenv("RECEIPT_BATCH_MAX_FILES", "50"))
+RECEIPT_BATCH_MAX_BYTES = int(float(os.getenv("RECEIPT_BATCH_MAX_MB", "200")) * 1024 * 1024)
+RECEIPT_BATCH_CONCURRENCY = int(os.getenv("RECEIPT_BATCH_CONCURRENCY", "4"))
+
+# Background receipt jobs (SQLite queue file, processed by workers inside each API process)
+RECEIPT_JOBS_PATH = os.getenv(
+    "RECEIPT_JOBS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "var", "receipt_jobs.sqlite3")
+)
+RECEIPT_JOB_OPTIONS = {
+    "concurrency": int(os.getenv("RECEIPT_JOB_CONCURRENCY", "4")),
+    "max_attempts": int(os.getenv("RECEIPT_JOB_MAX_ATTEMPTS", "3")),
+    "retry_delay": float(os.getenv("RECEIPT_JOB_RETRY_DELAY_SECONDS", "2")),
+    "lease_seconds": float(os.getenv("RECEIPT_JOB_LEASE_SECONDS", "300")),
+    "retention_seconds": float(os.getenv("RECEIPT_JOB_RETENTION_HOURS", "24")) * 3600
+}
+
+# Answer spending totals from spending_rollups (run spending_rollups.py install and backfill first)
+ROLLUP_FAST_PATH_ENABLED = os.getenv("ROLLUP_FAST_PATH_ENABLED", "false").lower() == "true"
+
 # Define expense categories
 class ExpenseCategory(str, Enum):
     ''' can be added more acc. to the user preferences'''
@@ -55,16 +199,255 @@ class ReceiptResponse(BaseModel):
     category: ExpenseCategory
     description: str
 
-# Budget chat request model
+# Receipt batch models
+# One line of the /process-receipt/batch NDJSON stream; exactly one of receipt and error is set
+class ReceiptBatchItem(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    status_code: int
+    receipt: Optional[ReceiptResponse] = None
+    error: Optional[str] = None
+
+# Receipt text request model
+class ReceiptTextRequest(BaseModel):
+    text: str
+
+# Receipt job models
+class ReceiptJobResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+class ReceiptJobStatus(BaseModel):
+    job_id: str
+    status: str
+    attempts: int
+    result: Optional[ReceiptResponse] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
+# Budget chat request model (the user comes from the authenticated request, see get_user_id)
 class BudgetChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None
 
 # Budget chat response model
 class BudgetChatResponse(BaseModel):
     response: str
 
+# Batch budget chat request model (concurrency is capped at BUDGET_BATCH_CONCURRENCY; every message acts for
+# the authenticated user)
+class BudgetChatBatchRequest(BaseModel):
+    messages: List[BudgetChatRequest]
+    concurrency: Optional[int] = None
+
+# Result for one batch item; exactly one of response and error is set
+class BudgetChatBatchItem(BaseModel):
+    index: int
+    response: Optional[str] = None
+    error: Optional[str] = None
+
+# Batch budget chat response model (results are in request order)
+class BudgetChatBatchResponse(BaseModel):
+    results: List[BudgetChatBatchItem]
+
+def build_intent_classifier() -> Optional[IntentClassifier]:
+    """Load the local intent classifier, falling back to keyword rules without a model file"""
+    if not INTENT_CLASSIFIER_ENABLED:
+        return None
+    if os.path.exists(INTENT_CLASSIFIER_MODEL):
+        return IntentClassifier.load(INTENT_CLASSIFIER_MODEL, threshold=INTENT_CLASSIFIER_THRESHOLD)
+    logger.warning(f"Intent model not found at {INTENT_CLASSIFIER_MODEL}, using keyword rules only")
+    return IntentClassifier(threshold=INTENT_CLASSIFIER_THRESHOLD)
+
+def build_sql_cache() -> Optional[SQLTemplateCache]:
+    """Create the SQL template cache if enabled"""
+    if not SQL_CACHE_ENABLED:
+        return None
+    return SQLTemplateCache(path=SQL_CACHE_PATH, max_entries=SQL_CACHE_MAX_ENTRIES)
+
+def build_sql_guard() -> Optional[SQLGuard]:
+    """Create the generated-SQL guard if enabled"""
+    if not SQL_GUARD_ENABLED:
+        return None
+    return SQLGuard(max_cost=SQL_GUARD_MAX_COST, max_rows=SQL_GUARD_MAX_ROWS)
+
+def build_image_preprocessor() -> Optional[ImagePreprocessor]:
+    """Create the receipt image preprocessor if enabled"""
+    if not RECEIPT_PREPROCESS_ENABLED:
+        return None
+    return ImagePreprocessor(**RECEIPT_IMAGE_OPTIONS)
+
+def build_receipt_validator() -> Optional[ReceiptValidator]:
+    """Create the local receipt validator if enabled"""
+    if not RECEIPT_VALIDATION_ENABLED:
+        return None
+    return ReceiptValidator([category.value for category in ExpenseCategory], tax_tolerance=RECEIPT_TAX_TOLERANCE)
+
+receipt_validator = build_receipt_validator()
+
+def is_valid_receipt(receipt_data: Dict[str, Any]) -> bool:
+    """Whether extracted receipt data is a complete ReceiptResponse (created_at is added per request)
+    that also passes the local checks, so extractions still failing them are not cached"""
+    try:
+        ReceiptResponse(**{**receipt_data, "created_at": ""})
+    except (ValidationError, TypeError):
+        return False
+    return receipt_validator is None or not receipt_validator.check(copy.deepcopy(receipt_data))
+
+def build_text_receipt_parser() -> Optional[TextReceiptParser]:
+    """Create the local text receipt parser if enabled, with merchant templates from
+    RECEIPT_TEXT_TEMPLATES (a JSON list, tried before the built-in ones) when set"""
+    if not RECEIPT_TEXT_PARSER_ENABLED:
+        return None
+    templates = DEFAULT_TEMPLATES
+    if RECEIPT_TEXT_TEMPLATES:
+        with open(RECEIPT_TEXT_TEMPLATES) as f:
+            templates = json.load(f) + DEFAULT_TEMPLATES
+    return TextReceiptParser([category.value for category in ExpenseCategory], templates=templates,
+                             validator=receipt_validator)
+
+def build_receipt_cache() -> Optional[ReceiptCache]:
+    """Create the receipt extraction cache if enabled"""
+    if not RECEIPT_CACHE_ENABLED:
+        return None
+    return ReceiptCache(RECEIPT_CACHE_PATH, validate=is_valid_receipt, **RECEIPT_CACHE_OPTIONS)
+
+def build_session_store():
+    """Create the chat session store: Mongo when configured, otherwise bounded process memory"""
+    if MONGODB_URL and AsyncIOMotorClient is not None:
+        return MongoSessionStore(MONGODB_URL)
+    if MONGODB_URL:
+        logger.warning("MONGODB_URL is set but motor is not installed, keeping chat sessions in memory")
+    return InMemorySessionStore(max_sessions=CHAT_MEMORY_MAX_SESSIONS, max_messages=CHAT_MEMORY_MAX_MESSAGES,
+                                idle_seconds=CHAT_MEMORY_IDLE_SECONDS)
+
+# Process-wide registry of shared processor instances (one per worker)
+registry = ServiceRegistry(
+    api_key=ANTHROPIC_API_KEY,
+    postgres_connection=POSTGRES_CONNECTION,
+    planner_options={
+        "router_mode": BUDGET_ROUTER_MODE,
+        "intent_classifier": build_intent_classifier(),
+        "sql_cache": build_sql_cache(),
+        "sql_guard": build_sql_guard(),
+        "max_sql_attempts": SQL_GUARD_MAX_ATTEMPTS,
+        "rollup_fast_path": ROLLUP_FAST_PATH_ENABLED,
+        "db_pool_options": DB_POOL_OPTIONS,
+        "max_result_rows": MAX_RESULT_ROWS,
+        "max_iterations": BUDGET_MAX_ITERATIONS,
+        "max_llm_calls": BUDGET_MAX_LLM_CALLS,
+        "request_timeout": BUDGET_REQUEST_TIMEOUT_SECONDS,
+        "session_store": build_session_store(),
+        "memory_options": CHAT_MEMORY_OPTIONS,
+        "prompt_caching": PROMPT_CACHE_ENABLED
+    },
+    receipt_options={
+        "preprocessor": build_image_preprocessor(),
+        "validator": receipt_validator,
+        "max_repairs": RECEIPT_MAX_REPAIRS,
+        "text_parser": build_text_receipt_parser(),
+        "text_confidence": RECEIPT_TEXT_CONFIDENCE
+    },
+    # The cache file is opened on first use (or by warm_up), not on import
+    receipt_cache_factory=build_receipt_cache
+)
+
+class IncompleteReceipt(Exception):
+    """The model's extraction is missing a required field"""
+
+async def extract_receipt(processor: ReceiptProcessor, upload: ReceiptUpload,
+                          request_id: Optional[str] = None,
+                          model_slots: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+    """
+    Extract receipt data from an image and check the required fields
+
+    Args:
+        processor: ReceiptProcessor instance
+        upload: The receipt image
+        request_id: Id the per-node breakdown is logged under
+        model_slots: Semaphore bounding concurrent model calls (for batches)
+
+    Returns:
+        Receipt data with created_at set
+
+    Raises:
+        IncompleteReceipt: If a required field is missing
+    """
+    return complete_receipt(await processor.aprocess_upload(upload, request_id, model_slots))
+
+def complete_receipt(receipt_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Stamp extracted receipt data and check the required fields
+
+    Args:
+        receipt_data: Data returned by the ReceiptProcessor
+
+    Returns:
+        Receipt data with created_at set
+
+    Raises:
+        IncompleteReceipt: If a required field is missing
+    """
+    # Add current timestamp
+    receipt_data["created_at"] = datetime.now().isoformat()
+
+    # Validate required fields
+    required_fields = ["merchant_name", "date", "items", "total", "category", "description"]
+    for field in required_fields:
+        if field not in receipt_data:
+            log_missing_field(field)
+            raise IncompleteReceipt(f"Missing required field: {field}")
+
+    # Log successful processing
+    log_processing_success(
+        receipt_data['merchant_name'],
+        receipt_data['total'],
+        receipt_data['category']
+    )
+    return receipt_data
+
+async def run_receipt_job(image_data: bytes, content_type: str, job_id: str) -> Dict[str, Any]:
+    """Job handler: extract a queued receipt with the shared processor"""
+    return await extract_receipt(registry.get_receipt_processor(), ReceiptUpload(image_data, content_type), job_id)
+
+def build_receipt_jobs() -> ReceiptJobQueue:
+    """Open the receipt job queue configured by the RECEIPT_JOB* settings"""
+    # An incomplete extraction is answered the same way on every attempt, so it is not retried
+    return ReceiptJobQueue(RECEIPT_JOBS_PATH, run_receipt_job, no_retry=(IncompleteReceipt,),
+                           **RECEIPT_JOB_OPTIONS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build and warm the shared processors and the job queue at startup, release them on shutdown"""
+    registry.warm_up()
+    app.state.registry = registry
+    receipt_jobs = build_receipt_jobs()
+    app.state.receipt_jobs = receipt_jobs
+    receipt_jobs.start()
+    try:
+        yield
+    finally:
+        # Jobs still running are put back in the queue for the next start
+        await receipt_jobs.stop()
+        receipt_jobs.close()
+        app.state.receipt_jobs = None
+        await registry.aclose()
+
 # Initialize FastAPI app
-app = FastAPI(title="QuipQuid: Budget Planner")
+app = FastAPI(title="QuipQuid: Budget Planner", lifespan=lifespan)
+
+def receipt_body_limit(path: str) -> Optional[int]:
+    """Request body limit for receipt endpoints, with room for the multipart boundaries and part headers"""
+    if not path.startswith("/process-receipt"):
+        return None
+    limit = RECEIPT_BATCH_MAX_BYTES if path == "/process-receipt/batch" else RECEIPT_MAX_UPLOAD_BYTES
+    return limit + 64 * 1024
+
+# Refuse oversized receipt uploads while the body arrives (Content-Length or counted chunks),
+# before the multipart body is spooled. Added before CORS so CORS wraps it and the 413 carries CORS headers
+app.add_middleware(UploadLimitMiddleware, limit_for=receipt_body_limit)
 
 # Configure CORS
 app.add_middleware(
@@ -75,31 +458,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Tag every request with an id (taken from X-Request-ID when the client sends one)
+# so per-node breakdowns in the logs can be matched to the response
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = set_request_id(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request_id(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # Dependencies to get processor instances
 def get_receipt_processor():
-    """Dependency that provides the ReceiptProcessor instance"""
-    return ReceiptProcessor(api_key=ANTHROPIC_API_KEY)
+    """Dependency that provides the shared ReceiptProcessor instance"""
+    start = time.perf_counter()
+    processor = registry.get_receipt_processor()
+    metrics.observe("dependency.receipt_processor.seconds", time.perf_counter() - start)
+    return processor
+
+user_resolver = UserResolver(RAG_SERVICE_TOKEN, RAG_SINGLE_USER_ID)
+
+def get_user_id(request: Request) -> int:
+    """Dependency that provides the id of the user the request acts for (see service_auth)"""
+    try:
+        return user_resolver.resolve(request.headers.get("Authorization"), request.headers.get(USER_HEADER))
+    except AuthRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+
+def get_receipt_jobs(request: Request) -> ReceiptJobQueue:
+    """Dependency that provides the receipt job queue opened by the lifespan"""
+    receipt_jobs = getattr(request.app.state, "receipt_jobs", None)
+    if receipt_jobs is None:
+        raise HTTPException(status_code=503, detail="The receipt job queue is not running")
+    return receipt_jobs
 
 def get_budget_planner():
-    """Dependency that provides the BudgetPlanner instance"""
-    return BudgetPlanner(
-        api_key=ANTHROPIC_API_KEY,
-        postgres_connection=POSTGRES_CONNECTION
-    )
+    """Dependency that provides the shared BudgetPlanner instance"""
+    start = time.perf_counter()
+    planner = registry.get_budget_planner()
+    metrics.observe("dependency.budget_planner.seconds", time.perf_counter() - start)
+    return planner
 
 
 # Endpoint for budget chat
 @app.post("/budget-chat", response_model=BudgetChatResponse)
 async def budget_chat(
     request: BudgetChatRequest,
-    planner: BudgetPlanner = Depends(get_budget_planner)
+    planner: BudgetPlanner = Depends(get_budget_planner),
+    user_id: int = Depends(get_user_id)
 ):
     """
     Process a budget-related chat message and generate a response
     
     Args:
-        request: Chat message from the user
+        request: Chat message from the user (with an optional session_id to continue a conversation)
         planner: BudgetPlanner instance (injected by FastAPI)
+        user_id: The authenticated user (injected by FastAPI)
         
     Returns:
         Response to the user's budget query
@@ -108,7 +525,8 @@ async def budget_chat(
         logger.info(f"Received budget chat: {request.message}")
         
         # Process the message
-        response = planner.process_query(request.message)
+        response = await planner.aprocess_query(request.message, user_id=user_id,
+                                                session_id=request.session_id)
         
         # Log successful processing
         logger.info("Budget chat processed successfully")
@@ -119,6 +537,76 @@ async def budget_chat(
         log_processing_error(str(e))
         raise HTTPException(status_code=500, detail=f"Error processing budget chat: {str(e)}")
 
+# Endpoint for batches of budget chat messages
+@app.post("/budget-chat/batch", response_model=BudgetChatBatchResponse)
+async def budget_chat_batch(
+    request: BudgetChatBatchRequest,
+    planner: BudgetPlanner = Depends(get_budget_planner),
+    user_id: int = Depends(get_user_id)
+):
+    """
+    Process a list of budget chat messages concurrently (messages continuing the
+    same session_id run in order, each seeing the turns before it)
+    
+    Args:
+        request: Messages to process and an optional concurrency limit
+        planner: BudgetPlanner instance (injected by FastAPI)
+        user_id: The authenticated user every message acts for (injected by FastAPI)
+        
+    Returns:
+        One result per message, in request order, with per-item errors
+    """
+    if len(request.messages) > BUDGET_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413,
+                            detail=f"Batch too large: {len(request.messages)} messages (max {BUDGET_BATCH_MAX_ITEMS})")
+    concurrency = BUDGET_BATCH_CONCURRENCY if request.concurrency is None \
+        else min(request.concurrency, BUDGET_BATCH_CONCURRENCY)
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    
+    logger.info(f"Received budget chat batch of {len(request.messages)} messages")
+    results = await planner.abatch_process_queries(
+        [(item.message, user_id, item.session_id) for item in request.messages],
+        concurrency=concurrency
+    )
+    return BudgetChatBatchResponse(
+        results=[BudgetChatBatchItem(index=index, **result) for index, result in enumerate(results)]
+    )
+
+# Endpoint for streaming budget chat (server-sent events)
+@app.post("/budget-chat/stream")
+async def budget_chat_stream(
+    request: BudgetChatRequest,
+    planner: BudgetPlanner = Depends(get_budget_planner),
+    user_id: int = Depends(get_user_id)
+):
+    """
+    Process a budget-related chat message and stream the response as server-sent events
+    
+    Emits a "node" event as each workflow step completes, "token" events while the
+    final response is generated, and a closing "done" (or "error") event.
+    
+    Args:
+        request: Chat message from the user
+        planner: BudgetPlanner instance (injected by FastAPI)
+        user_id: The authenticated user (injected by FastAPI)
+        
+    Returns:
+        text/event-stream response
+    """
+    logger.info(f"Received streaming budget chat: {request.message}")
+    
+    async def event_stream():
+        async for event in planner.astream_query(request.message, user_id=user_id,
+                                                 session_id=request.session_id):
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Endpoint to process receipt image
 @app.post("/process-receipt", response_model=ReceiptResponse)
 async def process_receipt_endpoint(
@@ -138,43 +626,235 @@ async def process_receipt_endpoint(
     Raises:
         HTTPException: If processing fails
     """
-    # Validate file
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    # Validate the file type and size while reading it in chunks, without loading it into memory
+    try:
+        upload = await read_upload(file, RECEIPT_MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
     
     try:
-        # Read the image file
-        image_data = await file.read()
-        
         # Log file information
-        log_receipt_processing(file.filename, len(image_data))
+        log_receipt_processing(file.filename, upload.size)
         
         # Process the receipt
-        receipt_data = processor.process_image(image_data, file.content_type)
-        
-        # Add current timestamp
-        receipt_data["created_at"] = datetime.now().isoformat()
-        
-        # Validate required fields
-        required_fields = ["merchant_name", "date", "items", "total", "category", "description"]
-        for field in required_fields:
-            if field not in receipt_data:
-                log_missing_field(field)
-                raise HTTPException(status_code=422, detail=f"Missing required field: {field}")
-        
-        # Log successful processing
-        log_processing_success(
-            receipt_data['merchant_name'], 
-            receipt_data['total'],
-            receipt_data['category']
-        )
+        return await extract_receipt(processor, upload)
+    except IncompleteReceipt as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        log_processing_error(str(e))
+        raise HTTPException(status_code=500, detail=f"Error processing receipt: {str(e)}")
+
+# Endpoint to process a plaintext or emailed receipt
+@app.post("/process-receipt/text", response_model=ReceiptResponse)
+async def process_receipt_text(
+    request: ReceiptTextRequest,
+    processor: ReceiptProcessor = Depends(get_receipt_processor)
+):
+    """
+    Extract structured data from receipt text (a pasted receipt or an e-receipt email, plain or HTML).
+    
+    The text is parsed locally with regular expressions and merchant templates; Claude is
+    only called when the parser is not confident in the result.
+    
+    Args:
+        request: The receipt text
+        processor: ReceiptProcessor instance (injected by FastAPI)
         
-        # Return the processed data
-        return receipt_data
+    Returns:
+        Structured receipt data, in the same shape as /process-receipt
+    
+    Raises:
+        HTTPException: If the text is empty or too long, or processing fails
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Receipt text is empty")
+    if len(request.text) > RECEIPT_TEXT_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"Receipt text exceeds {RECEIPT_TEXT_MAX_CHARS} characters")
+    
+    try:
+        logger.info(f"Processing text receipt ({len(request.text)} characters)")
+        return complete_receipt(await processor.aprocess_text(request.text))
+    except IncompleteReceipt as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         log_processing_error(str(e))
         raise HTTPException(status_code=500, detail=f"Error processing receipt: {str(e)}")
 
+# Endpoint to process a receipt image, streamed as server-sent events while the model writes it
+@app.post("/process-receipt/stream")
+async def process_receipt_stream(
+    file: UploadFile = File(...),
+    processor: ReceiptProcessor = Depends(get_receipt_processor)
+):
+    """
+    Process a receipt image and stream the extracted data as server-sent events.
+    
+    Emits a "field" event for each top-level field (merchant_name, date, ...) and an
+    "item" event for each item as soon as the model has written it, a "validation"
+    event if a local check fails and a repair is attempted, then a closing "done"
+    event with the complete receipt (or an "error" event).
+    
+    Args:
+        file: Uploaded receipt image file
+        processor: ReceiptProcessor instance (injected by FastAPI)
+        
+    Returns:
+        text/event-stream response
+    """
+    try:
+        upload = await read_upload(file, RECEIPT_MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    log_receipt_processing(file.filename, upload.size)
+    
+    async def event_stream():
+        async for event in processor.astream_upload(upload):
+            if event["event"] == "done":
+                try:
+                    receipt = ReceiptResponse(**complete_receipt(event["receipt"]))
+                    event = {"event": "done", "receipt": receipt.model_dump(mode="json")}
+                except IncompleteReceipt as e:
+                    event = {"event": "error", "detail": str(e)}
+                except ValidationError as e:
+                    log_processing_error(str(e))
+                    event = {"event": "error", "detail": f"Error processing receipt: {str(e)}"}
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Endpoint to process many receipts in one request, streamed back as NDJSON
+@app.post("/process-receipt/batch")
+async def process_receipt_batch(
+    files: List[UploadFile] = File(...),
+    concurrency: Optional[int] = None,
+    processor: ReceiptProcessor = Depends(get_receipt_processor)
+):
+    """
+    Process a batch of receipt images concurrently.
+    
+    Every receipt is validated and preprocessed right away; at most concurrency
+    model calls run at once. One JSON line per receipt is streamed back as soon
+    as it finishes, so lines arrive in completion order and carry the index of
+    the file in the request. A receipt that fails gets an error line with the
+    status code /process-receipt would have returned; the rest of the batch
+    carries on.
+    
+    Args:
+        files: Uploaded receipt image files
+        concurrency: Maximum concurrent model calls (capped at RECEIPT_BATCH_CONCURRENCY)
+        processor: ReceiptProcessor instance (injected by FastAPI)
+        
+    Returns:
+        application/x-ndjson stream of ReceiptBatchItem lines
+    """
+    if len(files) > RECEIPT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413,
+                            detail=f"Batch too large: {len(files)} files (max {RECEIPT_BATCH_MAX_FILES})")
+    concurrency = RECEIPT_BATCH_CONCURRENCY if concurrency is None else min(concurrency, RECEIPT_BATCH_CONCURRENCY)
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    
+    batch_id = current_request_id() or uuid.uuid4().hex
+    model_slots = asyncio.Semaphore(concurrency)
+    logger.info(f"Received receipt batch of {len(files)} files (concurrency {concurrency})")
+    
+    async def run(index: int, file: UploadFile) -> ReceiptBatchItem:
+        try:
+            upload = await read_upload(file, RECEIPT_MAX_UPLOAD_BYTES)
+            log_receipt_processing(file.filename, upload.size)
+            receipt_data = await extract_receipt(processor, upload, f"{batch_id}-{index}", model_slots)
+            return ReceiptBatchItem(index=index, filename=file.filename, status_code=200, receipt=receipt_data)
+        except UploadRejected as e:
+            status_code, error = e.status_code, e.reason
+        except IncompleteReceipt as e:
+            status_code, error = 422, str(e)
+        except Exception as e:
+            log_processing_error(f"Error processing batch receipt {index}: {str(e)}")
+            status_code, error = 500, f"Error processing receipt: {str(e)}"
+        metrics.increment("receipt.batch.errors")
+        return ReceiptBatchItem(index=index, filename=file.filename, status_code=status_code, error=error)
+    
+    async def result_stream():
+        tasks = [asyncio.create_task(run(index, file)) for index, file in enumerate(files)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                yield item.model_dump_json() + "\n"
+        finally:
+            # The client went away: stop the receipts still waiting for the model
+            for task in tasks:
+                task.cancel()
+        metrics.increment("receipt.batch.items", len(files))
+    
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Endpoint to queue a receipt for background processing
+@app.post("/process-receipt/jobs", response_model=ReceiptJobResponse, status_code=202)
+async def submit_receipt_job(file: UploadFile = File(...),
+                             receipt_jobs: ReceiptJobQueue = Depends(get_receipt_jobs)):
+    """
+    Queue a receipt image and return a job id without waiting for the model.
+    
+    Args:
+        file: Uploaded receipt image file
+        receipt_jobs: Shared receipt job queue
+        
+    Returns:
+        The job id and the URL to poll for its status
+    """
+    try:
+        upload = await read_upload(file, RECEIPT_MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    log_receipt_processing(file.filename, upload.size)
+    # The spooled upload is copied into the queue in chunks, not loaded into memory
+    job_id = await asyncio.to_thread(receipt_jobs.submit, upload.open(), upload.content_type, upload.size)
+    return {"job_id": job_id, "status": "queued", "status_url": f"/process-receipt/jobs/{job_id}"}
+
+# Endpoint to poll a queued receipt
+@app.get("/process-receipt/jobs/{job_id}", response_model=ReceiptJobStatus)
+async def get_receipt_job(job_id: str, receipt_jobs: ReceiptJobQueue = Depends(get_receipt_jobs)):
+    """
+    Return the status of a receipt job, with the receipt data once it has succeeded.
+    
+    Args:
+        job_id: Id returned by POST /process-receipt/jobs
+        receipt_jobs: Shared receipt job queue
+    """
+    job = await asyncio.to_thread(receipt_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown receipt job: {job_id}")
+    job["created_at"] = datetime.fromtimestamp(job["created_at"]).isoformat()
+    job["updated_at"] = datetime.fromtimestamp(job["updated_at"]).isoformat()
+    return job
+
+# Endpoint exposing in-process metrics
+@app.get("/metrics")
+async def get_metrics(request: Request, format: str = "json"):
+    """
+    Return counters and histograms collected by this worker
+    
+    Args:
+        format: "json" (default) or "prometheus" for the text exposition format
+    """
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus())
+    snapshot = metrics.snapshot()
+    if registry.receipt_cache is not None:
+        snapshot["receipt_cache"] = registry.receipt_cache.stats()
+    receipt_jobs = getattr(request.app.state, "receipt_jobs", None)
+    if receipt_jobs is not None:
+        snapshot["receipt_jobs"] = receipt_jobs.stats()
+    return snapshot
+
 # Create a simple index route
 @app.get("/")
 async def index():
@@ -190,10 +870,50 @@ async def index():
                 "method": "POST",
                 "description": "Process a receipt image and extract structured data"
             },
+            {
+                "path": "/process-receipt/text",
+                "method": "POST",
+                "description": "Extract structured data from a plaintext or emailed receipt, parsed locally when possible"
+            },
+            {
+                "path": "/process-receipt/stream",
+                "method": "POST",
+                "description": "Process a receipt image, streaming each field and item as server-sent events"
+            },
+            {
+                "path": "/process-receipt/batch",
+                "method": "POST",
+                "description": "Process many receipt images concurrently, streamed back as NDJSON in completion order"
+            },
+            {
+                "path": "/process-receipt/jobs",
+                "method": "POST",
+                "description": "Queue a receipt image for background processing and return a job id"
+            },
+            {
+                "path": "/process-receipt/jobs/{job_id}",
+                "method": "GET",
+                "description": "Status of a queued receipt, with the extracted data once it has succeeded"
+            },
             {
                 "path": "/budget-chat",
                 "method": "POST", 
                 "description": "Chat with the budget planning assistant"
+            },
+            {
+                "path": "/budget-chat/batch",
+                "method": "POST",
+                "description": "Process a list of budget chat messages concurrently"
+            },
+            {
+                "path": "/budget-chat/stream",
+                "method": "POST",
+                "description": "Chat with the budget planning assistant, streamed as server-sent events"
+            },
+            {
+                "path": "/metrics",
+                "method": "GET",
+                "description": "In-process counters and histograms for this worker (?format=prometheus for text exposition)"
             }
         ]
     }
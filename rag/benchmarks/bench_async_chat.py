@@ -0,0 +1,49 @@
+"""
+Concurrency benchmark: blocking process_query vs. async aprocess_query.
+
+Runs N budget chats in parallel on one event loop against a fake LLM with
+artificial latency. The blocking variant mimics the old endpoint (sync
+process_query called from an async handler), which serializes every chat.
+
+Usage:
+    python benchmarks/bench_async_chat.py [parallel_chats] [llm_latency_seconds]
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from budget_planner import BudgetPlanner
+from fake_llm import FakeChatModel
+
+PROMPT = "how much did I spend on each category?"
+
+async def run_blocking(planner, n):
+    async def chat():
+        return planner.process_query(PROMPT)
+    return await asyncio.gather(*(chat() for _ in range(n)))
+
+async def run_async(planner, n):
+    return await asyncio.gather(*(planner.aprocess_query(PROMPT) for _ in range(n)))
+
+def _report(label, n, elapsed):
+    print(f"{label:<28} {n} chats in {elapsed:7.3f} s  -> {n / elapsed:8.2f} chats/s")
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    planner = BudgetPlanner(api_key="benchmark-dummy-key", llm=FakeChatModel(latency=latency),
+                            router_mode="structured")
+
+    print(f"Parallel chats: {n}, fake LLM latency: {latency * 1000:.0f} ms per call")
+    for label, runner in (("blocking process_query", run_blocking), ("async aprocess_query", run_async)):
+        start = time.perf_counter()
+        responses = asyncio.run(runner(planner, n))
+        _report(label, n, time.perf_counter() - start)
+        assert all(r == responses[0] for r in responses)
+
+if __name__ == "__main__":
+    main()
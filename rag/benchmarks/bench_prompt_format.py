@@ -0,0 +1,56 @@
+"""
+Prompt size benchmark: str(db_data) vs. the compact tabular encoding.
+
+Builds synthetic expense rows shaped like real query results and reports
+characters and estimated tokens for both encodings at several result sizes.
+
+Usage:
+    python benchmarks/bench_prompt_format.py
+"""
+import os
+import sys
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_format import format_db_data, estimate_tokens
+from result_summary import ResultAccumulator
+
+CATEGORIES = ["food", "transportation", "shopping", "utilities", "entertainment"]
+MERCHANTS = ["Chipotle", "Target", "Uber", "Whole Foods", "Netflix"]
+
+def make_rows(n):
+    random.seed(42)
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": i,
+            "user_id": 1,
+            "amount": round(random.uniform(1, 200), 2),
+            "description": f"Purchase {i}",
+            "category": random.choice(CATEGORIES),
+            "merchant": random.choice(MERCHANTS),
+            "date": now - timedelta(days=random.randint(0, 90), seconds=random.randint(0, 86400)),
+            "created_at": now,
+            "balance": Decimal(random.randint(0, 100000)) / 100,
+        }
+        for i in range(n)
+    ]
+
+def main():
+    print(f"{'rows':>6} {'str() chars':>12} {'str() tokens':>13} {'compact chars':>14} {'compact tokens':>15} {'saved':>7}")
+    for n in (10, 50, 200, 1000):
+        rows = make_rows(n)
+        accumulator = ResultAccumulator(max_rows=200)
+        for row in rows:
+            accumulator.add(row)
+        before = str(accumulator.result())
+        after = format_db_data(accumulator.result())
+        before_tokens, after_tokens = estimate_tokens(before), estimate_tokens(after)
+        print(f"{n:>6} {len(before):>12} {before_tokens:>13} {len(after):>14} {after_tokens:>15} "
+              f"{1 - after_tokens / before_tokens:>6.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark receipt image preprocessing.
+
+Runs ReceiptProcessor on synthetic phone photos (12 MP, noisy JPEGs, one
+with a rotated EXIF orientation) and on the sample receipts in
+test-receipts/, with and without the ImagePreprocessor. For each image and
+configuration it reports the bytes sent to the model, the estimated image
+tokens (Anthropic bills about width * height / 750 tokens after fitting the
+image within 1568 px and 1.15 megapixels), the preprocessing time and the
+end-to-end latency, using a FakeChatModel that simulates upload bandwidth
+and model latency. A final run sends concurrent aprocess_image calls and
+records the longest event loop stall to show that preprocessing stays off
+the loop.
+
+Usage:
+    python benchmarks/bench_receipt_images.py [--iterations 5] [--upload-mbps 20]
+        [--latency 1.0] [--max-edge 1568] [--quality 85] [--json results.json]
+"""
+import io
+import os
+import base64
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Any, Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+
+from receipt_processor import ReceiptProcessor
+from image_preprocess import ImagePreprocessor
+from fake_llm import FakeChatModel, RECEIPT_RULES
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-receipts")
+
+def phone_photo(width: int, height: int, orientation: int = 1, seed: int = 0) -> bytes:
+    """A receipt-like photo: printed lines on paper over a noisy background, saved like a phone camera would"""
+    noise = Image.effect_noise((width, height), 40 + seed).convert("RGB")
+    image = Image.blend(Image.new("RGB", (width, height), (120, 110, 95)), noise, 0.35)
+    draw = ImageDraw.Draw(image)
+    left, top = width // 4, height // 10
+    draw.rectangle((left, top, width - left, height - top), fill=(240, 238, 230))
+    for line in range(40):
+        y = top + 60 + line * (height - 2 * top - 120) // 40
+        draw.rectangle((left + 80, y, left + 80 + (line * 97) % (width // 3) + 200, y + 18), fill=(30, 30, 30))
+    output = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    image.save(output, format="JPEG", quality=95, exif=exif.tobytes())
+    return output.getvalue()
+
+def load_images() -> List[Tuple[str, bytes, str]]:
+    images = [
+        ("photo-4032x3024", phone_photo(4032, 3024), "image/jpeg"),
+        ("photo-rotated-exif6", phone_photo(4032, 3024, orientation=6, seed=5), "image/jpeg"),
+    ]
+    if os.path.isdir(SAMPLES_DIR):
+        for name in sorted(os.listdir(SAMPLES_DIR)):
+            with open(os.path.join(SAMPLES_DIR, name), "rb") as f:
+                images.append((name, f.read(), "image/png" if name.endswith(".png") else "image/jpeg"))
+    return images
+
+def image_tokens(data: bytes) -> int:
+    """Anthropic's image token estimate after its own downscaling"""
+    width, height = Image.open(io.BytesIO(data)).size
+    scale = min(1.0, 1568 / max(width, height), (1_150_000 / (width * height)) ** 0.5)
+    return int(width * scale * height * scale / 750)
+
+# Source block of the last image sent to RecordingModel
+LAST_IMAGE: Dict[str, Any] = {}
+
+class RecordingModel(FakeChatModel):
+    """FakeChatModel that remembers the last image it was sent"""
+
+    def _delay(self, messages) -> float:
+        for block in messages[-1].content:
+            if isinstance(block, dict) and block.get("type") == "image":
+                LAST_IMAGE.update(block["source"])
+        return super()._delay(messages)
+
+def run_config(name: str, image: bytes, content_type: str, preprocessor, args) -> Dict[str, Any]:
+    llm = RecordingModel(rules=RECEIPT_RULES, latency=args.latency,
+                         upload_bytes_per_second=args.upload_mbps * 1_000_000 / 8)
+    processor = ReceiptProcessor(api_key="benchmark-dummy-key", model=llm, preprocessor=preprocessor)
+    samples, preprocess = [], []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        if preprocessor is not None:
+            preprocessor.preprocess(image, content_type)
+        preprocess.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        processor.process_image(image, content_type)
+        samples.append(time.perf_counter() - start)
+    sent = LAST_IMAGE["data"]
+    return {
+        "image": name,
+        "config": "preprocessed" if preprocessor is not None else "original",
+        "upload_bytes": len(image),
+        "sent_bytes": len(sent),
+        "image_tokens": image_tokens(base64.b64decode(sent)),
+        "preprocess_ms": sorted(preprocess)[len(preprocess) // 2] * 1000 if preprocessor is not None else 0.0,
+        "p50_ms": sorted(samples)[len(samples) // 2] * 1000,
+    }
+
+async def max_loop_stall(images: List[Tuple[str, bytes, str]], preprocessor, concurrency: int) -> float:
+    """Longest event loop stall (ms) while concurrent aprocess_image calls run"""
+    llm = FakeChatModel(rules=RECEIPT_RULES)
+    processor = ReceiptProcessor(api_key="benchmark-dummy-key", model=llm, preprocessor=preprocessor)
+    stall, done = 0.0, False
+
+    async def ticker():
+        nonlocal stall
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stall = max(stall, time.perf_counter() - start - 0.005)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.gather(*(processor.aprocess_image(data, content_type)
+                           for _ in range(concurrency) for _, data, content_type in images[:2]))
+    done = True
+    await tick
+    return stall * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=5, help="Runs per image and configuration")
+    parser.add_argument("--upload-mbps", type=float, default=20.0, help="Simulated upload bandwidth in Mbit/s")
+    parser.add_argument("--latency", type=float, default=1.0, help="Simulated model latency in seconds")
+    parser.add_argument("--max-edge", type=int, default=1568)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    parser.add_argument("--grayscale", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent uploads for the event loop check")
+    parser.add_argument("--json", default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    preprocessor = ImagePreprocessor(max_edge=args.max_edge, image_format=args.format, quality=args.quality,
+                                     grayscale=args.grayscale)
+    images = load_images()
+    results = []
+    for name, data, content_type in images:
+        for config in (None, preprocessor):
+            results.append(run_config(name, data, content_type, config, args))
+
+    print(f"Upload {args.upload_mbps:g} Mbit/s, model latency {args.latency * 1000:.0f} ms, "
+          f"max edge {args.max_edge}, {args.format} q{args.quality}" + (", grayscale" if args.grayscale else ""))
+    print(f"{'image':<24} {'config':<13} {'upload KB':>10} {'sent KB':>9} {'img tokens':>11} "
+          f"{'prep ms':>8} {'p50 ms':>9}")
+    for r in results:
+        print(f"{r['image']:<24} {r['config']:<13} {r['upload_bytes'] / 1024:10.0f} {r['sent_bytes'] / 1024:9.0f} "
+              f"{r['image_tokens']:11d} {r['preprocess_ms']:8.1f} {r['p50_ms']:9.1f}")
+
+    stalls = {"original": asyncio.run(max_loop_stall(images, None, args.concurrency)),
+              "preprocessed": asyncio.run(max_loop_stall(images, preprocessor, args.concurrency))}
+    print(f"Longest event loop stall with {args.concurrency * 2} concurrent uploads: "
+          + ", ".join(f"{config} {ms:.1f} ms" for config, ms in stalls.items()))
+    preprocessor.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results, "loop_stall_ms": stalls}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
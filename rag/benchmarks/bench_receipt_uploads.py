@@ -0,0 +1,176 @@
+"""
+Benchmark peak memory of receipt upload intake.
+
+Starts a server in a subprocess for each intake path and sends concurrent
+10 MB receipt photos to it. The "buffered" path is the previous endpoint:
+file.read() loads the whole upload, and base64.b64encode(...).decode()
+builds the model payload next to it, so the raw upload, the base64 bytes
+and the base64 string are all alive at once. The "streaming" path uses
+read_upload and ReceiptProcessor.aprocess_upload: the upload stays in
+Starlette's spooled temporary file, it is validated in chunks and, when sent
+unchanged, streamed into a single preallocated base64 buffer. Both use a
+FakeChatModel with a fixed latency so all requests are in flight together.
+
+The server's peak RSS is reset (/proc/<pid>/clear_refs) once it is warm,
+and the growth in VmHWM during the burst is divided by the number of
+requests. The real Anthropic client also serializes the request body, which
+adds the same amount to both paths and is not included here.
+
+Usage:
+    python benchmarks/bench_receipt_uploads.py [--requests 20] [--size-mb 10] [--latency 2]
+        [--preprocess] [--json results.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import random
+import asyncio
+import logging
+import argparse
+import subprocess
+from typing import Any, Dict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ("buffered", "streaming")
+
+def receipt_photo(size_bytes: int) -> bytes:
+    """A noisy JPEG of about size_bytes (noise does not compress, so the size tracks the pixel count)"""
+    from PIL import Image
+    rng = random.Random(0)
+    pixels = size_bytes
+    for _ in range(3):
+        width = int((pixels / 0.75) ** 0.5)
+        height = int(width * 0.75)
+        image = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=92)
+        pixels = int(pixels * size_bytes / output.tell())
+    return output.getvalue()
+
+def build_app(mode: str, args):
+    """Server app with one receipt endpoint using the given intake path"""
+    from fastapi import FastAPI, File, UploadFile
+    from receipt_processor import ReceiptProcessor
+    from receipt_upload import ReceiptUpload, read_upload
+    from image_preprocess import ImagePreprocessor
+    from fake_llm import FakeChatModel, RECEIPT_RULES
+
+    class BufferedProcessor(ReceiptProcessor):
+        """ReceiptProcessor building the payload the way the previous intake path did"""
+
+        def _initial_state(self, image: ReceiptUpload) -> Dict[str, Any]:
+            state = super()._initial_state(ReceiptUpload(b"", image.content_type))
+            state["messages"][0].content[0]["source"]["data"] = base64.b64encode(image.read()).decode("utf-8")
+            return state
+
+    processor_class = BufferedProcessor if mode == "buffered" else ReceiptProcessor
+    processor = processor_class(api_key="benchmark-dummy-key",
+                                model=FakeChatModel(rules=RECEIPT_RULES, latency=args.latency),
+                                preprocessor=ImagePreprocessor() if args.preprocess else None)
+    app = FastAPI()
+
+    @app.post("/process-receipt")
+    async def process_receipt(file: UploadFile = File(...)):
+        if mode == "buffered":
+            image_data = await file.read()
+            return await processor.aprocess_image(image_data, file.content_type)
+        upload = await read_upload(file, 64 * 1024 * 1024)
+        return await processor.aprocess_upload(upload)
+
+    @app.get("/ready")
+    async def ready():
+        return {"pid": os.getpid()}
+
+    return app
+
+def serve(mode: str, args) -> None:
+    import uvicorn
+    logging.disable(logging.INFO)
+    uvicorn.run(build_app(mode, args), host="127.0.0.1", port=args.port, log_level="warning")
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    with open(f"/proc/{pid}/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {key: int(fields[key].split()[0]) for key in ("VmRSS", "VmHWM")}
+
+async def burst(args, image: bytes) -> float:
+    import httpx
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=120) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post("/process-receipt", files={"file": ("receipt.jpg", image, "image/jpeg")})
+            for _ in range(args.requests)))
+        elapsed = time.perf_counter() - start
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        raise RuntimeError(f"{len(failed)} requests failed: {failed[:5]}")
+    return elapsed
+
+def run_mode(mode: str, args, image: bytes) -> Dict[str, Any]:
+    import httpx
+    command = [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(args.port),
+               "--latency", str(args.latency)] + (["--preprocess"] if args.preprocess else [])
+    server = subprocess.Popen(command)
+    try:
+        for _ in range(200):
+            try:
+                pid = httpx.get(f"http://127.0.0.1:{args.port}/ready").json()["pid"]
+                break
+            except httpx.HTTPError:
+                time.sleep(0.05)
+        else:
+            raise RuntimeError("Server did not start")
+        # Warm up with one request so imports and pools are not counted, then reset the peak
+        asyncio.run(burst(argparse.Namespace(**{**vars(args), "requests": 1}), image))
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        before = memory_kb(pid)
+        elapsed = asyncio.run(burst(args, image))
+        after = memory_kb(pid)
+    finally:
+        server.terminate()
+        server.wait()
+    growth_mb = (after["VmHWM"] - before["VmRSS"]) / 1024
+    return {
+        "mode": mode,
+        "rss_before_mb": before["VmRSS"] / 1024,
+        "peak_rss_mb": after["VmHWM"] / 1024,
+        "peak_growth_mb": growth_mb,
+        "per_request_mb": growth_mb / args.requests,
+        "seconds": elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20, help="Concurrent uploads")
+    parser.add_argument("--size-mb", type=float, default=10.0, help="Upload size in MB")
+    parser.add_argument("--latency", type=float, default=2.0, help="Simulated model latency in seconds")
+    parser.add_argument("--preprocess", action="store_true", help="Downscale images with ImagePreprocessor")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--json", default=None, help="Write results to this file")
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args)
+        return
+
+    image = receipt_photo(int(args.size_mb * 1024 * 1024))
+    results = [run_mode(mode, args, image) for mode in MODES]
+    print(f"{args.requests} concurrent uploads of {len(image) / 1024 / 1024:.1f} MB, model latency "
+          f"{args.latency:g} s, preprocessing {'on' if args.preprocess else 'off'}")
+    print(f"{'mode':<10} {'RSS before MB':>14} {'peak RSS MB':>12} {'growth MB':>10} {'per request MB':>15} {'seconds':>8}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['rss_before_mb']:14.1f} {r['peak_rss_mb']:12.1f} {r['peak_growth_mb']:10.1f} "
+              f"{r['per_request_mb']:15.1f} {r['seconds']:8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "upload_bytes": len(image), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
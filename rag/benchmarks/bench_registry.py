@@ -0,0 +1,58 @@
+"""
+Microbenchmark: per-request construction vs. the shared ServiceRegistry.
+
+Compares building a BudgetPlanner/ReceiptProcessor on every request (the old
+dependency behaviour) with fetching the instances from a warmed registry.
+No network calls are made; a dummy API key is enough to build the clients.
+
+Usage:
+    python benchmarks/bench_registry.py [iterations]
+"""
+import os
+import sys
+import time
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from budget_planner import BudgetPlanner
+from receipt_processor import ReceiptProcessor
+from registry import ServiceRegistry
+
+API_KEY = "benchmark-dummy-key"
+
+def _measure(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def _report(label, samples):
+    samples_ms = sorted(s * 1000 for s in samples)
+    p95 = samples_ms[int(len(samples_ms) * 0.95) - 1]
+    print(f"{label:<40} mean={statistics.mean(samples_ms):9.4f} ms  p95={p95:9.4f} ms")
+    return statistics.mean(samples_ms)
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    def per_request():
+        BudgetPlanner(api_key=API_KEY)
+        ReceiptProcessor(api_key=API_KEY)
+
+    registry = ServiceRegistry(api_key=API_KEY)
+    registry.warm_up()
+
+    def shared():
+        registry.get_budget_planner()
+        registry.get_receipt_processor()
+
+    print(f"Iterations: {iterations}")
+    before = _report("per-request construction", _measure(per_request, iterations))
+    after = _report("shared registry lookup", _measure(shared, iterations))
+    print(f"Saved per request: {before - after:.4f} ms ({before / max(after, 1e-9):.0f}x faster)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark the local parser for plaintext and emailed receipts.
+
+Every fixture in benchmarks/fixtures/text_receipts.jsonl is parsed with
+TextReceiptParser and checked against its expected merchant, date, total,
+item count and category, and against whether it should be answered locally
+("local": true) or sent to the model. The suite then reports throughput in
+receipts per second of:
+
+- the parser alone, sequentially in one thread
+- ReceiptProcessor.aprocess_text with the parser, where only low-confidence
+  receipts reach the FakeChatModel
+- ReceiptProcessor.aprocess_text without the parser, where every receipt goes
+  to the model (the previous way to extract a text receipt)
+
+Fixture lines look like workflows.jsonl:
+    {"fixture_id": ..., "workflow": "receipt_text", "title": ..., "text": ...,
+     "expect": {"local": ..., "merchant_name": ..., "date": ..., "total": ...,
+                "items": <count>, "category": ...},
+     "responses": [[needle, reply], ...]}
+
+Usage:
+    python benchmarks/bench_text_receipts.py [--iterations 200] [--concurrency 10]
+        [--latency 1.0] [--threshold 0.8] [--json results.json]
+
+Exits non-zero when a fixture misses an expected field or is answered by
+the wrong path.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from receipt_processor import ReceiptProcessor
+from receipt_validation import ReceiptValidator
+from text_receipts import TextReceiptParser
+from fake_llm import FakeChatModel, RECEIPT_RULES
+from metrics import metrics
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "text_receipts.jsonl")
+
+CATEGORIES = ["food", "transportation", "housing", "utilities", "entertainment", "healthcare", "shopping",
+              "education", "personal", "savings", "investments", "other"]
+
+# Fixture dates are checked against this day, so the corpus does not age out of the validator's range
+REFERENCE_DATE = date(2026, 10, 18)
+
+def load_fixtures(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def build_processor(fixtures: List[Dict[str, Any]], parser: Optional[TextReceiptParser], args) -> ReceiptProcessor:
+    """ReceiptProcessor answering fallbacks from the fixtures' scripted responses"""
+    rules = [tuple(rule) for fixture in fixtures for rule in fixture.get("responses", [])]
+    model = FakeChatModel(rules=rules, default_response=RECEIPT_RULES[0][1], latency=args.latency)
+    return ReceiptProcessor(api_key="benchmark-dummy-key", model=model,
+                            validator=ReceiptValidator(CATEGORIES),
+                            text_parser=parser, text_confidence=args.threshold)
+
+def check_fixture(fixture: Dict[str, Any], parser: TextReceiptParser, threshold: float) -> List[str]:
+    """Differences between the local parse and the fixture's expectations"""
+    expect = fixture["expect"]
+    parsed = parser.parse(fixture["text"], today=REFERENCE_DATE)
+    local = parsed.confidence >= threshold
+    if local != expect["local"]:
+        return [f"answered {'locally' if local else 'by the model'} at confidence {parsed.confidence:.2f}"]
+    if not local:
+        return []
+    got = {**parsed.data, "items": len(parsed.data["items"])}
+    return [f"{field} {got[field]!r} != {expect[field]!r}"
+            for field in ("merchant_name", "date", "total", "items", "category") if got[field] != expect[field]]
+
+def parser_throughput(parser: TextReceiptParser, fixtures: List[Dict[str, Any]], iterations: int) -> float:
+    texts = [fixture["text"] for fixture in fixtures]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            parser.parse(text)
+    return iterations * len(texts) / (time.perf_counter() - start)
+
+def processor_throughput(processor: ReceiptProcessor, fixtures: List[Dict[str, Any]], n: int,
+                         concurrency: int) -> Dict[str, float]:
+    texts = [fixtures[i % len(fixtures)]["text"] for i in range(n)]
+    metrics.reset()
+
+    async def run_all():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one(text: str):
+            async with slots:
+                await processor.aprocess_text(text)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(text) for text in texts))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run_all())
+    counters = metrics.snapshot()["counters"]
+    return {
+        "receipts_per_second": n / elapsed,
+        "model_calls": counters.get("receipt.text.llm_fallback", 0),
+        "local": counters.get("receipt.text.local", 0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--iterations", type=int, default=200, help="Passes over the corpus for the parser alone")
+    parser.add_argument("--requests", type=int, default=200, help="Receipts sent through the processor per mode")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=1.0, help="Simulated model latency in seconds")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Lowest confidence answered locally")
+    parser.add_argument("--json", default=None, help="Write results to this file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    fixtures = load_fixtures(args.fixtures)
+    text_parser = TextReceiptParser(CATEGORIES, validator=ReceiptValidator(CATEGORIES))
+    failures = {fixture["fixture_id"]: check_fixture(fixture, text_parser, args.threshold) for fixture in fixtures}
+    print(f"{'fixture':<28} {'expected path':<14} result")
+    for fixture in fixtures:
+        problems = failures[fixture["fixture_id"]]
+        path = "local" if fixture["expect"]["local"] else "model"
+        print(f"{fixture['fixture_id']:<28} {path:<14} {'ok' if not problems else '; '.join(problems)}")
+
+    results = {
+        "parser_receipts_per_second": parser_throughput(text_parser, fixtures, args.iterations),
+        "with_parser": processor_throughput(build_processor(fixtures, text_parser, args), fixtures,
+                                            args.requests, args.concurrency),
+        "model_only": processor_throughput(build_processor(fixtures, None, args), fixtures,
+                                           args.requests, args.concurrency),
+    }
+    print()
+    print(f"Parser alone: {results['parser_receipts_per_second']:.0f} receipts/s")
+    print(f"Fake LLM latency: {args.latency * 1000:.0f} ms, concurrency {args.concurrency}, {args.requests} receipts")
+    print(f"{'mode':<12} {'receipts/s':>11} {'model calls':>12} {'local':>6}")
+    for mode in ("with_parser", "model_only"):
+        r = results[mode]
+        print(f"{mode:<12} {r['receipts_per_second']:11.1f} {r['model_calls']:12d} {r['local']:6d}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "failures": failures, "results": results}, f, indent=2)
+    if any(failures.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
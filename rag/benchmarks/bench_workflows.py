@@ -0,0 +1,168 @@
+"""
+Offline benchmark suite for BudgetPlanner and ReceiptProcessor.
+
+Every fixture in benchmarks/fixtures/workflows.jsonl is replayed against the
+real LangGraph workflows with a deterministic FakeChatModel, so graph
+overhead, serialization and DB time can be measured without network access.
+Budget chats run against an in-memory SQLite stand-in unless a PostgreSQL
+DSN is given. For each fixture the suite reports p50/p95/p99 latency of
+sequential runs, throughput of concurrent runs, and how the mean request
+time splits between node work, DB queries and graph overhead (taken from
+the per-node histograms in metrics).
+
+Fixture lines look like requests.jsonl:
+    {"fixture_id": ..., "workflow": "budget_chat" | "receipt", "title": ...,
+     "prompt": ..., "responses": [[needle, reply], ...], "router_mode": ...,
+     "image_kb": ..., "expect": ...}
+
+Usage:
+    python benchmarks/bench_workflows.py [--iterations 50] [--concurrency 10]
+        [--latency 0.0] [--postgres DSN] [--json results.json] [--max-p95-ms MS]
+
+Exits non-zero when a response misses its "expect" text or, with
+--max-p95-ms, when any fixture's p95 exceeds the threshold.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from budget_planner import BudgetPlanner
+from receipt_processor import ReceiptProcessor
+from metrics import metrics
+from fake_llm import FakeChatModel, BUDGET_CHAT_RULES, RECEIPT_RULES
+from sqlite_standin import SQLitePool
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "workflows.jsonl")
+
+def load_fixtures(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def _rules(fixture: Dict[str, Any], defaults):
+    return [tuple(rule) for rule in fixture.get("responses", [])] + list(defaults)
+
+def build_budget_runner(fixture: Dict[str, Any], args) -> Dict[str, Callable]:
+    llm = FakeChatModel(rules=_rules(fixture, BUDGET_CHAT_RULES), latency=args.latency)
+    planner = BudgetPlanner(api_key="benchmark-dummy-key", llm=llm,
+                            postgres_connection=args.postgres or "sqlite://benchmark",
+                            router_mode=fixture.get("router_mode", "structured"))
+    if not args.postgres:
+        planner.db_pool = SQLitePool()
+    prompt = fixture["prompt"]
+    return {
+        "run": lambda: planner.process_query(prompt),
+        "arun": lambda: planner.aprocess_query(prompt),
+    }
+
+def build_receipt_runner(fixture: Dict[str, Any], args) -> Dict[str, Callable]:
+    llm = FakeChatModel(rules=_rules(fixture, RECEIPT_RULES), latency=args.latency)
+    processor = ReceiptProcessor(api_key="benchmark-dummy-key", model=llm)
+    image = os.urandom(fixture.get("image_kb", 64) * 1024)
+    return {"run": lambda: json.dumps(processor.process_image(image, "image/jpeg"))}
+
+RUNNERS = {"budget_chat": build_budget_runner, "receipt": build_receipt_runner}
+
+def measure_throughput(runner: Dict[str, Callable], n: int, concurrency: int) -> float:
+    """Requests per second with up to concurrency requests in flight"""
+    start = time.perf_counter()
+    if "arun" in runner:
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+            async def one():
+                async with semaphore:
+                    return await runner["arun"]()
+            return await asyncio.gather(*(one() for _ in range(n)))
+        asyncio.run(run_all())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: runner["run"](), range(n)))
+    return n / (time.perf_counter() - start)
+
+def breakdown(workflow: str, requests: int) -> Dict[str, float]:
+    """Mean per-request milliseconds spent in nodes, DB queries and graph overhead"""
+    timings = metrics.snapshot()["timings"]
+    node_seconds = sum(t["sum"] for name, t in timings.items()
+                       if name.startswith("node.") and name.endswith(".seconds") and ".llm." not in name)
+    db_seconds = timings.get("db.query.seconds", {}).get("sum", 0.0)
+    request_seconds = timings.get(f"request.{workflow}.seconds", {}).get("sum", 0.0)
+    return {
+        "node_ms": node_seconds / requests * 1000,
+        "db_ms": db_seconds / requests * 1000,
+        "overhead_ms": max(request_seconds - node_seconds, 0.0) / requests * 1000,
+    }
+
+def run_fixture(fixture: Dict[str, Any], args) -> Dict[str, Any]:
+    runner = RUNNERS[fixture["workflow"]](fixture, args)
+    expected = fixture.get("expect")
+    output = str(runner["run"]())  # warm-up (prompt templates, lazy pools)
+    if expected and expected not in output:
+        raise AssertionError(f"{fixture['fixture_id']}: expected {expected!r} in {output[:200]!r}")
+
+    metrics.reset()
+    samples = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        runner["run"]()
+        samples.append(time.perf_counter() - start)
+    split = breakdown(fixture["workflow"], args.iterations)
+    throughput = measure_throughput(runner, args.iterations, args.concurrency)
+
+    return {
+        "fixture_id": fixture["fixture_id"],
+        "workflow": fixture["workflow"],
+        "iterations": args.iterations,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "throughput_rps": throughput,
+        **split,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--iterations", type=int, default=50, help="Sequential runs per fixture")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight for the throughput run")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake LLM latency per call in seconds")
+    parser.add_argument("--postgres", default=None, help="PostgreSQL DSN (defaults to the SQLite stand-in)")
+    parser.add_argument("--json", default=None, help="Write results to this file")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="Fail if any fixture's p95 is above this")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = [run_fixture(fixture, args) for fixture in load_fixtures(args.fixtures)]
+
+    print(f"Fake LLM latency: {args.latency * 1000:.0f} ms, database: {'postgres' if args.postgres else 'sqlite stand-in'}")
+    print(f"{'fixture':<30} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>9} "
+          f"{'node ms':>8} {'db ms':>7} {'graph ms':>9}")
+    for r in results:
+        print(f"{r['fixture_id']:<30} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+              f"{r['throughput_rps']:9.1f} {r['node_ms']:8.2f} {r['db_ms']:7.2f} {r['overhead_ms']:9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latency": args.latency, "results": results}, f, indent=2)
+
+    if args.max_p95_ms is not None:
+        slow = [r["fixture_id"] for r in results if r["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"p95 above {args.max_p95_ms} ms: {', '.join(slow)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Offline check of the prompt-cache layout used by BudgetPlanner.
+
+Runs GET, POST and no-data requests through both router modes with a stub
+chat model that records every request, then verifies that:
+- every LLM call starts with the shared SYSTEM_PROMPT marked with
+  cache_control {"type": "ephemeral"} (and unmarked when caching is off),
+- SYSTEM_PROMPT reaches the model's minimum cacheable length (shorter
+  prefixes are never cached, and the fake model enforces the same minimum),
+- the static schema block appears only in that prefix, never in the
+  per-request suffix,
+- ChatAnthropic keeps the marker in the request payload it would send,
+- cache-read and cache-write token counts reach the metrics.
+
+Usage:
+    python benchmarks/check_prompt_cache.py
+"""
+import os
+import sys
+import asyncio
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from budget_planner import BudgetPlanner, SYSTEM_PROMPT
+from metrics import metrics
+from fake_llm import FakeChatModel, BUDGET_CHAT_RULES
+from prompt_format import estimate_tokens
+from sqlite_standin import SQLitePool
+
+SCHEMA_LINE = "- expenses (id, user_id, amount"
+EPHEMERAL = {"type": "ephemeral"}
+
+POST_RULES = [
+    ("Return ONLY a JSON object with these keys", '{"request_type": "POST", "get_data": null, "what_type": "New Expense"}'),
+    ('Respond with either "GET" or "POST"', "POST"),
+    ("Respond with just one of", "New Expense"),
+    ("Generate a PostgreSQL query", "INSERT INTO expenses (user_id, amount, description, category, input_type, date) "
+                                    "VALUES (%(user_id)s, 12.5, 'Lunch', 'food', 'text', '2025-03-14')"),
+]
+NO_DATA_RULES = [
+    ("Return ONLY a JSON object with these keys", '{"request_type": "GET", "get_data": false, "what_type": null}'),
+    ('Respond with either "Yes" or "No"', "No"),
+]
+
+# Every request received by a RecordingChatModel, in order
+RECORDED: List[List[BaseMessage]] = []
+
+class RecordingChatModel(FakeChatModel):
+    """FakeChatModel that keeps every request it receives"""
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        RECORDED.append(messages)
+        return super()._respond(messages)
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        print(f"FAIL: {message}")
+        sys.exit(1)
+
+def check_calls(calls: List[List[BaseMessage]], caching: bool) -> None:
+    check(len(calls) > 0, "no LLM calls were made")
+    for messages in calls:
+        system, rest = messages[0], messages[1:]
+        check(isinstance(system, SystemMessage), "first message is not the system prompt")
+        if caching:
+            check(isinstance(system.content, list) and len(system.content) == 1, "system prompt is not one content block")
+            block = system.content[0]
+            check(block["text"] == SYSTEM_PROMPT, "system prompt differs from the shared prefix")
+            check(block.get("cache_control") == EPHEMERAL, "system prompt is missing cache_control")
+        else:
+            check(system.content == SYSTEM_PROMPT, "uncached system prompt should be plain text")
+        check(all(SCHEMA_LINE not in str(message.content) for message in rest),
+              "schema block leaked into the per-request suffix")
+
+def check_anthropic_payload(messages: List[BaseMessage]) -> None:
+    try:
+        from langchain_anthropic import ChatAnthropic
+        payload = ChatAnthropic(model="claude-3-7-sonnet-20250219", api_key="offline")._get_request_payload(messages)
+    except (ImportError, AttributeError, TypeError) as e:
+        print(f"SKIP: could not build the Anthropic request payload offline ({e})")
+        return
+    system = payload["system"]
+    check(isinstance(system, list) and system[-1].get("cache_control") == EPHEMERAL,
+          "ChatAnthropic dropped the cache_control marker")
+    print("ok: Anthropic request payload carries cache_control on the system prompt")
+
+def run(caching: bool) -> List[List[BaseMessage]]:
+    RECORDED.clear()
+    for router_mode in ("structured", "sequential"):
+        for rules in ([], POST_RULES, NO_DATA_RULES):
+            llm = RecordingChatModel(rules=rules + BUDGET_CHAT_RULES)
+            planner = BudgetPlanner(api_key="offline", llm=llm, postgres_connection="sqlite://check",
+                                    router_mode=router_mode, prompt_caching=caching)
+            planner.db_pool = SQLitePool(expenses=50)
+            planner.process_query("How much did I spend on food?")
+            asyncio.run(planner.aprocess_query("How much did I spend on food?"))
+    return list(RECORDED)
+
+def main():
+    prefix_tokens = estimate_tokens(SYSTEM_PROMPT)
+    minimum = FakeChatModel().min_cache_tokens
+    check(prefix_tokens >= minimum, f"SYSTEM_PROMPT is about {prefix_tokens} tokens, below the {minimum}-token "
+                                    f"minimum Anthropic caches")
+    print(f"ok: SYSTEM_PROMPT is about {prefix_tokens} tokens (cache minimum {minimum})")
+
+    metrics.reset()
+    calls = run(caching=True)
+    check_calls(calls, caching=True)
+    print(f"ok: {len(calls)} calls start with the cached system prompt, no schema in the suffix")
+
+    counters = metrics.snapshot()["counters"]
+    check(counters.get("llm.cache_write_tokens", 0) > 0, "no cache-write tokens recorded")
+    check(counters.get("llm.cache_read_tokens", 0) > 0, "no cache-read tokens recorded")
+    print(f"ok: cache tokens recorded (write {counters['llm.cache_write_tokens']}, "
+          f"read {counters['llm.cache_read_tokens']})")
+
+    check_anthropic_payload(calls[0])
+
+    check_calls(run(caching=False), caching=False)
+    print("ok: prompt_caching=False sends the system prompt without cache_control")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Deterministic fake chat model for offline benchmarks.
+
+Responses are chosen by matching substrings of the prompt against scripted
+rules, so concurrent requests get stable answers regardless of ordering.
+An optional artificial latency simulates the round trip to the real API,
+and token_latency the delay between streamed tokens; upload_bytes_per_second
+adds the time to send the request payload (images included) over a link of
+that speed. Responses carry
+usage_metadata with word-count token estimates so the token histograms in
+/metrics have something to show. Content blocks marked with cache_control
+are tracked like Anthropic's prompt cache: the first call writes them, later
+calls with the same prefix read them. As with the real API, a marked prefix
+shorter than min_cache_tokens (Sonnet's 1024) is not cached at all.
+"""
+import time
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from prompt_format import estimate_tokens
+
+# Scripted answers for every BudgetPlanner prompt (GET request that reads data)
+BUDGET_CHAT_RULES: List[Tuple[str, str]] = [
+    ("Return ONLY a JSON object with these keys", '{"request_type": "GET", "get_data": true, "what_type": null}'),
+    ('Respond with either "GET" or "POST"', "GET"),
+    ('Respond with either "Yes" or "No"', "Yes"),
+    ("Generate a PostgreSQL query", "SELECT category, SUM(amount) AS total FROM expenses "
+                                    "WHERE user_id = %(user_id)s GROUP BY category"),
+    ('Respond with either "POST" or "Response"', "Response"),
+    ("budget planning assistant chatbot", "You spent $420 on food this month."),
+]
+
+# Scripted answer for the ReceiptProcessor extraction prompt
+RECEIPT_RULES: List[Tuple[str, str]] = [
+    ("Analyze this receipt image", '{"merchant_name": "Corner Cafe", "date": "2025-03-14", '
+                                   '"items": [{"name": "Latte", "price": 4.5, "quantity": 2}, '
+                                   '{"name": "Bagel", "price": 3.25, "quantity": 1}], '
+                                   '"total": 12.25, "category": "food", "description": "Breakfast at Corner Cafe"}'),
+]
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers from scripted rules after an optional delay"""
+
+    rules: List[Tuple[str, str]] = BUDGET_CHAT_RULES
+    default_response: str = "OK"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    upload_bytes_per_second: float = 0.0
+    # Shortest prefix Anthropic caches (1024 tokens for Sonnet and Opus, 2048 for Haiku)
+    min_cache_tokens: int = 1024
+    cached_prefixes: set = Field(default_factory=set)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _prompt_text(self, messages: List[BaseMessage]) -> str:
+        # Text blocks only: base64 image data is neither matched nor counted as text tokens
+        return "\n".join(
+            "\n".join(block.get("text", "") for block in message.content if isinstance(block, dict))
+            if isinstance(message.content, list) else str(message.content)
+            for message in messages
+        )
+
+    def _delay(self, messages: List[BaseMessage]) -> float:
+        """Model latency plus the simulated upload time of the request payload"""
+        delay = self.latency
+        if self.upload_bytes_per_second:
+            payload = 0
+            for message in messages:
+                blocks = message.content if isinstance(message.content, list) else [message.content]
+                for block in blocks:
+                    if isinstance(block, dict):
+                        payload += len(block.get("text", "")) + len(block.get("source", {}).get("data", ""))
+                    else:
+                        payload += len(str(block))
+            delay += payload / self.upload_bytes_per_second
+        return delay
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        # Rules match the per-request part of the prompt, not the shared system prompt
+        text = self._prompt_text([message for message in messages if not isinstance(message, SystemMessage)])
+        for needle, reply in self.rules:
+            if needle in text:
+                return reply
+        return self.default_response
+
+    def _cache_usage(self, messages: List[BaseMessage]) -> Dict[str, int]:
+        """
+        Simulate prompt caching: the prefix up to the last cache_control block is written once, then read,
+        provided it reaches min_cache_tokens
+        """
+        prefix, cached_text = [], None
+        for message in messages:
+            blocks = message.content if isinstance(message.content, list) else [{"text": message.content}]
+            for block in blocks:
+                prefix.append(block.get("text", "") if isinstance(block, dict) else str(block))
+                if isinstance(block, dict) and block.get("cache_control"):
+                    cached_text = "\n".join(prefix)
+        if cached_text is None:
+            return {"cache_read": 0, "cache_creation": 0}
+        tokens = estimate_tokens(cached_text)
+        if tokens < self.min_cache_tokens:
+            return {"cache_read": 0, "cache_creation": 0}
+        if cached_text in self.cached_prefixes:
+            return {"cache_read": tokens, "cache_creation": 0}
+        self.cached_prefixes.add(cached_text)
+        return {"cache_read": 0, "cache_creation": tokens}
+
+    def _message(self, messages: List[BaseMessage]) -> AIMessage:
+        content = self._respond(messages)
+        input_tokens = estimate_tokens(self._prompt_text(messages))
+        output_tokens = estimate_tokens(content)
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_token_details": self._cache_usage(messages),
+        })
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        delay = self._delay(messages)
+        if delay:
+            time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        delay = self._delay(messages)
+        if delay:
+            await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        delay = self._delay(messages)
+        if delay:
+            time.sleep(delay)
+        for token in self._respond(messages).split(" "):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        delay = self._delay(messages)
+        if delay:
+            await asyncio.sleep(delay)
+        for token in self._respond(messages).split(" "):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,166 @@
+"""
+SQLite stand-in for PostgresPool in offline benchmarks.
+
+Implements the subset of the PostgresPool / psycopg interface BudgetPlanner
+uses (transaction/atransaction, named cursors, dict rows, pyformat params)
+on top of an in-memory SQLite database seeded with deterministic expenses,
+so the DB node can be measured without a PostgreSQL server.
+"""
+import re
+import random
+import sqlite3
+import asyncio
+import threading
+from datetime import date, timedelta
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Dict, Optional
+
+# Mirrors the backend models (backend/app/models) that generated SQL targets
+SCHEMA = """
+CREATE TABLE expenses (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT NOT NULL,
+    input_type TEXT NOT NULL,
+    merchant TEXT,
+    date DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    raw_data TEXT,
+    processed_text TEXT
+);
+CREATE TABLE budgets (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    expense_category TEXT NOT NULL,
+    percentage REAL,
+    amount REAL NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE goals (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    target_amount REAL NOT NULL,
+    current_amount REAL NOT NULL DEFAULT 0,
+    deadline DATE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+CATEGORIES = ["food", "transportation", "housing", "utilities", "entertainment", "shopping", "healthcare"]
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s")
+
+def to_sqlite(query: str) -> str:
+    """Translate psycopg pyformat placeholders to SQLite named parameters"""
+    return _PARAM_RE.sub(r":\1", query).replace("%%", "%")
+
+def seed(conn: sqlite3.Connection, expenses: int = 3000, users: int = 3, seed_value: int = 7) -> None:
+    """Create the schema and insert deterministic expenses and budgets"""
+    rng = random.Random(seed_value)
+    conn.executescript(SCHEMA)
+    start = date(2025, 1, 1)
+    conn.executemany(
+        "INSERT INTO expenses (user_id, amount, description, category, input_type, date) VALUES (?, ?, ?, ?, ?, ?)",
+        [(i % users + 1, round(rng.uniform(2, 250), 2), f"Expense {i}", rng.choice(CATEGORIES), "text",
+          start + timedelta(days=rng.randrange(365))) for i in range(expenses)]
+    )
+    conn.executemany(
+        "INSERT INTO budgets (user_id, expense_category, amount, start_date, end_date) VALUES (?, ?, ?, ?, ?)",
+        [(user, category, 500.0, start, date(2025, 12, 31))
+         for user in range(1, users + 1) for category in CATEGORIES]
+    )
+    conn.commit()
+
+class _Cursor:
+    def __init__(self, conn: sqlite3.Connection):
+        self._cursor = conn.cursor()
+        self.itersize = 0
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def execute(self, query: str, params: Optional[Dict[str, Any]] = None) -> None:
+        self._cursor.execute(to_sqlite(query), params or {})
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+class _AsyncCursor(_Cursor):
+    async def execute(self, query: str, params: Optional[Dict[str, Any]] = None) -> None:
+        super().execute(query, params)
+
+    async def __aiter__(self):
+        for row in self._cursor:
+            yield row
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._cursor.close()
+
+class _Connection:
+    def __init__(self, conn: sqlite3.Connection, is_async: bool):
+        self._conn = conn
+        self._is_async = is_async
+
+    def cursor(self, name: Optional[str] = None, **kwargs: Any):
+        return _AsyncCursor(self._conn) if self._is_async else _Cursor(self._conn)
+
+class SQLitePool:
+    """In-memory SQLite database behind the PostgresPool transaction interface"""
+
+    def __init__(self, expenses: int = 3000):
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._async_lock = asyncio.Lock()
+        seed(self._conn, expenses=expenses)
+
+    @contextmanager
+    def _transaction(self, read_only: bool, is_async: bool):
+        with self._lock:
+            if read_only:
+                self._conn.execute("PRAGMA query_only = ON")
+            try:
+                yield _Connection(self._conn, is_async)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            finally:
+                if read_only:
+                    self._conn.execute("PRAGMA query_only = OFF")
+
+    @contextmanager
+    def transaction(self, read_only: bool = False, statement_timeout_ms: Optional[int] = None):
+        with self._transaction(read_only, is_async=False) as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def atransaction(self, read_only: bool = False, statement_timeout_ms: Optional[int] = None):
+        async with self._async_lock:
+            with self._transaction(read_only, is_async=True) as conn:
+                yield conn
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite"}
+
+    def close(self) -> None:
+        self._conn.close()
+
+    async def aclose(self) -> None:
+        self.close()
@@ -1,15 +1,38 @@
 import os
-from typing import Dict, List, Optional, Any
+import json
+import time
+import uuid
+import asyncio
+import contextlib
+from typing import Dict, List, Optional, Any, Union, Callable, AsyncIterator, Tuple
 from enum import Enum
 import psycopg2
 import psycopg2.extras
 from pydantic import BaseModel
 
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
 from langchain_anthropic import ChatAnthropic
 from langgraph.graph import StateGraph, END
 
+try:
+    from psycopg.rows import dict_row
+except ImportError:  # async driver is optional, queries then run in a worker thread
+    dict_row = None
+
 from logger import logger, log_processing_error, setup_logger
+from metrics import metrics
+from intent_classifier import IntentClassifier, label_to_route
+from sql_cache import SQLTemplateCache, prepare_template, is_cacheable
+from sql_guard import SQLGuard, SQLRejected
+from spending_rollups import match_question
+from db_pool import PostgresPool, PoolError
+from result_summary import ResultAccumulator
+from prompt_format import format_db_data
+from instrumentation import trace_request, node_span, record_llm_usage, record_db_query, current_request_id, message_text
+from chat_memory import ConversationMemory, ConversationContext
 
 # Create a dedicated logger for budget planner
 budget_logger = setup_logger("budget_planner")
@@ -24,21 +47,136 @@ class WhatType(str, Enum):
     NEW_EXPENSE = "New Expense"
     CREATE_GOALS = "Create Goals"
 
+class RouterMode(str, Enum):
+    SEQUENTIAL = "sequential"
+    STRUCTURED = "structured"
+
+class LimitReason(str, Enum):
+    MAX_ITERATIONS = "max_iterations"
+    MAX_LLM_CALLS = "max_llm_calls"
+    DEADLINE = "deadline"
+
 class GraphState(BaseModel):
     prompt: str
+    user_id: int = 1
     request_type: Optional[RequestType] = None
     get_data: Optional[bool] = None
     what_type: Optional[WhatType] = None
     sql_query: Optional[str] = None
+    sql_params: Optional[Dict[str, Any]] = None
     db_data: Optional[Any] = None
     response: Optional[str] = None
     generate_post: Optional[bool] = None
+    # Why the SQL guard rejected the last query, fed back into SQL generation
+    sql_rejection: Optional[str] = None
+    sql_attempts: int = 0
+    # Session context: rendered summary + recent turns, and the previous turn's db_data
+    history: str = ""
+    previous_db_data: Optional[Any] = None
+    # Per-request execution budget
+    max_iterations: int = 3
+    max_llm_calls: int = 10
+    deadline: Optional[float] = None  # time.time() by which the request must finish
+    iterations: int = 0
+    llm_calls: int = 0
+    limit_reached: Optional[LimitReason] = None
+
+# Static instructions shared by every LLM call. It is sent as the system prompt,
+# ahead of the small per-request suffix, so Anthropic can cache it as one prefix.
+# Anthropic only caches a prefix of at least the model's minimum length (1024
+# tokens for Sonnet), so stable guidance belongs here rather than in node prompts;
+# benchmarks/check_prompt_cache.py fails when the prefix drops below that minimum.
+SYSTEM_PROMPT = """
+You are the reasoning engine of a budget planning assistant for a mobile app. Each message gives you one
+step of handling a user's request (classify it, decide whether data is needed, write SQL, or answer the
+user) and says exactly what to return. Follow the requested output format strictly: when a step asks for
+one word, a JSON object or a SQL statement, return only that, with no explanation, markdown or code fences.
+
+Request types:
+- GET: the user is asking for information about their account or data that can be present in the database
+  (spending, budgets, goals, transactions).
+- POST: the user wants to log purchases, update or add budgets, or create goals. POST requests are one of
+  "Readjust budget" (change budget amounts or percentages), "New Expense" (log a purchase or bill) or
+  "Create Goals" (add a savings goal).
+
+How to classify requests:
+- A request is POST only when the user asks you to change their data now: "set my food budget to $400",
+  "log $12 for lunch", "I paid $75 for the phone bill", "create a goal to save $800 for a bike".
+- Questions about budgets or goals are GET, even when they mention changing something: "should I change my
+  budget?", "what happens if I lower my food budget?", "how do I set a savings goal?",
+  "did my spending go over budget last month?".
+- A GET request needs data when the answer depends on the user's own records (totals, lists, remaining
+  budget, progress towards a goal, comparisons between periods). General questions about budgeting,
+  saving or investing, greetings and questions about the app do not need data.
+- When a follow-up question refers to an earlier turn ("and last month?", "what about food?"), resolve it
+  from the conversation so far and classify the resolved request.
+
+PostgreSQL database schema (every table except users belongs to one user through user_id):
+- users (id, email, hashed_password, full_name, is_active, created_at, updated_at, plaid_access_token)
+  Never read this table; the requesting user's id is always given as a placeholder.
+- expenses (id, user_id, amount, description, category, input_type, merchant, date, created_at, raw_data, processed_text)
+  One row per purchase or bill. amount is a positive double precision value in dollars. date (timestamptz)
+  is when the purchase happened and is the column to filter and group spending by; created_at is when the
+  row was stored. merchant may be NULL. raw_data and processed_text hold the uploaded receipt or audio and
+  its extracted text; do not select them.
+- budgets (id, user_id, expense_category, percentage, amount, start_date, end_date, created_at)
+  A spending limit for one category over the period start_date to end_date (dates, inclusive).
+  amount is the limit in dollars; percentage (may be NULL) is the share of the user's total budget.
+- goals (id, user_id, name, target_amount, current_amount, deadline, created_at)
+  A savings goal: current_amount of target_amount saved so far, to be reached by deadline (a date).
+
+Expense categories are one of: food, transportation, housing, utilities, entertainment, healthcare, shopping,
+education, personal, savings, investments, other.
+The input_type of an expense is one of: text, audio, image, plaid.
+Map everyday words to these categories: groceries, restaurants, coffee and takeout are food; fuel, taxis,
+rides, parking and transit are transportation; rent and mortgage are housing; electricity, water, internet
+and phone bills are utilities; movies, concerts, games and streaming are entertainment; pharmacy, doctor and
+dental are healthcare; clothes and electronics are shopping; tuition and courses are education; gym, salon
+and haircuts are personal. Use other only when nothing else fits.
+
+When writing SQL:
+- Write a single PostgreSQL statement that can be executed directly, with no explanation or code fences.
+- Filter rows by the requesting user wherever the table has a user_id column.
+- Use the psycopg2 placeholders you are given (such as %(user_id)s) instead of literal values.
+- Only read the expenses, budgets and goals tables. Never write DDL (CREATE, ALTER, DROP, TRUNCATE) and never
+  DELETE rows.
+- For totals, aggregate in SQL (SUM, COUNT, AVG with GROUP BY) instead of returning every row, and round
+  money with ROUND(SUM(amount)::numeric, 2). When listing rows, order them (newest first for expenses) and
+  add a LIMIT of at most 50.
+- Express periods relative to the current date: "this month" is
+  date >= date_trunc('month', CURRENT_DATE) AND date < date_trunc('month', CURRENT_DATE) + interval '1 month',
+  "last month" shifts both bounds back by one month, and "last 7 days" is date >= CURRENT_DATE - interval '6 days'.
+  A month named without a year is the most recent such month.
+- Match merchants and descriptions case-insensitively with ILIKE and a %-wrapped pattern.
+- Remaining budget is the budget amount minus the category's expenses between start_date and end_date.
+- New expenses: INSERT INTO expenses (user_id, amount, description, category, input_type, merchant, date)
+  with input_type 'text', the date the user gave (CURRENT_DATE when none) and a short description.
+- Budget changes: UPDATE the user's budget row for that category whose period covers CURRENT_DATE.
+  A percentage change updates percentage, an amount change updates amount.
+- New goals: INSERT INTO goals (user_id, name, target_amount, current_amount, deadline) with current_amount 0
+  unless the user says otherwise, and a deadline one year from CURRENT_DATE when none is given.
+
+When answering the user:
+- Be short, clear and friendly, and base every figure on the data provided.
+- Format money as dollars with two decimals ($1,234.50) and name the period the figures cover.
+- If the data is empty, say that no matching records were found instead of guessing.
+- For POST requests, confirm what was done and give any relevant feedback.
+"""
 
 class BudgetPlanner:
     """Budget planning system using LangGraph and Claude"""
     
     def __init__(self, api_key: str, model_name: str = "claude-3-7-sonnet-20250219", 
-                postgres_connection: Optional[str] = None):
+                postgres_connection: Optional[str] = None, llm: Optional[BaseChatModel] = None,
+                router_mode: RouterMode = RouterMode.SEQUENTIAL,
+                intent_classifier: Optional[IntentClassifier] = None,
+                sql_cache: Optional[SQLTemplateCache] = None,
+                db_pool_options: Optional[Dict[str, Any]] = None,
+                max_result_rows: int = 200, fetch_batch_size: int = 500,
+                max_iterations: int = 3, max_llm_calls: int = 10, request_timeout: float = 60.0,
+                session_store=None, memory_options: Optional[Dict[str, Any]] = None,
+                prompt_caching: bool = True, sql_guard: Optional[SQLGuard] = None,
+                max_sql_attempts: int = 2, rollup_fast_path: bool = False):
         """
         Initialize the budget planner
         
@@ -46,30 +184,94 @@ class BudgetPlanner:
             api_key: Anthropic API key
             model_name: Claude model name to use
             postgres_connection: PostgreSQL connection string
+            llm: Optional pre-built chat model to share (skips creating a new client)
+            router_mode: "sequential" asks the model one routing question per node,
+                "structured" resolves request_type, get_data and what_type in a single call
+            intent_classifier: Optional local classifier tried before the LLM router
+            sql_cache: Optional cache of parameterized SQL templates keyed by normalized intent
+            db_pool_options: Keyword arguments for the PostgresPool (size, max_age, statement_timeout_ms, ...)
+            max_result_rows: GET results larger than this are replaced by a summary (counts, sums, top-N)
+            fetch_batch_size: Rows fetched per round trip from the server-side cursor
+            max_iterations: Maximum create_query loops per request
+            max_llm_calls: Maximum LLM calls per request
+            request_timeout: Seconds each request may run before it ends with a partial answer
+            session_store: Optional MongoSessionStore / InMemorySessionStore enabling session-aware chat
+            memory_options: Keyword arguments for the ConversationMemory (recent_messages, max_summary_words, ...)
+            prompt_caching: Mark the shared system prompt with Anthropic cache_control
+            sql_guard: Optional allow-list and EXPLAIN cost check run before generated SQL executes
+            max_sql_attempts: Rejected queries are regenerated until this many have been rejected
+            rollup_fast_path: Answer category/period spending totals from spending_rollups without generating SQL
         """
         budget_logger.info("Initializing BudgetPlanner")
         self.model_name = model_name
         self.api_key = api_key
         self.postgres_connection = postgres_connection
+        self.router_mode = RouterMode(router_mode)
+        self.intent_classifier = intent_classifier
+        self.sql_cache = sql_cache
+        self.max_result_rows = max_result_rows
+        self.fetch_batch_size = fetch_batch_size
+        self.max_iterations = max_iterations
+        self.max_llm_calls = max_llm_calls
+        self.request_timeout = request_timeout
+        self.prompt_caching = prompt_caching
+        self.sql_guard = sql_guard
+        self.max_sql_attempts = max_sql_attempts
+        self.rollup_fast_path = rollup_fast_path
+        self.db_pool = PostgresPool(postgres_connection, **(db_pool_options or {})) if postgres_connection else None
         
-        budget_logger.info(f"Using Claude model: {model_name}")
-        self.llm = ChatAnthropic(
-            model=model_name,
-            temperature=0,
-            anthropic_api_key=api_key,
-            max_tokens=1000
-        )
+        if llm is not None:
+            budget_logger.info("Using shared chat model")
+            self.llm = llm
+        else:
+            budget_logger.info(f"Using Claude model: {model_name}")
+            self.llm = ChatAnthropic(
+                model=model_name,
+                temperature=0,
+                anthropic_api_key=api_key,
+                max_tokens=1000
+            )
+        self.memory = ConversationMemory(session_store, self.llm, **(memory_options or {})) \
+            if session_store is not None else None
         budget_logger.info("Creating workflow graph")
         self.workflow = self._create_workflow()
         budget_logger.info("BudgetPlanner initialization complete")
     
-    def _determine_request_type(self, state: GraphState) -> Dict:
-        """Determine if the request is GET or POST."""
+    def _messages(self, prompt: str) -> List[BaseMessage]:
+        """Put the shared static prefix in the system prompt and the per-request prompt after it"""
+        if self.prompt_caching:
+            system = SystemMessage(content=[
+                {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+            ])
+        else:
+            system = SystemMessage(content=SYSTEM_PROMPT)
+        return [system, HumanMessage(content=prompt)]
+
+    def _history_block(self, state: GraphState) -> str:
+        """Conversation context for prompts (empty outside a session)"""
+        if not state.history:
+            return ""
+        return f"Conversation so far (use it to resolve follow-up questions):\n{state.history}\n"
+
+    def _previous_data_block(self, state: GraphState, instruction: str) -> str:
+        """Offer the previous turn's db_data for reuse (empty when there is none)"""
+        if state.previous_db_data is None:
+            return ""
+        return f"{instruction}\nData retrieved for the previous question:\n{format_db_data(state.previous_db_data)}\n"
+
+    def _reuse_previous_data(self, state: GraphState) -> Dict:
+        """Answer from the previous turn's db_data instead of querying again"""
+        budget_logger.info("Reusing db_data from the previous turn")
+        metrics.increment("budget_planner.db_data.reused")
+        return {"get_data": False, "db_data": state.previous_db_data}
+
+    def _determine_request_type_prompt(self, state: GraphState) -> str:
+        """Build the prompt that asks whether the request is GET or POST."""
         budget_logger.info("Determining request type")
         prompt_template = """
-        Based on the following user prompt, determine if this is a "GET", meaning the user is asking some info regarding its account or data that can be present in the database
-        or a "POST", meaning the user wants to log purchases, update or add budgets or goals.
+        Based on the following user prompt, determine if this is a "GET" or a "POST" request (see Request types).
         
+        {history}
         User prompt: {prompt}
         
         Respond with either "GET" or "POST".
@@ -77,8 +279,10 @@ class BudgetPlanner:
         
         prompt = ChatPromptTemplate.from_template(prompt_template)
         budget_logger.debug(f"Sending prompt to determine request type for: {state.prompt[:50]}...")
-        response = self.llm.invoke(prompt.format(prompt=state.prompt))
-        
+        return prompt.format(prompt=state.prompt, history=self._history_block(state))
+
+    def _determine_request_type(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Determine if the request is GET or POST."""
         if "GET" in response.content:
             request_type = RequestType.GET
             budget_logger.info("Request type determined: GET")
@@ -88,43 +292,49 @@ class BudgetPlanner:
             
         return {"request_type": request_type}
 
-    def _determine_get_data(self, state: GraphState) -> Dict:
-        """Determine if we need to get data for a GET request."""
+    def _determine_get_data_prompt(self, state: GraphState) -> str:
+        """Build the prompt that asks whether a GET request needs data."""
         budget_logger.info("Determining if data retrieval is needed")
         prompt_template = """
         Based on the following user prompt for a GET request, determine if we need to query the database.
         
+        {history}
         User prompt: {prompt}
         
         Respond with either "Yes" or "No".
+        {previous_data}
         """
         
         prompt = ChatPromptTemplate.from_template(prompt_template)
-        response = self.llm.invoke(prompt.format(prompt=state.prompt))
-        
+        previous_data = self._previous_data_block(
+            state, 'If the data retrieved for the previous question already answers it, respond with "Reuse" instead.')
+        return prompt.format(prompt=state.prompt, history=self._history_block(state), previous_data=previous_data)
+
+    def _determine_get_data(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Determine if we need to get data for a GET request."""
+        if "Reuse" in response.content and state.previous_db_data is not None:
+            return self._reuse_previous_data(state)
         get_data = "Yes" in response.content
         budget_logger.info(f"Data retrieval decision: {get_data}")
         return {"get_data": get_data}
 
-    def _determine_post_type(self, state: GraphState) -> Dict:
-        """Determine what type of POST request this is."""
+    def _determine_post_type_prompt(self, state: GraphState) -> str:
+        """Build the prompt that asks what type of POST request this is."""
         budget_logger.info("Determining POST request type")
         prompt_template = """
         Based on the following user prompt for a POST request, determine what type of operation this is.
         
+        {history}
         User prompt: {prompt}
         
-        Choose one of the following:
-        - Readjust budget
-        - New Expense
-        - Create Goals
-        
-        Respond with just one of these options.
+        Respond with just one of: Readjust budget, New Expense, Create Goals.
         """
         
         prompt = ChatPromptTemplate.from_template(prompt_template)
-        response = self.llm.invoke(prompt.format(prompt=state.prompt))
-        
+        return prompt.format(prompt=state.prompt, history=self._history_block(state))
+
+    def _determine_post_type(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Determine what type of POST request this is."""
         if "Readjust budget" in response.content:
             what_type = WhatType.READJUST_BUDGET
             budget_logger.info("POST type determined: Readjust budget")
@@ -137,21 +347,123 @@ class BudgetPlanner:
             
         return {"what_type": what_type}
 
-    def _generate_sql_query(self, state: GraphState) -> Dict:
-        """Generate an SQL query based on the request type and what type."""
+    def _route_request_prompt(self, state: GraphState) -> str:
+        """Build the single structured routing prompt."""
+        budget_logger.info("Routing request with structured intent call")
+        prompt_template = """
+        Classify the following user prompt for a budget planning assistant.
+        
+        {history}
+        User prompt: {prompt}
+        
+        Return ONLY a JSON object with these keys:
+        - "request_type": "GET" or "POST" (see Request types)
+        - "get_data": for a GET request, true if we need to query the database, otherwise false. Use null for POST.
+        - "what_type": for a POST request, one of "Readjust budget", "New Expense" or "Create Goals". Use null for GET.
+        {previous_data}
+        """
+        
+        prompt = ChatPromptTemplate.from_template(prompt_template)
+        previous_data = self._previous_data_block(
+            state, '- "reuse_data": true if the data retrieved for the previous question already answers this GET request, '
+                   'otherwise false.')
+        return prompt.format(prompt=state.prompt, history=self._history_block(state), previous_data=previous_data)
+
+    def _route_request(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Determine request_type, get_data and what_type with a single structured call."""
+        try:
+            content = response.content
+            route = json.loads(content[content.find('{'):content.rfind('}') + 1])
+            request_type = RequestType(str(route["request_type"]).upper())
+        except (ValueError, KeyError, TypeError) as e:
+            budget_logger.warning(f"Could not parse structured route, falling back to sequential routing: {str(e)}")
+            metrics.increment("budget_planner.router.fallback")
+            return {"request_type": None, "get_data": None, "what_type": None}
+        
+        get_data = None
+        what_type = None
+        if request_type == RequestType.GET:
+            if route.get("reuse_data") and state.previous_db_data is not None:
+                metrics.increment("budget_planner.router.structured")
+                return {"request_type": request_type, "what_type": None, **self._reuse_previous_data(state)}
+            get_data = bool(route.get("get_data", True))
+        else:
+            try:
+                what_type = WhatType(route.get("what_type"))
+            except ValueError:
+                what_type = WhatType.CREATE_GOALS
+        
+        metrics.increment("budget_planner.router.structured")
+        budget_logger.info(f"Structured route: request_type={request_type.value}, get_data={get_data}, "
+                           f"what_type={what_type.value if what_type else None}")
+        return {"request_type": request_type, "get_data": get_data, "what_type": what_type}
+
+    def _fast_route(self, state: GraphState) -> Dict:
+        """Route the request locally, without an LLM call, when the classifier is confident."""
+        limit = self._check_budget(state)
+        if limit:
+            return self._limit_update(limit)
+        if state.history:
+            # The classifier sees only the prompt; follow-ups in a session need the LLM router's context
+            budget_logger.info("Session has history, deferring to LLM router")
+            return {"request_type": None, "get_data": None, "what_type": None}
+        prediction = self.intent_classifier.classify(state.prompt)
+        if prediction is None:
+            budget_logger.info("Local intent classifier not confident or predicted a write, deferring to LLM router")
+            return {"request_type": None, "get_data": None, "what_type": None}
+        
+        budget_logger.info(f"Local intent classifier routed request as {prediction.label} "
+                           f"({prediction.source}, confidence {prediction.confidence:.2f})")
+        route = label_to_route(prediction.label)
+        return {
+            "request_type": RequestType(route["request_type"]),
+            "get_data": route["get_data"],
+            "what_type": WhatType(route["what_type"]) if route["what_type"] else None
+        }
+
+    def _sql_intent(self, state: GraphState) -> str:
+        """The SQL intent of the request: "GET" or the POST what_type"""
+        return state.request_type.value if state.request_type == RequestType.GET else state.what_type.value
+
+    def _sql_cache_key(self, state: GraphState):
+        """Return the SQL template cache key, slot parameters and bound parameters for the request
+        (no key and no slots when the cache is disabled: the model then writes literal values)"""
+        if self.sql_cache is None:
+            return None, {}, {"user_id": state.user_id}
+        cache_key, slot_params = SQLTemplateCache.make_key(self._sql_intent(state), state.prompt)
+        return cache_key, slot_params, {**slot_params, "user_id": state.user_id}
+
+    def _generate_sql_query_prompt(self, state: GraphState) -> Union[str, Dict]:
+        """Build the SQL generation prompt, or return the cached query when the template is known."""
         budget_logger.info(f"Generating SQL query for request type: {state.request_type}")
+        cache_key, slot_params, sql_params = self._sql_cache_key(state)
+        
+        if (self.rollup_fast_path and state.request_type == RequestType.GET
+                and not state.history and not state.sql_rejection):
+            rollup = match_question(state.prompt)
+            if rollup is not None:
+                rollup_query, rollup_params = rollup
+                metrics.increment("budget_planner.rollup.hits")
+                budget_logger.info(f"Answering from spending rollups: {rollup_params}")
+                return {"sql_query": rollup_query, "sql_params": {**rollup_params, "user_id": state.user_id}}
+        
+        # Follow-up questions depend on the conversation and regenerations on the rejection,
+        # so they bypass the template cache
+        if self.sql_cache is not None and not state.history and not state.sql_rejection:
+            cached_query = self.sql_cache.get(cache_key)
+            if cached_query is not None:
+                budget_logger.info(f"Using cached SQL template: {cached_query}")
+                return {"sql_query": cached_query, "sql_params": sql_params}
+        
         if state.request_type == RequestType.GET:
             budget_logger.debug("Using GET query template")
             template = """
             Generate a PostgreSQL query to retrieve budget information based on the user's request.
-            The database has the following tables:
-            - users (id, email, hashed_password, full_name, is_active, created_at, updated_at, plaid_access_token)
-            - budgets (id, expense_category, percentage, amount, start_date, end_date, created_at)
-            - expenses (id, user_id, amount, description, category, input_type, merchant, date, created_at, raw_data, processed_text)
-            - goals (id, name, target_amount, current_amount, deadline, created_at)
+            Use the database schema from the system prompt.
             
+            {history}
             User request: {prompt}
-            use user_id = 1
+            {placeholders}
                 
             Return only the SQL query, nothing else. The ouput SQL query qould be directly executed in the database.
             """
@@ -160,14 +472,11 @@ class BudgetPlanner:
                 budget_logger.debug("Using READJUST_BUDGET query template")
                 template = """
                 Generate a PostgreSQL query to update the budget based on the user's request.
-                The database has the following tables:
-                - users (id, email, hashed_password, full_name, is_active, created_at, updated_at, plaid_access_token)
-                - budgets (id, expense_category, percentage, amount, start_date, end_date, created_at)
-                - expenses (id, user_id, amount, description, category, input_type, merchant, date, created_at, raw_data, processed_text)
-                - goals (id, name, target_amount, current_amount, deadline, created_at)
+                Use the database schema from the system prompt.
                 
+                {history}
                 User request: {prompt}
-                use user_id = 1
+                {placeholders}
                 
                 Return only the SQL query, nothing else. The ouput SQL query qould be directly executed in the database.
                 """
@@ -175,19 +484,11 @@ class BudgetPlanner:
                 budget_logger.debug("Using NEW_EXPENSE query template")
                 template = """
                 Generate a PostgreSQL query to add a new expense based on the user's request.
-                The database has the following tables:
-                - users (id, email, hashed_password, full_name, is_active, created_at, updated_at, plaid_access_token)
-                - budgets (id, expense_category, percentage, amount, start_date, end_date, created_at)
-                - expenses (id, user_id, amount, description, category, input_type, merchant, date, created_at, raw_data, processed_text)
-                - goals (id, name, target_amount, current_amount, deadline, created_at)
-                
-                Note that the expense category should be one of: food, transportation, housing, utilities, entertainment, 
-                healthcare, shopping, education, personal, savings, investments, other.
-                
-                The input_type should be one of: text, audio, image, plaid.
+                Use the database schema from the system prompt.
                 
+                {history}
                 User request: {prompt}
-                use user_id = 1
+                {placeholders}
                 
                 Return only the SQL query, nothing else. The ouput SQL query qould be directly executed in the database.
                 """
@@ -195,97 +496,206 @@ class BudgetPlanner:
                 budget_logger.debug("Using CREATE_GOALS query template")
                 template = """
                 Generate a PostgreSQL query to add new budget goals based on the user's request.
-                The database has the following tables:
-                - users (id, email, hashed_password, full_name, is_active, created_at, updated_at, plaid_access_token)
-                - budgets (id, expense_category, percentage, amount, start_date, end_date, created_at)
-                - expenses (id, user_id, amount, description, category, input_type, merchant, date, created_at, raw_data, processed_text)
-                - goals (id, name, target_amount, current_amount, deadline, created_at)
+                Use the database schema from the system prompt.
                 
+                {history}
                 User request: {prompt}
-                use user_id = 1
+                {placeholders}
                 
                 Return only the SQL query, nothing else. The ouput SQL query qould be directly executed in the database.
                 """
         
-        prompt = ChatPromptTemplate.from_template(template)
-        response = self.llm.invoke(prompt.format(prompt=state.prompt))
+        placeholders = "Use the placeholder %(user_id)s wherever the user's id is needed."
+        if slot_params:
+            placeholders += " Use these psycopg2 placeholders instead of literal values: " + ", ".join(
+                f"%({name})s = {value!r}" for name, value in slot_params.items()
+            ) + "."
+        if state.sql_rejection:
+            placeholders += (f"\nThe previous query was rejected before it ran: {state.sql_rejection}."
+                             f"\nRejected query: {state.sql_query}\nWrite a query that avoids this problem.")
         
-        sql_query = response.content.strip()
+        prompt = ChatPromptTemplate.from_template(template)
+        return prompt.format(prompt=state.prompt, history=self._history_block(state), placeholders=placeholders)
+
+    def _generate_sql_query(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Generate an SQL query based on the request type and what type."""
+        cache_key, slot_params, sql_params = self._sql_cache_key(state)
+        sql_query = prepare_template(response.content)
         budget_logger.info("SQL query generated")
         budget_logger.info(f"Generated SQL query: {sql_query}")
-        return {"sql_query": sql_query}
+        
+        if self.sql_cache is not None and not state.history and not state.sql_rejection:
+            if is_cacheable(sql_query, slot_params):
+                self.sql_cache.put(cache_key, sql_query)
+            else:
+                budget_logger.info("Generated SQL is not a reusable template, not caching it")
+        return {"sql_query": sql_query, "sql_params": sql_params}
 
     def _get_data_from_db(self, state: GraphState) -> Dict:
         """Execute the SQL query and get data from the database."""
+        limit = self._check_budget(state)
+        if limit:
+            return self._limit_update(limit)
         budget_logger.info("Executing SQL query against database")
         if not self.postgres_connection:
             budget_logger.error("No PostgreSQL connection string provided")
             return {"db_data": {"error": "Database connection not configured"}}
             
+        is_get = state.request_type == RequestType.GET
         try:
-            budget_logger.debug("Establishing database connection")
-            conn = psycopg2.connect(self.postgres_connection)
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            
-            try:
-                budget_logger.debug(f"Executing query: {state.sql_query}")
-                cursor.execute(state.sql_query)
-                if state.request_type == RequestType.GET:
-                    budget_logger.debug("Fetching results for GET request")
-                    data = cursor.fetchall()
-                    # Convert DictRow objects to regular dictionaries
-                    db_data = [dict(row) for row in data]
-                    budget_logger.info(f"Retrieved {len(db_data)} rows from database")
-                else:  # POST
-                    budget_logger.debug("Committing transaction for POST request")
-                    conn.commit()
-                    db_data = {"success": True, "rows_affected": cursor.rowcount}
-                    budget_logger.info(f"POST operation affected {cursor.rowcount} rows")
-            except Exception as e:
-                log_processing_error(f"Database error: {str(e)}")
-                budget_logger.error(f"Error executing SQL query: {str(e)}")
-                db_data = {"error": str(e)}
-            finally:
-                budget_logger.debug("Closing database cursor and connection")
-                cursor.close()
-                conn.close()
+            if self.sql_guard is not None:
+                self.sql_guard.check_statement(state.sql_query, self._sql_intent(state))
+            # GET queries run in READ ONLY transactions, all statements carry a statement_timeout
+            with self.db_pool.transaction(read_only=is_get,
+                                          statement_timeout_ms=self._remaining_ms(state)) as conn:
+                if self.sql_guard is not None:
+                    with conn.cursor() as cursor:
+                        cursor.execute(self.sql_guard.explain_sql(state.sql_query), state.sql_params)
+                        self.sql_guard.check_plan(cursor.fetchone()[0])
+                # GET results are streamed through a server-side cursor so only a bounded number of rows is held
+                cursor_name = f"budget_get_{uuid.uuid4().hex}" if is_get else None
+                with conn.cursor(name=cursor_name, cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    budget_logger.debug(f"Executing query: {state.sql_query}")
+                    if is_get:
+                        cursor.itersize = self.fetch_batch_size
+                    query_start = time.perf_counter()
+                    cursor.execute(state.sql_query, state.sql_params)
+                    if is_get:
+                        budget_logger.debug("Streaming results for GET request")
+                        accumulator = ResultAccumulator(max_rows=self.max_result_rows)
+                        for row in cursor:
+                            # Convert DictRow objects to regular dictionaries
+                            accumulator.add(dict(row))
+                        db_data = accumulator.result()
+                        record_db_query(time.perf_counter() - query_start, accumulator.total_rows)
+                        budget_logger.info(f"Retrieved {accumulator.total_rows} rows from database"
+                                           + (" (summarised)" if accumulator.truncated else ""))
+                    else:  # POST
+                        budget_logger.debug("Committing transaction for POST request")
+                        db_data = {"success": True, "rows_affected": cursor.rowcount}
+                        record_db_query(time.perf_counter() - query_start, max(cursor.rowcount, 0))
+                        budget_logger.info(f"POST operation affected {cursor.rowcount} rows")
+        except SQLRejected as e:
+            return self._sql_rejected(state, e)
+        except PoolError as e:
+            log_processing_error(f"Failed to connect to database: {str(e)}")
+            budget_logger.error(f"Database connection error: {str(e)}")
+            db_data = {"error": f"Connection error: {str(e)}"}
         except Exception as e:
+            log_processing_error(f"Database error: {str(e)}")
+            budget_logger.error(f"Error executing SQL query: {str(e)}")
+            db_data = {"error": str(e)}
+        
+        return {"db_data": db_data, "sql_rejection": None, "sql_attempts": 0}
+
+    async def _aget_data_from_db(self, state: GraphState) -> Dict:
+        """Execute the SQL query and get data from the database without blocking the event loop."""
+        limit = self._check_budget(state)
+        if limit:
+            return self._limit_update(limit)
+        budget_logger.info("Executing SQL query against database (async)")
+        if not self.postgres_connection:
+            budget_logger.error("No PostgreSQL connection string provided")
+            return {"db_data": {"error": "Database connection not configured"}}
+        if dict_row is None:
+            budget_logger.debug("psycopg async driver not installed, running query in a worker thread")
+            return await asyncio.to_thread(self._get_data_from_db, state)
+            
+        is_get = state.request_type == RequestType.GET
+        try:
+            if self.sql_guard is not None:
+                self.sql_guard.check_statement(state.sql_query, self._sql_intent(state))
+            async with self.db_pool.atransaction(read_only=is_get,
+                                                 statement_timeout_ms=self._remaining_ms(state)) as conn:
+                if self.sql_guard is not None:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(self.sql_guard.explain_sql(state.sql_query), state.sql_params)
+                        self.sql_guard.check_plan((await cursor.fetchone())[0])
+                cursor_name = f"budget_get_{uuid.uuid4().hex}" if is_get else ""
+                async with conn.cursor(name=cursor_name, row_factory=dict_row) as cursor:
+                    budget_logger.debug(f"Executing query: {state.sql_query}")
+                    if is_get:
+                        cursor.itersize = self.fetch_batch_size
+                    query_start = time.perf_counter()
+                    await cursor.execute(state.sql_query, state.sql_params)
+                    if is_get:
+                        budget_logger.debug("Streaming results for GET request")
+                        accumulator = ResultAccumulator(max_rows=self.max_result_rows)
+                        async for row in cursor:
+                            accumulator.add(dict(row))
+                        db_data = accumulator.result()
+                        record_db_query(time.perf_counter() - query_start, accumulator.total_rows)
+                        budget_logger.info(f"Retrieved {accumulator.total_rows} rows from database"
+                                           + (" (summarised)" if accumulator.truncated else ""))
+                    else:  # POST
+                        budget_logger.debug("Committing transaction for POST request")
+                        db_data = {"success": True, "rows_affected": cursor.rowcount}
+                        record_db_query(time.perf_counter() - query_start, max(cursor.rowcount, 0))
+                        budget_logger.info(f"POST operation affected {cursor.rowcount} rows")
+        except SQLRejected as e:
+            return self._sql_rejected(state, e)
+        except PoolError as e:
             log_processing_error(f"Failed to connect to database: {str(e)}")
             budget_logger.error(f"Database connection error: {str(e)}")
             db_data = {"error": f"Connection error: {str(e)}"}
+        except Exception as e:
+            log_processing_error(f"Database error: {str(e)}")
+            budget_logger.error(f"Error executing SQL query: {str(e)}")
+            db_data = {"error": str(e)}
         
-        return {"db_data": db_data}
+        return {"db_data": db_data, "sql_rejection": None, "sql_attempts": 0}
 
-    def _determine_generate_post(self, state: GraphState) -> Dict:
-        """Determine if we need to generate a POST after getting data."""
+    def _sql_rejected(self, state: GraphState, rejection: SQLRejected) -> Dict:
+        """State update for a query the SQL guard rejected; the router then regenerates it"""
+        budget_logger.warning(f"SQL guard rejected query ({rejection.kind}): {rejection.reason}")
+        if self.sql_cache is not None and not state.history:
+            self.sql_cache.invalidate(self._sql_cache_key(state)[0])
+        return {
+            "db_data": {"error": f"Query rejected: {rejection.reason}"},
+            "sql_rejection": rejection.reason,
+            "sql_attempts": state.sql_attempts + 1
+        }
+
+    async def aclose(self) -> None:
+        """Close the database connection pool, if one was created"""
+        if self.db_pool is not None:
+            await self.db_pool.aclose()
+
+    def _determine_generate_post_prompt(self, state: GraphState) -> Union[str, Dict]:
+        """Build the prompt that asks whether a POST should follow the retrieved data."""
         budget_logger.info("Determining if POST generation is needed after data retrieval")
-        if state.request_type == RequestType.GET:
-            prompt_template = """
-            Based on the user's request and the data we retrieved, determine if we need to generate a POST request.
-            
-            User request: {prompt}
-            Retrieved data: {db_data}
-            
-            Respond with either "POST" or "Response".
-            """
-            
-            prompt = ChatPromptTemplate.from_template(prompt_template)
-            response = self.llm.invoke(prompt.format(prompt=state.prompt, db_data=state.db_data))
-            
-            generate_post = "POST" in response.content
-            budget_logger.info(f"Decision to generate POST: {generate_post}")
-        else:
-            generate_post = False
+        if state.request_type != RequestType.GET:
             budget_logger.info("No need to determine POST generation for a POST request")
-            
+            return {"generate_post": False}
+        
+        prompt_template = """
+        Based on the user's request and the data we retrieved, determine if we need to generate a POST request.
+        
+        {history}
+        User request: {prompt}
+        Retrieved data: {db_data}
+        
+        Respond with either "POST" or "Response".
+        """
+        
+        prompt = ChatPromptTemplate.from_template(prompt_template)
+        return prompt.format(prompt=state.prompt, history=self._history_block(state), db_data=format_db_data(state.db_data))
+
+    def _determine_generate_post(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Determine if we need to generate a POST after getting data."""
+        generate_post = "POST" in response.content
+        budget_logger.info(f"Decision to generate POST: {generate_post}")
         return {"generate_post": generate_post}
 
-    def _create_query(self, state: GraphState) -> Dict:
-        """Create a query based on the data we retrieved."""
+    def _create_query_prompt(self, state: GraphState) -> str:
+        """Build the prompt that creates a follow-up query from the retrieved data."""
+        if state.iterations >= state.max_iterations:
+            return self._limit_update(LimitReason.MAX_ITERATIONS)
         budget_logger.info("Creating new query based on retrieved data")
         prompt_template = """
         Create a new query based on the user's original request and the data we retrieved.
         
+        {history}
         User request: {prompt}
         Retrieved data: {db_data}
         
@@ -293,15 +703,17 @@ class BudgetPlanner:
         """
         
         prompt = ChatPromptTemplate.from_template(prompt_template)
-        response = self.llm.invoke(prompt.format(prompt=state.prompt, db_data=state.db_data))
-        
+        return prompt.format(prompt=state.prompt, history=self._history_block(state), db_data=format_db_data(state.db_data))
+
+    def _create_query(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Create a query based on the data we retrieved."""
         new_prompt = response.content.strip()
         budget_logger.info("Created new query")
         budget_logger.debug(f"New query: {new_prompt[:50]}...")
-        return {"prompt": new_prompt}
+        return {"prompt": new_prompt, "iterations": state.iterations + 1}
 
-    def _generate_response(self, state: GraphState) -> Dict:
-        """Generate a response to the user."""
+    def _generate_response_prompt(self, state: GraphState) -> str:
+        """Build the prompt for the final response to the user."""
         budget_logger.info("Generating response to user")
         if state.request_type == RequestType.GET:
             budget_logger.debug("Using GET response template")
@@ -309,6 +721,7 @@ class BudgetPlanner:
             You are a budget planning assistant chatbot for a mobile app. Create a short response to the user
             based on the data retrieved from the database.
             
+            {history}
             User request: {prompt}
             Data from database: {db_data}
             
@@ -321,6 +734,7 @@ class BudgetPlanner:
             You are a budget planning assistant chatbot for a mobile app. 
             Generate a short confirmation response for the user, based on the users prompt, saying that it was successful.
             
+            {history}
             User request: {prompt}
             Result of operation: {db_data}
             
@@ -328,8 +742,10 @@ class BudgetPlanner:
             """
         
         prompt = ChatPromptTemplate.from_template(template)
-        response = self.llm.invoke(prompt.format(prompt=state.prompt, db_data=state.db_data))
-        
+        return prompt.format(prompt=state.prompt, history=self._history_block(state), db_data=format_db_data(state.db_data))
+
+    def _generate_response(self, state: GraphState, response: BaseMessage) -> Dict:
+        """Generate a response to the user."""
         user_response = response.content.strip()
         budget_logger.info("Response generated successfully")
         return {"response": user_response}
@@ -351,12 +767,144 @@ class BudgetPlanner:
         budget_logger.info(f"Routing based on what_type: {route}")
         return route
 
+    def _structured_router(self, state: GraphState) -> str:
+        """Conditional routing for the single-call structured route"""
+        if state.request_type is None:
+            route = "fallback"
+        elif state.request_type == RequestType.GET:
+            route = self._should_get_data(state)
+        else:
+            route = self._what_type_router(state)
+        budget_logger.info(f"Routing based on structured route: {route}")
+        return route
+
+    def _after_db_router(self, state: GraphState) -> Union[bool, str]:
+        """Conditional routing after the DB node: regenerate a rejected query, else continue by request type"""
+        if state.sql_rejection and state.sql_attempts < self.max_sql_attempts:
+            route = "regenerate_" + ("get_data_true" if state.request_type == RequestType.GET
+                                     else self._what_type_router(state))
+            metrics.increment("budget_planner.sql.regenerated")
+            budget_logger.info(f"Routing based on SQL rejection: {route}")
+            return route
+        return state.request_type == RequestType.GET
+
     def _post_or_response(self, state: GraphState) -> str:
         """Conditional routing for post_or_response decision"""
         route = "generate_post" if state.generate_post else "generate_response"
         budget_logger.info(f"Routing based on generate_post: {route}")
         return route
 
+    def _check_budget(self, state: GraphState, llm_call: bool = False) -> Optional[LimitReason]:
+        """Return the limit that stops this request, if any"""
+        if state.limit_reached:
+            return state.limit_reached
+        if state.deadline is not None and time.time() >= state.deadline:
+            return LimitReason.DEADLINE
+        if llm_call and state.llm_calls >= state.max_llm_calls:
+            return LimitReason.MAX_LLM_CALLS
+        return None
+
+    def _remaining_ms(self, state: GraphState) -> Optional[int]:
+        """Milliseconds left before the request deadline (None when there is no deadline)"""
+        if state.deadline is None:
+            return None
+        return max(1, int((state.deadline - time.time()) * 1000))
+
+    def _limit_update(self, limit: LimitReason) -> Dict:
+        """State update that ends the request because an execution limit fired"""
+        budget_logger.warning(f"Execution budget exhausted: {LimitReason(limit).value}")
+        return {"limit_reached": limit}
+
+    def _llm_node(self, build_prompt: Callable, handle_response: Callable) -> Tuple[Callable, Callable]:
+        """
+        Combine a prompt builder and a response handler into sync (invoke) and
+        async (ainvoke) node implementations.
+        
+        build_prompt returns the per-request part of the prompt (sent after the shared
+        system prompt), or a state update dict to skip the LLM call.
+        Every call is checked against the request's execution budget first.
+        """
+        def prepare(state: GraphState):
+            limit = self._check_budget(state)
+            if limit:
+                return self._limit_update(limit)
+            request = build_prompt(state)
+            if isinstance(request, dict):
+                return request
+            limit = self._check_budget(state, llm_call=True)
+            if limit:
+                return self._limit_update(limit)
+            return self._messages(request)
+
+        def node(state: GraphState) -> Dict:
+            request = prepare(state)
+            if isinstance(request, dict):
+                return request
+            response = self.llm.invoke(request)
+            record_llm_usage(response)
+            update = handle_response(state, response)
+            return {**update, "llm_calls": state.llm_calls + 1}
+
+        async def anode(state: GraphState) -> Dict:
+            request = prepare(state)
+            if isinstance(request, dict):
+                return request
+            remaining_ms = self._remaining_ms(state)
+            try:
+                response = await asyncio.wait_for(
+                    self.llm.ainvoke(request),
+                    timeout=remaining_ms / 1000 if remaining_ms is not None else None
+                )
+            except asyncio.TimeoutError:
+                return {**self._limit_update(LimitReason.DEADLINE), "llm_calls": state.llm_calls + 1}
+            record_llm_usage(response)
+            update = handle_response(state, response)
+            return {**update, "llm_calls": state.llm_calls + 1}
+
+        return node, anode
+
+    def _node(self, name: str, func: Callable, afunc: Optional[Callable] = None) -> RunnableLambda:
+        """Wrap node implementations so each execution is timed and traced under its graph node name"""
+        def traced(state: GraphState) -> Dict:
+            with node_span(name):
+                return func(state)
+
+        async def atraced(state: GraphState) -> Dict:
+            with node_span(name):
+                if afunc is None:
+                    return func(state)
+                return await afunc(state)
+
+        return RunnableLambda(traced, afunc=atraced, name=name)
+
+    def _finish_partial(self, state: GraphState) -> Dict:
+        """End the request with a partial answer, without another LLM call, once a limit fired."""
+        limit = LimitReason(state.limit_reached)
+        metrics.increment(f"budget_planner.limit.{limit.value}")
+        budget_logger.warning(f"Ending request early with a partial answer ({limit.value})")
+        
+        within = "in time" if limit == LimitReason.DEADLINE else "within the allowed number of steps"
+        if isinstance(state.db_data, dict) and state.db_data.get("success"):
+            response = (f"Your request was saved ({state.db_data.get('rows_affected', 0)} rows updated), "
+                        f"but I couldn't confirm the details {within}.")
+        elif state.db_data is not None and not (isinstance(state.db_data, dict) and "error" in state.db_data):
+            data = format_db_data(state.db_data)
+            if len(data) > 1500:
+                data = data[:1500] + "\n..."
+            response = f"I couldn't finish answering {within}, but here is the data I found:\n{data}"
+        else:
+            response = (f"Sorry, I couldn't complete your request {within}. "
+                        "Please try again or ask a simpler question.")
+        return {"response": response}
+
+    def _guarded(self, router: Callable) -> Callable:
+        """Wrap a conditional router so an exhausted execution budget diverts to finish_partial"""
+        def route(state: GraphState):
+            if state.limit_reached:
+                return "budget_exhausted"
+            return router(state)
+        return route
+
     def _create_workflow(self):
         """Create the LangGraph workflow for budget planning"""
         budget_logger.info("Creating LangGraph workflow")
@@ -365,36 +913,85 @@ class BudgetPlanner:
 
         # Add nodes
         budget_logger.debug("Adding nodes to workflow graph")
-        workflow.add_node("determine_request_type", self._determine_request_type)
-        workflow.add_node("determine_get_data", self._determine_get_data)
-        workflow.add_node("determine_post_type", self._determine_post_type)
-        workflow.add_node("generate_sql_query_get", self._generate_sql_query)
-        workflow.add_node("generate_sql_query_readjust", self._generate_sql_query)
-        workflow.add_node("generate_sql_query_new_expense", self._generate_sql_query)
-        workflow.add_node("generate_sql_query_goals", self._generate_sql_query)
-        workflow.add_node("get_data_from_db", self._get_data_from_db)
-        workflow.add_node("determine_generate_post", self._determine_generate_post)
-        workflow.add_node("create_query", self._create_query)
-        workflow.add_node("generate_response", self._generate_response)
+        workflow.add_node("determine_request_type", self._node("determine_request_type", *self._llm_node(
+            self._determine_request_type_prompt, self._determine_request_type)))
+        workflow.add_node("determine_get_data", self._node("determine_get_data", *self._llm_node(
+            self._determine_get_data_prompt, self._determine_get_data)))
+        workflow.add_node("determine_post_type", self._node("determine_post_type", *self._llm_node(
+            self._determine_post_type_prompt, self._determine_post_type)))
+        generate_sql_query = self._llm_node(self._generate_sql_query_prompt, self._generate_sql_query)
+        for node in ("generate_sql_query_get", "generate_sql_query_readjust",
+                     "generate_sql_query_new_expense", "generate_sql_query_goals"):
+            workflow.add_node(node, self._node(node, *generate_sql_query))
+        workflow.add_node("get_data_from_db", self._node(
+            "get_data_from_db", self._get_data_from_db, self._aget_data_from_db))
+        workflow.add_node("determine_generate_post", self._node("determine_generate_post", *self._llm_node(
+            self._determine_generate_post_prompt, self._determine_generate_post)))
+        workflow.add_node("create_query", self._node("create_query", *self._llm_node(
+            self._create_query_prompt, self._create_query)))
+        workflow.add_node("generate_response", self._node("generate_response", *self._llm_node(
+            self._generate_response_prompt, self._generate_response)))
+        if self.router_mode == RouterMode.STRUCTURED:
+            workflow.add_node("route_request", self._node("route_request", *self._llm_node(
+                self._route_request_prompt, self._route_request)))
+            llm_entry_point = "route_request"
+        else:
+            llm_entry_point = "determine_request_type"
+        if self.intent_classifier is not None:
+            workflow.add_node("fast_route", self._node("fast_route", self._fast_route))
+            entry_point = "fast_route"
+        else:
+            entry_point = llm_entry_point
+
+        workflow.add_node("finish_partial", self._node("finish_partial", self._finish_partial))
+
+        def add_edges(source: str, router: Callable, routes: Dict) -> None:
+            # Every edge first checks the execution budget
+            workflow.add_conditional_edges(
+                source,
+                self._guarded(router),
+                {**routes, "budget_exhausted": "finish_partial"}
+            )
 
         # Add edges
         budget_logger.debug("Adding edges to workflow graph")
         # For GET request
-        workflow.add_conditional_edges(
+        add_edges(
             "determine_request_type",
             lambda state: state.request_type == RequestType.GET,
             {True: "determine_get_data", False: "determine_post_type"}
         )
 
+        # For the local classifier and the single-call router, jump straight to the SQL generation node
+        direct_routes = {
+            "get_data_true": "generate_sql_query_get",
+            "get_data_false": "generate_response",
+            "readjust_budget": "generate_sql_query_readjust",
+            "new_expense": "generate_sql_query_new_expense",
+            "create_goals": "generate_sql_query_goals"
+        }
+        if self.intent_classifier is not None:
+            add_edges(
+                "fast_route",
+                self._structured_router,
+                {**direct_routes, "fallback": llm_entry_point}
+            )
+        if self.router_mode == RouterMode.STRUCTURED:
+            add_edges(
+                "route_request",
+                self._structured_router,
+                {**direct_routes, "fallback": "determine_request_type"}
+            )
+
         # For determining whether to get data
-        workflow.add_conditional_edges(
+        add_edges(
             "determine_get_data",
             self._should_get_data,
-            {"get_data_true": "generate_sql_query_get", "get_data_false": END}
+            {"get_data_true": "generate_sql_query_get", "get_data_false": "generate_response"}
         )
 
         # For handling different POST types
-        workflow.add_conditional_edges(
+        add_edges(
             "determine_post_type",
             self._what_type_router,
             {
@@ -405,55 +1002,229 @@ class BudgetPlanner:
         )
 
         # For database operations
-        workflow.add_edge("generate_sql_query_get", "get_data_from_db")
-        workflow.add_edge("generate_sql_query_readjust", "get_data_from_db")
-        workflow.add_edge("generate_sql_query_new_expense", "get_data_from_db")
-        workflow.add_edge("generate_sql_query_goals", "get_data_from_db")
+        for node in ("generate_sql_query_get", "generate_sql_query_readjust",
+                     "generate_sql_query_new_expense", "generate_sql_query_goals"):
+            add_edges(node, lambda state: "next", {"next": "get_data_from_db"})
 
         # For handling database results based on request type
-        workflow.add_conditional_edges(
+        # A query rejected by the SQL guard goes back to its SQL generation node
+        add_edges(
             "get_data_from_db",
-            lambda state: state.request_type == RequestType.GET,
-            {True: "determine_generate_post", False: "generate_response"}
+            self._after_db_router,
+            {True: "determine_generate_post", False: "generate_response",
+             **{f"regenerate_{route}": node for route, node in direct_routes.items()
+                if node.startswith("generate_sql_query")}}
         )
 
         # For deciding whether to create a new query or generate response
-        workflow.add_conditional_edges(
+        add_edges(
             "determine_generate_post",
             self._post_or_response,
             {"generate_post": "create_query", "generate_response": "generate_response"}
         )
 
         # Complete the loop or end
-        workflow.add_edge("create_query", "determine_request_type")
-        workflow.add_edge("generate_response", END)
+        add_edges("create_query", lambda state: "next", {"next": entry_point})
+        add_edges("generate_response", lambda state: "next", {"next": END})
+        workflow.add_edge("finish_partial", END)
 
         # Set the entry point
-        workflow.set_entry_point("determine_request_type")
+        workflow.set_entry_point(entry_point)
 
         # Compile the graph
         budget_logger.info("Compiling workflow graph")
         return workflow.compile()
 
-    def process_query(self, user_query: str) -> str:
+    def _initial_state(self, user_query: str, user_id: int,
+                       context: Optional[ConversationContext] = None) -> Dict:
+        """Initial graph state carrying the request's execution budget and session context"""
+        state = {
+            "prompt": user_query,
+            "user_id": user_id,
+            "max_iterations": self.max_iterations,
+            "max_llm_calls": self.max_llm_calls,
+            "deadline": time.time() + self.request_timeout if self.request_timeout else None
+        }
+        if context is not None:
+            state["history"] = self.memory.render(context)
+            state["previous_db_data"] = context.last_db_data
+        return state
+
+    async def _load_context(self, user_id: int, session_id: Optional[str]) -> Optional[ConversationContext]:
+        """Load the session's bounded context, if session memory is enabled and a session was given"""
+        if session_id is None or self.memory is None:
+            return None
+        return await self.memory.load(user_id, session_id)
+
+    async def _remember(self, user_id: int, session_id: Optional[str], user_query: str, result: Dict) -> None:
+        """Record a finished turn in the session"""
+        if session_id is None or self.memory is None:
+            return
+        db_data = result.get("db_data")
+        # Only successful GET results are offered for reuse; after a write they would be stale
+        if result.get("request_type") != RequestType.GET or (isinstance(db_data, dict) and "error" in db_data):
+            db_data = None
+        await self.memory.record_turn(user_id, session_id, user_query, result.get("response") or "", db_data)
+
+    def process_query(self, user_query: str, user_id: int = 1, request_id: Optional[str] = None) -> str:
         """
         Process a user query through the budget planning system
         
         Args:
             user_query: The user's budget-related query
+            user_id: Id of the user the query is about (bound into generated SQL)
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
             
         Returns:
             Response to the user's query
         """
         budget_logger.info(f"Processing budget query: {user_query[:50]}...")
         
+        with trace_request("budget_chat", request_id) as trace:
+            try:
+                budget_logger.debug("Invoking workflow with user query")
+                result = self.workflow.invoke(self._initial_state(user_query, user_id))
+                budget_logger.info("Budget query processed successfully")
+                return result["response"]
+            except Exception as e:
+                error_msg = f"Error processing budget query: {str(e)}"
+                log_processing_error(error_msg)
+                budget_logger.error(error_msg, exc_info=True)
+                return f"Error processing your request: {str(e)}"
+            finally:
+                trace.log(budget_logger)
+
+    async def aprocess_query(self, user_query: str, user_id: int = 1, request_id: Optional[str] = None,
+                             session_id: Optional[str] = None) -> str:
+        """
+        Process a user query through the budget planning system without blocking the event loop
+        
+        Args:
+            user_query: The user's budget-related query
+            user_id: Id of the user the query is about (bound into generated SQL)
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
+            session_id: Chat session to continue; its recent turns and rolling summary
+                are added to the prompts and the turn is recorded afterwards
+            
+        Returns:
+            Response to the user's query
+        """
+        budget_logger.info(f"Processing budget query (async): {user_query[:50]}...")
+        
         try:
-            budget_logger.debug("Invoking workflow with user query")
-            result = self.workflow.invoke({"prompt": user_query})
+            response = await self._arun_query(user_query, user_id, request_id, session_id)
             budget_logger.info("Budget query processed successfully")
-            return result["response"]
+            return response
         except Exception as e:
             error_msg = f"Error processing budget query: {str(e)}"
             log_processing_error(error_msg)
             budget_logger.error(error_msg, exc_info=True)
-            return f"Error processing your request: {str(e)}"
\ No newline at end of file
+            return f"Error processing your request: {str(e)}"
+
+    async def _arun_query(self, user_query: str, user_id: int, request_id: Optional[str],
+                          session_id: Optional[str] = None) -> str:
+        """Run the workflow once under a request trace, letting errors propagate"""
+        with trace_request("budget_chat", request_id) as trace:
+            try:
+                context = await self._load_context(user_id, session_id)
+                budget_logger.debug("Invoking workflow asynchronously with user query")
+                result = await self.workflow.ainvoke(self._initial_state(user_query, user_id, context))
+                response = result["response"]
+                await self._remember(user_id, session_id, user_query, result)
+                return response
+            finally:
+                trace.log(budget_logger)
+
+    async def abatch_process_queries(self, queries: List[Tuple[Any, ...]], concurrency: int = 8,
+                                     request_id: Optional[str] = None) -> List[Dict[str, Optional[str]]]:
+        """
+        Process many user queries concurrently
+        
+        At most concurrency workflows run at once, so a large batch keeps the
+        model busy without exceeding its rate limits. One failing query does
+        not affect the others. Queries continuing the same chat session run one
+        after the other, in input order, so each sees the turns before it.
+        
+        Args:
+            queries: (user_query, user_id) or (user_query, user_id, session_id) tuples
+            concurrency: Maximum number of queries in flight
+            request_id: Id of the batch; item i is traced as "<request_id>-<i>"
+            
+        Returns:
+            One {"response": ..., "error": ...} dict per query, in input order
+        """
+        batch_id = request_id or current_request_id() or uuid.uuid4().hex
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        budget_logger.info(f"Processing batch of {len(queries)} budget queries (concurrency {concurrency})")
+        
+        # asyncio.Lock wakes waiters in order, and the tasks reach their lock in input order
+        session_locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+        
+        async def run(index: int, user_query: str, user_id: int,
+                      session_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+            session_lock = contextlib.nullcontext() if session_id is None \
+                else session_locks.setdefault((user_id, session_id), asyncio.Lock())
+            async with session_lock, semaphore:
+                try:
+                    response = await self._arun_query(user_query, user_id, f"{batch_id}-{index}", session_id)
+                    return {"response": response, "error": None}
+                except Exception as e:
+                    error_msg = f"Error processing batch item {index}: {str(e)}"
+                    log_processing_error(error_msg)
+                    budget_logger.error(error_msg, exc_info=True)
+                    metrics.increment("budget_planner.batch.errors")
+                    return {"response": None, "error": str(e)}
+        
+        results = await asyncio.gather(*(run(index, *query) for index, query in enumerate(queries)))
+        metrics.increment("budget_planner.batch.items", len(queries))
+        return list(results)
+
+    async def astream_query(self, user_query: str, user_id: int = 1, request_id: Optional[str] = None,
+                            session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream progress for a user query: one event per completed node, then
+        the tokens of the final response as the model produces them
+        
+        Args:
+            user_query: The user's budget-related query
+            user_id: Id of the user the query is about (bound into generated SQL)
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
+            session_id: Chat session to continue (see aprocess_query)
+            
+        Yields:
+            Event dicts: {"event": "node", "node": ...}, {"event": "token", "text": ...},
+            then {"event": "done", "response": ...} or {"event": "error", "detail": ...}
+        """
+        budget_logger.info(f"Streaming budget query: {user_query[:50]}...")
+        response = None
+        result: Dict[str, Any] = {}
+        
+        with trace_request("budget_chat", request_id) as trace:
+            try:
+                context = await self._load_context(user_id, session_id)
+                async for mode, chunk in self.workflow.astream(
+                    self._initial_state(user_query, user_id, context),
+                    stream_mode=["updates", "messages"]
+                ):
+                    if mode == "messages":
+                        message, metadata = chunk
+                        text = message_text(message)
+                        if metadata.get("langgraph_node") == "generate_response" and text:
+                            yield {"event": "token", "text": text}
+                    else:
+                        for node, update in chunk.items():
+                            if node in ("generate_response", "finish_partial") and update:
+                                response = update.get("response")
+                            result.update(update or {})
+                            yield {"event": "node", "node": node}
+                budget_logger.info("Budget query streamed successfully")
+                # Record the turn before the final event, the client may disconnect right after it
+                await self._remember(user_id, session_id, user_query, result)
+                yield {"event": "done", "response": response}
+            except Exception as e:
+                error_msg = f"Error processing budget query: {str(e)}"
+                log_processing_error(error_msg)
+                budget_logger.error(error_msg, exc_info=True)
+                yield {"event": "error", "detail": f"Error processing your request: {str(e)}"}
+            finally:
+                trace.log(budget_logger)
@@ -0,0 +1,351 @@
+"""
+Bounded conversation memory for budget chat sessions.
+
+Sessions live in the backend's Mongo chat_history collection, in the
+ChatSession/ChatMessage document shape (backend/app/models/chat.py). Each
+turn loads only the most recent messages; older messages are folded into a
+rolling summary in ChatSession.context, updated incrementally from the
+previous summary plus the messages that just aged out. Prompt size therefore
+stays bounded however long a conversation runs. The context also keeps the
+previous turn's db_data, so a follow-up question can reuse it instead of
+querying the database again. Without Mongo, sessions are kept in process
+memory by InMemorySessionStore, which caps the number of sessions, the
+messages per session and how long an idle session is kept.
+"""
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from langchain_core.language_models import BaseChatModel
+
+from logger import setup_logger
+from metrics import metrics
+from prompt_format import format_value
+from instrumentation import record_llm_usage
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo import ReturnDocument
+except ImportError:  # Mongo driver is optional, sessions then live in process memory
+    AsyncIOMotorClient = None
+
+memory_logger = setup_logger("chat_memory")
+
+class ConversationContext(NamedTuple):
+    """What a new turn sees of the conversation so far"""
+    summary: str
+    messages: List[Dict[str, Any]]
+    last_db_data: Optional[Any]
+
+EMPTY_CONTEXT = ConversationContext(summary="", messages=[], last_db_data=None)
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _filter(user_id: int, session_id: str) -> Dict[str, Any]:
+    return {"session_id": session_id, "user_id": user_id}
+
+class MongoSessionStore:
+    """ChatSession documents in the backend's Mongo chat_history collection"""
+
+    def __init__(self, url: str, database: str = "budget_tracker", collection: str = "chat_history"):
+        """
+        Initialize the store (motor connects on demand)
+
+        Args:
+            url: MongoDB connection string
+            database: Database name (the backend uses budget_tracker)
+            collection: Collection name (the backend uses chat_history)
+        """
+        if AsyncIOMotorClient is None:
+            raise ImportError("motor is required for MongoSessionStore")
+        self.client = AsyncIOMotorClient(url)
+        self.collection = self.client[database][collection]
+        self._indexed = False
+
+    async def _ensure_index(self) -> None:
+        if not self._indexed:
+            await self.collection.create_index([("session_id", 1), ("user_id", 1)])
+            self._indexed = True
+
+    async def load(self, user_id: int, session_id: str, last_messages: int) -> Optional[Dict[str, Any]]:
+        """Return the session's context and its last last_messages messages, or None"""
+        await self._ensure_index()
+        return await self.collection.find_one(
+            _filter(user_id, session_id),
+            {"_id": 0, "context": 1, "messages": {"$slice": -last_messages}}
+        )
+
+    async def messages(self, user_id: int, session_id: str, start: int, count: int) -> List[Dict[str, Any]]:
+        """Return count messages starting at index start"""
+        document = await self.collection.find_one(
+            _filter(user_id, session_id),
+            {"_id": 0, "messages": {"$slice": [start, count]}}
+        )
+        return document["messages"] if document else []
+
+    async def append(self, user_id: int, session_id: str, messages: List[Dict[str, Any]],
+                     context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Append messages, count them and update context fields in one atomic update,
+        creating the session if needed
+
+        Returns:
+            The session context after the update (message_count includes these messages)
+        """
+        now = _now()
+        document = await self.collection.find_one_and_update(
+            _filter(user_id, session_id),
+            {
+                "$push": {"messages": {"$each": messages}},
+                "$inc": {"context.message_count": len(messages)},
+                "$set": {**{f"context.{key}": value for key, value in context.items()}, "updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            },
+            projection={"_id": 0, "context": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return document["context"]
+
+    async def update_context(self, user_id: int, session_id: str, context: Dict[str, Any],
+                             summarized_count: int) -> bool:
+        """
+        Update context fields of an existing session, unless another turn has already
+        moved its summarized_count on from the value the update was based on
+
+        Returns:
+            True when the update was applied
+        """
+        # A session that was never summarized has no summarized_count field yet
+        expected = {"$in": [0, None]} if summarized_count == 0 else summarized_count
+        result = await self.collection.update_one(
+            {**_filter(user_id, session_id), "context.summarized_count": expected},
+            {"$set": {f"context.{key}": value for key, value in context.items()}}
+        )
+        return result.matched_count > 0
+
+    async def aclose(self) -> None:
+        self.client.close()
+
+class InMemorySessionStore:
+    """
+    Process-local session store with the same interface, used when Mongo is not configured
+
+    Memory is bounded: at most max_sessions sessions are kept (the least recently used is dropped
+    first), sessions idle for idle_seconds are dropped, and each session keeps its last max_messages
+    messages. Messages dropped from the front keep their indices, so messages() still addresses
+    them the way the Mongo store does.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_messages: int = 100, idle_seconds: float = 3600.0):
+        """
+        Initialize the store
+
+        Args:
+            max_sessions: Most sessions kept at once
+            max_messages: Most messages kept per session (older ones are dropped)
+            idle_seconds: Sessions not used for this long are dropped
+        """
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+    def _evict(self) -> None:
+        # Sessions are kept in least recently used order, so idle ones are at the front
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._sessions and next(iter(self._sessions.values()))["last_used"] < cutoff:
+            self._sessions.popitem(last=False)
+            metrics.increment("chat_memory.sessions.expired")
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            metrics.increment("chat_memory.sessions.evicted")
+
+    def _get(self, user_id: int, session_id: str) -> Optional[Dict[str, Any]]:
+        self._evict()
+        session = self._sessions.get((user_id, session_id))
+        if session is not None:
+            session["last_used"] = time.monotonic()
+            self._sessions.move_to_end((user_id, session_id))
+        return session
+
+    async def load(self, user_id: int, session_id: str, last_messages: int) -> Optional[Dict[str, Any]]:
+        session = self._get(user_id, session_id)
+        if session is None:
+            return None
+        messages = session["messages"][-last_messages:] if last_messages else []
+        return {"context": dict(session["context"]), "messages": messages}
+
+    async def messages(self, user_id: int, session_id: str, start: int, count: int) -> List[Dict[str, Any]]:
+        session = self._get(user_id, session_id)
+        if session is None:
+            return []
+        start -= session["dropped"]
+        return session["messages"][max(start, 0):max(start + count, 0)]
+
+    async def append(self, user_id: int, session_id: str, messages: List[Dict[str, Any]],
+                     context: Dict[str, Any]) -> Dict[str, Any]:
+        now = _now()
+        session = self._get(user_id, session_id)
+        if session is None:
+            session = self._sessions[(user_id, session_id)] = {
+                **_filter(user_id, session_id), "messages": [], "context": {}, "created_at": now,
+                "dropped": 0, "last_used": time.monotonic()
+            }
+            self._evict()
+        # No await between reading and writing the count, so concurrent turns cannot interleave here
+        session["messages"].extend(messages)
+        overflow = len(session["messages"]) - self.max_messages
+        if overflow > 0:
+            del session["messages"][:overflow]
+            session["dropped"] += overflow
+        session["context"].update(context)
+        session["context"]["message_count"] = session["context"].get("message_count", 0) + len(messages)
+        session["updated_at"] = now
+        return dict(session["context"])
+
+    async def update_context(self, user_id: int, session_id: str, context: Dict[str, Any],
+                             summarized_count: int) -> bool:
+        session = self._get(user_id, session_id)
+        if session is None or session["context"].get("summarized_count", 0) != summarized_count:
+            return False
+        session["context"].update(context)
+        return True
+
+    async def aclose(self) -> None:
+        self._sessions.clear()
+
+class ConversationMemory:
+    """Loads bounded context for a session turn and records turns with a rolling summary"""
+
+    def __init__(self, store, llm: BaseChatModel, recent_messages: int = 6, summarize_batch: int = 4,
+                 max_message_chars: int = 600, max_summary_words: int = 150):
+        """
+        Initialize the memory
+
+        Args:
+            store: MongoSessionStore or InMemorySessionStore
+            llm: Chat model used to update the rolling summary
+            recent_messages: Messages kept verbatim in the prompt
+            summarize_batch: Aged-out messages collected before the summary is updated
+            max_message_chars: Longer messages are cut to this length in the prompt
+            max_summary_words: Upper bound on the rolling summary length
+        """
+        self.store = store
+        self.llm = llm
+        self.recent_messages = recent_messages
+        self.summarize_batch = summarize_batch
+        self.max_message_chars = max_message_chars
+        self.max_summary_words = max_summary_words
+
+    async def load(self, user_id: int, session_id: str) -> ConversationContext:
+        """
+        Load the rolling summary, the unsummarized recent messages and the previous db_data
+
+        At most recent_messages + summarize_batch messages are read, whatever the session length.
+        """
+        try:
+            document = await self.store.load(user_id, session_id, self.recent_messages + self.summarize_batch)
+        except Exception as e:
+            memory_logger.warning(f"Could not load chat session {session_id}: {str(e)}")
+            metrics.increment("chat_memory.load.failures")
+            return EMPTY_CONTEXT
+        if not document:
+            return EMPTY_CONTEXT
+
+        context = document.get("context") or {}
+        unsummarized = context.get("message_count", 0) - context.get("summarized_count", 0)
+        messages = document.get("messages", [])
+        messages = messages[len(messages) - min(len(messages), max(unsummarized, 0)):]
+        metrics.increment("chat_memory.sessions.loaded")
+        return ConversationContext(
+            summary=context.get("summary", ""),
+            messages=messages,
+            last_db_data=context.get("last_db_data")
+        )
+
+    def render(self, context: ConversationContext) -> str:
+        """Render the context as prompt text (empty for a new session)"""
+        lines = []
+        if context.summary:
+            lines.append(f"Summary of earlier conversation: {context.summary}")
+        for message in context.messages:
+            content = message["content"]
+            if len(content) > self.max_message_chars:
+                content = content[:self.max_message_chars] + "..."
+            lines.append(f"{message['role']}: {content}")
+        return "\n".join(lines)
+
+    async def record_turn(self, user_id: int, session_id: str, prompt: str, response: str,
+                          db_data: Optional[Any] = None) -> None:
+        """
+        Append a user/assistant turn and fold aged-out messages into the summary
+
+        Args:
+            user_id: Owner of the session
+            session_id: Session id
+            prompt: The user's message
+            response: The assistant's answer
+            db_data: Data the answer was based on, kept for follow-ups (None clears it)
+        """
+        try:
+            now = _now()
+            # The store counts the messages atomically, so concurrent turns of a session each see their own count
+            context = await self.store.append(
+                user_id, session_id,
+                [{"role": "user", "content": prompt, "timestamp": now},
+                 {"role": "assistant", "content": response, "timestamp": now}],
+                {"last_db_data": _json_safe(db_data)}
+            )
+            message_count = context["message_count"]
+            summarized_count = context.get("summarized_count", 0)
+            aged_out = message_count - self.recent_messages - summarized_count
+            if aged_out >= self.summarize_batch:
+                await self._update_summary(user_id, session_id, context.get("summary", ""),
+                                           summarized_count, aged_out)
+        except Exception as e:
+            memory_logger.warning(f"Could not record turn for chat session {session_id}: {str(e)}")
+            metrics.increment("chat_memory.record.failures")
+
+    async def _update_summary(self, user_id: int, session_id: str, summary: str,
+                              summarized_count: int, aged_out: int) -> None:
+        messages = await self.store.messages(user_id, session_id, summarized_count, aged_out)
+        transcript = "\n".join(f"{message['role']}: {message['content'][:self.max_message_chars]}"
+                               for message in messages)
+        request = f"""
+        Update the running summary of a conversation between a user and a budget planning assistant.
+        Keep amounts, categories, dates and decisions the user or assistant mentioned, and any open questions.
+        Use at most {self.max_summary_words} words.
+
+        Current summary: {summary or "(none)"}
+
+        New messages:
+        {transcript}
+
+        Return only the updated summary.
+        """
+        response = await self.llm.ainvoke(request)
+        record_llm_usage(response)
+        words = response.content.strip().split()
+        applied = await self.store.update_context(user_id, session_id, {
+            "summary": " ".join(words[:self.max_summary_words]),
+            "summarized_count": summarized_count + len(messages)
+        }, summarized_count)
+        if not applied:
+            # A concurrent turn folded the same messages first
+            metrics.increment("chat_memory.summary.conflicts")
+            return
+        metrics.increment("chat_memory.summary.updates")
+        memory_logger.info(f"Folded {len(messages)} messages into the summary of chat session {session_id}")
+
+    async def aclose(self) -> None:
+        await self.store.aclose()
+
+def _json_safe(value: Any) -> Any:
+    """Convert dates and decimals so db_data can be stored in the session document"""
+    if value is None:
+        return None
+    return json.loads(json.dumps(value, default=format_value))
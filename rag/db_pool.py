@@ -0,0 +1,238 @@
+"""
+Pooled PostgreSQL connections for BudgetPlanner.
+
+PostgresPool keeps a bounded set of psycopg2 connections (sync path) and a
+psycopg 3 AsyncConnectionPool (async path). Connections are health-checked
+when they have been idle for a while and recycled once they exceed a maximum
+age. Transactions can be opened READ ONLY and always carry a statement_timeout.
+"""
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, Optional
+
+import psycopg2
+
+from logger import setup_logger
+from metrics import metrics
+
+try:
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # async driver is optional, the async path then uses a worker thread
+    AsyncConnectionPool = None
+
+pool_logger = setup_logger("db_pool")
+
+class PoolError(Exception):
+    """Raised when a connection cannot be checked out of the pool"""
+
+class PostgresPool:
+    """Bounded pool of PostgreSQL connections shared across requests"""
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10, max_age: float = 1800.0,
+                 health_check_after: float = 30.0, checkout_timeout: float = 10.0,
+                 statement_timeout_ms: int = 5000):
+        """
+        Initialize the pool (connections are opened lazily)
+
+        Args:
+            dsn: PostgreSQL connection string
+            min_size: Connections kept open by the async pool
+            max_size: Maximum number of connections open at once
+            max_age: Seconds after which a connection is closed and replaced
+            health_check_after: Idle seconds after which a connection is pinged before reuse
+            checkout_timeout: Seconds to wait for a free connection before failing
+            statement_timeout_ms: Per-statement timeout applied to every transaction
+        """
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+
+        self._idle = deque()  # (connection, created_at, last_used)
+        self._created_at: Dict[Any, float] = {}
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+        self._async_pool = None
+        self._async_pool_lock = asyncio.Lock()
+
+    # Sync (psycopg2) path
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn)
+        except psycopg2.Error as e:
+            raise PoolError(str(e)) from e
+        self._created_at[conn] = time.monotonic()
+        metrics.increment("db_pool.connections.created")
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._created_at.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if now - self._created_at.get(conn, now) > self.max_age:
+            metrics.increment("db_pool.connections.recycled")
+            return False
+        if now - last_used > self.health_check_after:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                metrics.increment("db_pool.health_check.failed")
+                return False
+        return True
+
+    def _checkout(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            metrics.increment("db_pool.checkout.timeouts")
+            raise PoolError(f"Timed out after {self.checkout_timeout}s waiting for a database connection")
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    conn = self._connect()
+                elif self._is_healthy(idle[0], idle[2]):
+                    conn = idle[0]
+                else:
+                    self._discard(idle[0])
+        except Exception:
+            self._slots.release()
+            raise
+        metrics.observe("db_pool.checkout.wait.seconds", time.perf_counter() - start)
+        metrics.increment("db_pool.checkouts")
+        return conn
+
+    def _checkin(self, conn, broken: bool = False) -> None:
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, self._created_at.get(conn, time.monotonic()), time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _timeout_ms(self, statement_timeout_ms: Optional[int]) -> int:
+        if statement_timeout_ms is None:
+            return int(self.statement_timeout_ms)
+        return int(min(statement_timeout_ms, self.statement_timeout_ms))
+
+    @contextmanager
+    def transaction(self, read_only: bool = False, statement_timeout_ms: Optional[int] = None):
+        """
+        Check out a connection and run one transaction on it
+
+        Commits when the block succeeds and rolls back when it raises.
+
+        Args:
+            read_only: Open the transaction as READ ONLY
+            statement_timeout_ms: Lower the pool's statement timeout for this transaction
+
+        Yields:
+            A psycopg2 connection inside an open transaction
+        """
+        conn = self._checkout()
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                if read_only:
+                    cursor.execute("SET TRANSACTION READ ONLY")
+                cursor.execute(f"SET LOCAL statement_timeout = {self._timeout_ms(statement_timeout_ms)}")
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self._checkin(conn, broken=broken or bool(conn.closed))
+
+    # Async (psycopg 3) path
+
+    async def _get_async_pool(self):
+        if self._async_pool is None:
+            async with self._async_pool_lock:
+                if self._async_pool is None:
+                    pool_logger.info("Opening async PostgreSQL connection pool")
+                    pool = AsyncConnectionPool(
+                        self.dsn,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        max_lifetime=self.max_age,
+                        max_idle=self.health_check_after * 10,
+                        timeout=self.checkout_timeout,
+                        check=AsyncConnectionPool.check_connection,
+                        open=False
+                    )
+                    await pool.open()
+                    self._async_pool = pool
+        return self._async_pool
+
+    @asynccontextmanager
+    async def atransaction(self, read_only: bool = False, statement_timeout_ms: Optional[int] = None):
+        """
+        Async twin of transaction() using psycopg 3
+
+        Yields:
+            A psycopg AsyncConnection inside an open transaction
+        """
+        pool = await self._get_async_pool()
+        start = time.perf_counter()
+        try:
+            conn = await pool.getconn()
+        except Exception as e:
+            metrics.increment("db_pool.checkout.timeouts")
+            raise PoolError(str(e)) from e
+        metrics.observe("db_pool.checkout.wait.seconds", time.perf_counter() - start)
+        metrics.increment("db_pool.checkouts")
+
+        try:
+            async with conn.transaction():
+                if read_only:
+                    await conn.execute("SET TRANSACTION READ ONLY")
+                await conn.execute(f"SET LOCAL statement_timeout = {self._timeout_ms(statement_timeout_ms)}")
+                yield conn
+        finally:
+            await pool.putconn(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the current pool sizes"""
+        with self._lock:
+            stats = {"idle": len(self._idle), "open": len(self._created_at), "max_size": self.max_size}
+        if self._async_pool is not None:
+            stats["async"] = self._async_pool.get_stats()
+        return stats
+
+    def close(self) -> None:
+        """Close every idle sync connection"""
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    async def aclose(self) -> None:
+        """Close the async pool and every idle sync connection"""
+        if self._async_pool is not None:
+            await self._async_pool.close()
+            self._async_pool = None
+            pool_logger.info("Closed async PostgreSQL connection pool")
+        self.close()
@@ -0,0 +1,157 @@
+"""
+Receipt image preprocessing before upload to the model.
+
+Phone photos arrive as 5-12 MB images at full sensor resolution. The model
+downscales anything above about 1568 px on the long edge anyway, so sending
+the original only adds upload time and image tokens. ImagePreprocessor
+applies the EXIF orientation, optionally converts to grayscale, shrinks the
+image to a maximum edge and recompresses it as JPEG or WebP. The async path
+runs in a thread pool (Pillow releases the GIL while decoding, resampling
+and encoding), so large uploads never block the event loop.
+
+Images Pillow cannot open are passed through unchanged.
+"""
+import io
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, NamedTuple, Optional, Union
+
+from logger import setup_logger
+from metrics import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, images are then sent as uploaded
+    Image = None
+
+preprocess_logger = setup_logger("image_preprocess")
+
+# Upper bounds for image payload sizes in bytes
+BYTE_BUCKETS = (50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000)
+
+FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+ORIENTATION_TAG = 0x0112
+
+class PreparedImage(NamedTuple):
+    """Image bytes to send to the model"""
+    data: Union[bytes, BinaryIO]
+    content_type: str
+    width: Optional[int]
+    height: Optional[int]
+
+class ImagePreprocessor:
+    """Orientation fix, optional grayscale, downscaling and recompression of receipt images"""
+
+    def __init__(self, max_edge: int = 1568, image_format: str = "JPEG", quality: int = 85,
+                 grayscale: bool = False, workers: int = 2):
+        """
+        Initialize the preprocessor (the thread pool is started on first async use)
+
+        Args:
+            max_edge: Longest edge in pixels after resizing
+            image_format: "JPEG" or "WEBP"
+            quality: Encoder quality (1-100)
+            grayscale: Convert to grayscale, which is enough for printed receipts and compresses better
+            workers: Threads used by apreprocess
+        """
+        image_format = image_format.upper()
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported image format {image_format!r}, use one of {', '.join(FORMATS)}")
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+        self.grayscale = grayscale
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if Image is None:
+            preprocess_logger.warning("Pillow is not installed, receipt images are sent unprocessed")
+
+    def preprocess(self, image_data: Union[bytes, BinaryIO], content_type: str) -> PreparedImage:
+        """
+        Prepare an uploaded image for the model
+
+        Args:
+            image_data: Raw upload bytes, or a seekable file holding them (decoded without loading it whole)
+            content_type: MIME type of the upload
+
+        Returns:
+            The recompressed image, or the upload itself (the same object) when it cannot be improved
+        """
+        original = PreparedImage(image_data, content_type, None, None)
+        if Image is None:
+            return original
+        start = time.perf_counter()
+        if isinstance(image_data, (bytes, bytearray)):
+            size_in, source = len(image_data), io.BytesIO(image_data)
+        else:
+            size_in, source = image_data.seek(0, io.SEEK_END), image_data
+            image_data.seek(0)
+        try:
+            image = Image.open(source)
+            source_size = image.size
+            # Let the JPEG decoder scale down by a power of two while decoding,
+            # as long as the long edge stays at or above max_edge
+            scale = self.max_edge / max(source_size)
+            if scale < 1:
+                image.draft(image.mode if image.mode in ("RGB", "L") else "RGB",
+                            (math.ceil(source_size[0] * scale), math.ceil(source_size[1] * scale)))
+            changed = image.size != source_size or image.getexif().get(ORIENTATION_TAG, 1) != 1
+            image = ImageOps.exif_transpose(image)
+            if max(image.size) > self.max_edge:
+                image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+                changed = True
+            image = self._convert_mode(image)
+            # Drop comments and other metadata: they are useless to the model, and identical
+            # pixels then always encode to identical bytes
+            image.info = {}
+            output = io.BytesIO()
+            image.save(output, format=self.image_format, quality=self.quality)
+        except Exception as e:
+            metrics.increment("receipt.preprocess.failures")
+            preprocess_logger.warning(f"Could not preprocess {content_type} image, sending it unchanged: {str(e)}")
+            return original
+
+        data = output.getvalue()
+        if len(data) >= size_in and not changed and not self.grayscale:
+            # Already small enough and upright: recompressing would only lose quality
+            prepared = PreparedImage(image_data, content_type, image.width, image.height)
+        else:
+            prepared = PreparedImage(data, FORMATS[self.image_format], image.width, image.height)
+        metrics.observe("receipt.preprocess.seconds", time.perf_counter() - start)
+        size_out = size_in if prepared.data is image_data else len(prepared.data)
+        metrics.observe("receipt.image.bytes_in", size_in, buckets=BYTE_BUCKETS)
+        metrics.observe("receipt.image.bytes_out", size_out, buckets=BYTE_BUCKETS)
+        preprocess_logger.info(f"Prepared receipt image: {size_in} -> {size_out} bytes, "
+                               f"{source_size[0]}x{source_size[1]} -> {image.width}x{image.height}")
+        return prepared
+
+    async def apreprocess(self, image_data: Union[bytes, BinaryIO], content_type: str) -> PreparedImage:
+        """Run preprocess in the thread pool"""
+        if Image is None:
+            return PreparedImage(image_data, content_type, None, None)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="receipt-image")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.preprocess, image_data, content_type)
+
+    def _convert_mode(self, image):
+        if self.grayscale:
+            return image.convert("L")
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # JPEG has no alpha channel: flatten transparent areas onto white paper
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            return background
+        if image.mode not in ("RGB", "L"):
+            return image.convert("RGB")
+        return image
+
+    def close(self) -> None:
+        """Stop the thread pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,126 @@
+"""
+Per-node instrumentation for the LangGraph workflows.
+
+A RequestTrace collects one entry per executed node (latency, LLM token
+counts, DB time and row counts) for a single request. The trace and the
+currently running node live in context variables, so LLM and DB helpers deep
+inside a node can record into them without threading state through the graph.
+Every value is also aggregated into process-wide histograms in metrics.
+"""
+import json
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from metrics import metrics, COUNT_BUCKETS
+
+_current_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+_current_node: contextvars.ContextVar = contextvars.ContextVar("node_span", default=None)
+
+class RequestTrace:
+    """Per-request breakdown of node timings, token counts and DB work"""
+
+    def __init__(self, workflow: str, request_id: Optional[str] = None):
+        self.workflow = workflow
+        self.request_id = request_id or _current_request_id.get() or uuid.uuid4().hex
+        self.nodes: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the breakdown with request-level totals"""
+        return {
+            "request_id": self.request_id,
+            "workflow": self.workflow,
+            "total_seconds": round(time.perf_counter() - self._start, 4),
+            "llm_calls": sum(node.get("llm_calls", 0) for node in self.nodes),
+            "input_tokens": sum(node.get("input_tokens", 0) for node in self.nodes),
+            "output_tokens": sum(node.get("output_tokens", 0) for node in self.nodes),
+            "cache_read_tokens": sum(node.get("cache_read_tokens", 0) for node in self.nodes),
+            "cache_write_tokens": sum(node.get("cache_write_tokens", 0) for node in self.nodes),
+            "nodes": self.nodes,
+        }
+
+    def log(self, logger) -> None:
+        """Write the breakdown to the given logger under the request id"""
+        summary = self.summary()
+        metrics.observe(f"request.{self.workflow}.seconds", summary["total_seconds"])
+        logger.info(f"[request_id={self.request_id}] breakdown: {json.dumps(summary)}")
+
+def set_request_id(request_id: str) -> contextvars.Token:
+    """Bind a request id (e.g. from the X-Request-ID header) to the current context"""
+    return _current_request_id.set(request_id)
+
+def reset_request_id(token: contextvars.Token) -> None:
+    """Undo set_request_id"""
+    _current_request_id.reset(token)
+
+def current_request_id() -> Optional[str]:
+    """Return the request id bound to the current context, if any"""
+    return _current_request_id.get()
+
+@contextmanager
+def trace_request(workflow: str, request_id: Optional[str] = None):
+    """Start a RequestTrace for the duration of the block"""
+    trace = RequestTrace(workflow, request_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def node_span(node: str):
+    """Time one node execution and collect what it records into the current trace"""
+    entry: Dict[str, Any] = {"node": node}
+    token = _current_node.set(entry)
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        _current_node.reset(token)
+        entry["seconds"] = round(time.perf_counter() - start, 4)
+        metrics.observe(f"node.{node}.seconds", entry["seconds"])
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.nodes.append(entry)
+
+def record_llm_usage(message: Any) -> None:
+    """Record the token usage (including prompt-cache reads and writes) of an LLM response for the running node"""
+    entry = _current_node.get()
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    tokens = {
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "cache_read_tokens": details.get("cache_read", 0) or 0,
+        "cache_write_tokens": details.get("cache_creation", 0) or 0,
+    }
+    metrics.increment("llm.calls")
+    for name, value in tokens.items():
+        metrics.increment(f"llm.{name}", value)
+    if entry is None:
+        return
+    entry["llm_calls"] = entry.get("llm_calls", 0) + 1
+    node = entry["node"]
+    for name, value in tokens.items():
+        entry[name] = entry.get(name, 0) + value
+        metrics.observe(f"node.{node}.llm.{name}", value, buckets=COUNT_BUCKETS)
+
+def message_text(message: Any) -> str:
+    """Text of an LLM message or streamed chunk (plain or a list of content blocks)"""
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(block.get("text", "") for block in message.content if isinstance(block, dict))
+
+def record_db_query(seconds: float, rows: int) -> None:
+    """Record the time and row count of a DB query for the running node"""
+    metrics.observe("db.query.seconds", seconds)
+    metrics.observe("db.query.rows", rows, buckets=COUNT_BUCKETS)
+    entry = _current_node.get()
+    if entry is None:
+        return
+    entry["db_seconds"] = round(entry.get("db_seconds", 0) + seconds, 4)
+    entry["db_rows"] = entry.get("db_rows", 0) + rows
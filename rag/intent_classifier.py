@@ -0,0 +1,298 @@
+"""
+Local fast-path intent classifier for BudgetPlanner.
+
+Routes routine chat prompts without an LLM call using keyword rules plus a
+small TF-IDF / softmax-regression model trained from labelled prompts. When
+neither is confident the caller falls back to the LLM router. Only read
+intents are routed locally: a prediction of a write intent (new expense,
+budget change, goal) is deferred to the LLM router, which decides whether
+the request really changes data.
+
+Train and evaluate from the command line:
+    python intent_classifier.py train data/intent_train.jsonl --out data/intent_model.json
+    python intent_classifier.py evaluate data/intent_eval.jsonl --model data/intent_model.json
+"""
+import re
+import json
+import math
+import argparse
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, NamedTuple
+
+from logger import setup_logger
+from metrics import metrics
+
+classifier_logger = setup_logger("intent_classifier")
+
+# Route labels and the BudgetPlanner state they map to
+LABELS = ["get_data", "get_no_data", "new_expense", "readjust_budget", "create_goals"]
+
+DEFAULT_THRESHOLD = 0.8
+RULE_CONFIDENCE = 0.95
+
+# Labels that lead to INSERT/UPDATE statements; classify() never routes these on its own
+WRITE_LABELS = frozenset({"new_expense", "readjust_budget", "create_goals"})
+
+# High-precision keyword rules, checked in order before the model. Write rules only match imperative
+# requests ("set my food budget to 400"), not questions about budgets or goals ("should I change my budget?")
+RULES: List[Tuple[str, re.Pattern]] = [
+    ("new_expense", re.compile(
+        r"^\s*(please\s+)?(add|log|record|track)\b.*(\$\s?\d|\d+(\.\d+)?\s*(dollars|usd|bucks))", re.I)),
+    ("new_expense", re.compile(r"^\s*i\s+(just\s+)?(spent|paid)\s+\$?\d", re.I)),
+    ("readjust_budget", re.compile(
+        r"^\s*(please\s+)?(increase|decrease|raise|lower|reduce|change|adjust|update|set)\b[^?]*\bbudget\b[^?]*$",
+        re.I)),
+    ("create_goals", re.compile(
+        r"^\s*(please\s+)?(create|set|add|start|make)\b[^?]*\b(goal|savings target)\b[^?]*$"
+        r"|^\s*(please\s+)?save\s+(up\s+)?\$?\d[^?]*\bfor\b[^?]*$", re.I)),
+    ("get_data", re.compile(
+        r"^\s*(how\s+much|what\s+did\s+i\s+spend|what('s| is| are)\s+my|show\s+(me\s+)?my|list\s+my)\b", re.I)),
+]
+
+_TOKEN_RE = re.compile(r"\$?\d+(?:[.,]\d+)?|[a-z']+")
+
+class IntentPrediction(NamedTuple):
+    label: str
+    confidence: float
+    source: str  # "rule" or "model"
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, collapse numbers/amounts into placeholders, and add bigrams"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token.startswith("$"):
+            tokens.append("<amount>")
+        elif token[0].isdigit():
+            tokens.append("<num>")
+        else:
+            tokens.append(token)
+    bigrams = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return tokens + bigrams
+
+def label_to_route(label: str) -> Dict:
+    """Convert a classifier label into BudgetPlanner routing fields"""
+    if label == "get_data":
+        return {"request_type": "GET", "get_data": True, "what_type": None}
+    if label == "get_no_data":
+        return {"request_type": "GET", "get_data": False, "what_type": None}
+    what_type = {
+        "new_expense": "New Expense",
+        "readjust_budget": "Readjust budget",
+        "create_goals": "Create Goals",
+    }[label]
+    return {"request_type": "POST", "get_data": None, "what_type": what_type}
+
+class IntentClassifier:
+    """Keyword rules plus a TF-IDF softmax-regression model"""
+
+    def __init__(self, model: Optional[Dict] = None, threshold: float = DEFAULT_THRESHOLD,
+                 use_rules: bool = True):
+        """
+        Initialize the classifier
+
+        Args:
+            model: Trained model parameters (see train()); rules only when None
+            threshold: Minimum confidence required to skip the LLM router
+            use_rules: Whether to apply the keyword rules before the model
+        """
+        self.threshold = threshold
+        self.use_rules = use_rules
+        self.model = model
+        if model:
+            self._vocab = {term: i for i, term in enumerate(model["vocab"])}
+            self._idf = model["idf"]
+            self._labels = model["labels"]
+            self._weights = model["weights"]
+            self._bias = model["bias"]
+
+    @classmethod
+    def load(cls, path: str, threshold: float = DEFAULT_THRESHOLD) -> "IntentClassifier":
+        """Load a trained model from a JSON file"""
+        with open(path) as f:
+            model = json.load(f)
+        classifier_logger.info(f"Loaded intent model from {path} ({len(model['vocab'])} features)")
+        return cls(model=model, threshold=threshold)
+
+    def _features(self, text: str) -> Dict[int, float]:
+        counts = Counter(t for t in tokenize(text) if t in self._vocab)
+        features = {self._vocab[t]: c * self._idf[self._vocab[t]] for t, c in counts.items()}
+        norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+        return {i: v / norm for i, v in features.items()}
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        """Return model probabilities per label (empty without a model)"""
+        if not self.model:
+            return {}
+        features = self._features(text)
+        scores = [
+            self._bias[k] + sum(self._weights[k][i] * v for i, v in features.items())
+            for k in range(len(self._labels))
+        ]
+        return dict(zip(self._labels, _softmax(scores)))
+
+    def predict_rule(self, text: str) -> Optional[IntentPrediction]:
+        """Return the first matching keyword rule's label, or None"""
+        for label, pattern in RULES:
+            if pattern.search(text):
+                return IntentPrediction(label, RULE_CONFIDENCE, "rule")
+        return None
+
+    def predict_model(self, text: str) -> Optional[IntentPrediction]:
+        """Return the model's most probable label (None without a model)"""
+        probabilities = self.predict_proba(text)
+        if not probabilities:
+            return None
+        label = max(probabilities, key=probabilities.get)
+        return IntentPrediction(label, probabilities[label], "model")
+
+    def predict(self, text: str) -> Optional[IntentPrediction]:
+        """Return the best prediction regardless of threshold"""
+        prediction = self.predict_rule(text) if self.use_rules else None
+        return prediction or self.predict_model(text)
+
+    def classify(self, text: str) -> Optional[IntentPrediction]:
+        """
+        Return a read-intent prediction only when it clears the confidence threshold
+
+        Write intents are returned as None, so the LLM router confirms them before any
+        INSERT or UPDATE is generated.
+        """
+        prediction = self.predict(text)
+        if prediction is None or prediction.confidence < self.threshold:
+            metrics.increment("intent_classifier.miss")
+            return None
+        if prediction.label in WRITE_LABELS:
+            metrics.increment("intent_classifier.deferred_write")
+            return None
+        metrics.increment("intent_classifier.hit")
+        metrics.increment(f"intent_classifier.hit.{prediction.source}")
+        return prediction
+
+def _softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+def load_examples(path: str) -> List[Tuple[str, str]]:
+    """Read labelled prompts from a JSONL file with "prompt" and "label" keys"""
+    examples = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["prompt"], row["label"]))
+    return examples
+
+def train(examples: List[Tuple[str, str]], epochs: int = 300, learning_rate: float = 2.0,
+          l2: float = 1e-3) -> Dict:
+    """
+    Train a TF-IDF softmax-regression model with batch gradient descent
+
+    Args:
+        examples: (prompt, label) pairs
+        epochs: Number of passes over the data
+        learning_rate: Gradient step size
+        l2: L2 regularisation strength
+
+    Returns:
+        JSON-serialisable model parameters
+    """
+    documents = [set(tokenize(prompt)) for prompt, _ in examples]
+    document_frequency = Counter(t for doc in documents for t in doc)
+    vocab = sorted(document_frequency)
+    n_docs = len(examples)
+    idf = [math.log((1 + n_docs) / (1 + document_frequency[t])) + 1 for t in vocab]
+    labels = [label for label in LABELS if any(l == label for _, l in examples)]
+
+    model = {"vocab": vocab, "idf": idf, "labels": labels,
+             "weights": [[0.0] * len(vocab) for _ in labels], "bias": [0.0] * len(labels)}
+    featurizer = IntentClassifier(model=model, use_rules=False)
+    rows = [(featurizer._features(prompt), labels.index(label)) for prompt, label in examples]
+
+    for _ in range(epochs):
+        weight_grad = [Counter() for _ in labels]
+        bias_grad = [0.0] * len(labels)
+        for features, target in rows:
+            scores = [model["bias"][k] + sum(model["weights"][k][i] * v for i, v in features.items())
+                      for k in range(len(labels))]
+            for k, p in enumerate(_softmax(scores)):
+                error = p - (1.0 if k == target else 0.0)
+                bias_grad[k] += error
+                for i, v in features.items():
+                    weight_grad[k][i] += error * v
+        for k in range(len(labels)):
+            model["bias"][k] -= learning_rate * bias_grad[k] / n_docs
+            weights = model["weights"][k]
+            for i in range(len(vocab)):
+                weights[i] -= learning_rate * (weight_grad[k][i] / n_docs + l2 * weights[i])
+    return model
+
+def _score(predictions: List[Tuple[Optional[IntentPrediction], str]], threshold: float) -> Dict:
+    """Hit rate (coverage), accuracy on hits and accuracy over all examples for one set of predictions"""
+    hits = correct_hits = correct = 0
+    for prediction, label in predictions:
+        if prediction and prediction.label == label:
+            correct += 1
+        if prediction and prediction.confidence >= threshold:
+            hits += 1
+            if prediction.label == label:
+                correct_hits += 1
+    total = len(predictions) or 1
+    return {
+        "hits": hits,
+        "hit_rate": hits / total,
+        "hit_accuracy": correct_hits / hits if hits else 0.0,
+        "overall_accuracy": correct / total,
+    }
+
+def evaluate(classifier: IntentClassifier, examples: List[Tuple[str, str]]) -> Dict:
+    """
+    Report hit rate, accuracy on hits and overall accuracy of the rules alone, the model alone
+    (on every example, whether or not a rule matches) and the combined fast path
+
+    "routed" counts hits classify() would act on: read intents only, write intents go to the LLM router.
+    """
+    rules = [(classifier.predict_rule(prompt) if classifier.use_rules else None, label)
+             for prompt, label in examples]
+    model = [(classifier.predict_model(prompt), label) for prompt, label in examples]
+    combined = [(rule or prediction, label) for (rule, label), (prediction, _) in zip(rules, model)]
+    routed = [(prediction if prediction and prediction.label not in WRITE_LABELS else None, label)
+              for prediction, label in combined]
+    return {
+        "examples": len(examples),
+        "threshold": classifier.threshold,
+        "rules": _score(rules, classifier.threshold),
+        "model": _score(model, classifier.threshold) if classifier.model else None,
+        "combined": _score(combined, classifier.threshold),
+        "routed": _score(routed, classifier.threshold),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the budget chat intent classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Train a model from labelled prompts")
+    train_parser.add_argument("data", help="JSONL file with prompt/label rows")
+    train_parser.add_argument("--out", required=True, help="Where to write the model JSON")
+    train_parser.add_argument("--epochs", type=int, default=300)
+
+    eval_parser = subparsers.add_parser("evaluate", help="Evaluate a model on labelled prompts")
+    eval_parser.add_argument("data", help="JSONL file with prompt/label rows")
+    eval_parser.add_argument("--model", help="Model JSON (rules only when omitted)")
+    eval_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args()
+    examples = load_examples(args.data)
+    if args.command == "train":
+        model = train(examples, epochs=args.epochs)
+        with open(args.out, "w") as f:
+            json.dump(model, f)
+        print(f"Trained on {len(examples)} examples, wrote {args.out}")
+    else:
+        classifier = (IntentClassifier.load(args.model, threshold=args.threshold)
+                      if args.model else IntentClassifier(threshold=args.threshold))
+        print(json.dumps(evaluate(classifier, examples), indent=2))
+
+if __name__ == "__main__":
+    main()
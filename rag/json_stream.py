@@ -0,0 +1,150 @@
+"""
+Incremental parsing of a JSON object streamed by a model.
+
+IncrementalJSONParser is fed the text as it arrives. It reports each
+top-level field of the object, and each element of a top-level array, as
+soon as that value is complete, so a client can show the merchant name or
+the first item before the model has finished. Values are decoded with
+json.loads on their own slice of the text, and the scan only tracks nesting,
+strings and separators.
+
+Like the non-streaming parser, it tolerates a short preamble before the
+opening brace (prose or a ```json fence) and ignores anything after the
+closing brace. When no object starts within max_preamble characters, or the
+object is malformed, NotJSONError is raised so the caller can stop the model
+instead of waiting for output it cannot use.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+class NotJSONError(ValueError):
+    """The streamed text is not a JSON object"""
+
+class IncrementalJSONParser:
+    """Parse a JSON object from text chunks, reporting fields and array elements once complete"""
+
+    def __init__(self, max_preamble: int = 200):
+        """
+        Args:
+            max_preamble: Characters allowed before the opening brace
+        """
+        self.max_preamble = max_preamble
+        self.text = ""
+        self.done = False
+        self._pos = 0
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect = "key"
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._element_start: Optional[int] = None
+        self._index = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Add streamed text
+
+        Args:
+            chunk: The next piece of the model's output
+
+        Returns:
+            Events completed by this chunk: {"event": "field", "name": ..., "value": ...} for top-level
+            scalars and objects, {"event": "item", "field": ..., "index": ..., "value": ...} for each
+            element of a top-level array
+
+        Raises:
+            NotJSONError: If the text is not (the start of) a JSON object
+        """
+        events: List[Dict[str, Any]] = []
+        self.text += chunk
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            if self.done:
+                break
+            ch = text[pos]
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._stack.append("{")
+                elif pos >= self.max_preamble:
+                    raise NotJSONError(f"No JSON object in the first {self.max_preamble} characters")
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._expect == "key":
+                        self._key = json.loads(text[self._string_start:pos + 1])
+                        self._expect = ":"
+                continue
+            if ch.isspace():
+                continue
+
+            depth = len(self._stack)
+            if depth == 1 and self._expect == "key":
+                if ch == '"':
+                    self._in_string, self._string_start = True, pos
+                elif ch == "}" and self._key is None:
+                    self._stack.pop()
+                    self.done = True
+                else:
+                    raise NotJSONError(f"Expected a field name at character {pos}, got {ch!r}")
+                continue
+            if depth == 1 and self._expect == ":":
+                if ch != ":":
+                    raise NotJSONError(f"Expected ':' at character {pos}, got {ch!r}")
+                self._expect = "value"
+                continue
+            if depth == 1 and self._value_start is None:
+                if ch in ",}":
+                    raise NotJSONError(f"Missing value for {self._key!r}")
+                self._value_start, self._index = pos, 0
+            if depth == 2 and self._stack[-1] == "[" and self._element_start is None and ch not in ",]":
+                self._element_start = pos
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch in "}]":
+                opener = self._stack.pop()
+                if opener + ch not in ("{}", "[]"):
+                    raise NotJSONError(f"Mismatched {ch!r} at character {pos}")
+                if depth == 2 and ch == "]":
+                    self._end_element(events, pos)
+                elif depth == 1:
+                    self._end_field(events, pos)
+                    self.done = True
+            elif ch == ",":
+                if depth == 1:
+                    self._end_field(events, pos)
+                    self._expect = "key"
+                elif depth == 2 and self._stack[-1] == "[":
+                    self._end_element(events, pos)
+        self._pos = len(text)
+        return events
+
+    def _decode(self, start: int, end: int) -> Any:
+        try:
+            return json.loads(self.text[start:end])
+        except json.JSONDecodeError as e:
+            raise NotJSONError(f"Invalid value for {self._key!r}: {str(e)}") from e
+
+    def _end_field(self, events: List[Dict[str, Any]], pos: int) -> None:
+        # Arrays were already reported element by element
+        if self.text[self._value_start] != "[":
+            events.append({"event": "field", "name": self._key, "value": self._decode(self._value_start, pos)})
+        self._value_start = None
+
+    def _end_element(self, events: List[Dict[str, Any]], pos: int) -> None:
+        if self._element_start is not None:
+            events.append({"event": "item", "field": self._key, "index": self._index,
+                           "value": self._decode(self._element_start, pos)})
+            self._index += 1
+        self._element_start = None
@@ -0,0 +1,103 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Sequence
+
+# Default histogram buckets (upper bounds) for latencies in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Buckets for token and row counts
+COUNT_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+class Metrics:
+    """Thread-safe, in-process store for counters and histogram observations"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, Any]] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Add value to the named counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Optional[Sequence[float]] = None) -> None:
+        """
+        Record a single observation for the named histogram
+
+        Args:
+            name: Histogram name (seconds unless the name says otherwise)
+            value: Observed value
+            buckets: Bucket upper bounds, fixed by the first observation (defaults to LATENCY_BUCKETS)
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                bounds = tuple(buckets or LATENCY_BUCKETS)
+                timing = {"count": 0, "sum": 0.0, "min": value, "max": value,
+                          "bounds": bounds, "buckets": [0] * (len(bounds) + 1)}
+                self._timings[name] = timing
+            timing["count"] += 1
+            timing["sum"] += value
+            timing["min"] = min(timing["min"], value)
+            timing["max"] = max(timing["max"], value)
+            timing["buckets"][bisect_left(timing["bounds"], value)] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        """Context manager that observes the elapsed wall-clock time in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of all counters and histograms (bucket counts are cumulative)"""
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                cumulative, running = {}, 0
+                for bound, count in zip(list(timing["bounds"]) + ["+Inf"], timing["buckets"]):
+                    running += count
+                    cumulative[str(bound)] = running
+                timings[name] = {
+                    "count": timing["count"],
+                    "sum": timing["sum"],
+                    "min": timing["min"],
+                    "max": timing["max"],
+                    "avg": timing["sum"] / timing["count"],
+                    "buckets": cumulative,
+                }
+            return {"counters": dict(self._counters), "timings": timings}
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = _prometheus_name(name)
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, timing in sorted(snapshot["timings"].items()):
+            metric = _prometheus_name(name)
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in timing["buckets"].items():
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{metric}_sum {timing['sum']}")
+            lines.append(f"{metric}_count {timing['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Clear all recorded values"""
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+def _prometheus_name(name: str) -> str:
+    return "quipquid_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+# Process-wide metrics instance
+metrics = Metrics()
@@ -0,0 +1,91 @@
+"""
+Compact prompt encoding for database results.
+
+Rendering db_data with str() repeats every column name on every row and
+prints datetimes and floats in their verbose repr. format_db_data emits the
+column header once, one delimited line per row, and normalises dates,
+datetimes and decimals.
+"""
+import re
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List
+
+DELIMITER = "|"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """Rough, offline token estimate (word pieces plus punctuation)"""
+    return len(_TOKEN_RE.findall(text))
+
+def format_value(value: Any) -> str:
+    """Render a single cell compactly"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        if (value.hour, value.minute, value.second) == (0, 0, 0):
+            return value.date().isoformat()
+        return value.strftime("%Y-%m-%d %H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (float, Decimal)):
+        text = f"{float(value):.2f}".rstrip("0").rstrip(".")
+        return text if text not in ("", "-0") else "0"
+    text = str(value)
+    return text.replace("\n", " ").replace(DELIMITER, "/")
+
+def format_rows(rows: List[Dict[str, Any]]) -> str:
+    """Render a list of row dicts as a header line followed by delimited rows"""
+    if not rows:
+        return "(no rows)"
+    columns: List[str] = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    lines = [DELIMITER.join(columns)]
+    lines.extend(DELIMITER.join(format_value(row.get(column)) for column in columns) for row in rows)
+    return "\n".join(lines)
+
+def format_db_data(db_data: Any) -> str:
+    """
+    Render GraphState.db_data for a prompt
+
+    Args:
+        db_data: Rows (list of dicts), a summary dict from ResultAccumulator,
+            or a status/error dict
+
+    Returns:
+        Compact text representation
+    """
+    if db_data is None:
+        return "(no data)"
+    if isinstance(db_data, list):
+        return format_rows(db_data)
+    if isinstance(db_data, dict) and db_data.get("truncated"):
+        summary = db_data["summary"]
+        sample = db_data["sample_rows"]
+        parts = [f"{db_data['total_rows']} rows in total, summarised. First {len(sample)} rows:",
+                 format_rows(sample)]
+        if summary.get("numeric"):
+            parts.append("Numeric columns (sum|min|max|avg):")
+            parts.extend(
+                f"{column}: " + DELIMITER.join(format_value(stats[key]) for key in ("sum", "min", "max", "avg"))
+                for column, stats in summary["numeric"].items()
+            )
+        if summary.get("date_ranges"):
+            parts.append("Date ranges:")
+            parts.extend(f"{column}: {stats['min'][:10]} to {stats['max'][:10]}"
+                         for column, stats in summary["date_ranges"].items())
+        if summary.get("top_values"):
+            parts.append("Most frequent values (value:count):")
+            parts.extend(
+                f"{column}: " + ", ".join(f"{format_value(value)}:{count}" for value, count in values)
+                for column, values in summary["top_values"].items()
+            )
+        return "\n".join(parts)
+    return json.dumps(db_data, default=format_value, separators=(",", ":"))
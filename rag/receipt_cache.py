@@ -0,0 +1,236 @@
+"""
+Content-addressed cache of receipt extractions.
+
+Re-uploads and client retries of the same receipt are answered from a local
+SQLite file instead of another vision-model call. Entries are keyed by the
+SHA-256 of the normalized image (the bytes ImagePreprocessor would send to
+the model, so re-encoded or re-tagged copies of the same photo match). The
+SHA-256 of each raw upload is kept as an alias, so an identical re-upload
+is found before any decoding. An optional 64-bit difference hash (dHash)
+also matches near-duplicates within a Hamming distance. It is off by
+default, because receipts from the same store can look alike at that
+resolution.
+
+Only payloads accepted by the validate callback are stored. Entries expire
+after a TTL and the least recently used ones are evicted once the stored
+payloads exceed max_bytes.
+"""
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Optional, Union
+
+from logger import setup_logger
+from metrics import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, near-duplicate matching is then disabled
+    Image = None
+
+cache_logger = setup_logger("receipt_cache")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    digest TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sent_bytes INTEGER NOT NULL,
+    phash TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS aliases (
+    upload_digest TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+"""
+
+def image_digest(data: bytes) -> str:
+    """SHA-256 hex digest of image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def perceptual_hash(data: Union[bytes, BinaryIO]) -> Optional[str]:
+    """64-bit difference hash of an image (bytes or a seekable file) as 16 hex digits, or None when it cannot be decoded"""
+    if Image is None:
+        return None
+    try:
+        image = Image.open(io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+        image.draft("L", (64, 64))
+        pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return f"{bits:016x}"
+
+def hamming_distance(left: str, right: str) -> int:
+    return bin(int(left, 16) ^ int(right, 16)).count("1")
+
+class ReceiptCache:
+    """SQLite-backed LRU cache of validated receipt payloads keyed by image hash"""
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 30 * 24 * 3600,
+                 perceptual: bool = False, max_distance: int = 4,
+                 validate: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        """
+        Open (or create) the cache file
+
+        Args:
+            path: SQLite file holding the cache
+            max_bytes: Total payload size kept before least recently used entries are evicted
+            ttl_seconds: Age after which an entry is no longer returned
+            perceptual: Also match near-duplicate images by perceptual hash
+            max_distance: Largest Hamming distance between perceptual hashes counted as a match
+            validate: Returns True for payloads worth caching (all payloads when None)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.perceptual = perceptual and Image is not None
+        self.max_distance = max_distance
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def lookup(self, upload_digest: str, digest: Optional[str] = None, phash: Optional[str] = None,
+               record_miss: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached payload for an upload, or None
+
+        Args:
+            upload_digest: image_digest of the raw upload
+            digest: image_digest of the normalized image (skipped when None)
+            phash: perceptual_hash of the normalized image (skipped when None or disabled)
+            record_miss: Count a miss (False for the early upload-only lookup that is retried later)
+
+        Returns:
+            A fresh copy of the cached payload, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            kind, row = "upload", self._conn.execute(
+                "SELECT e.digest, e.payload, e.sent_bytes, e.created FROM aliases a "
+                "JOIN entries e ON e.digest = a.digest WHERE a.upload_digest = ?", (upload_digest,)).fetchone()
+            if row is None and digest is not None:
+                kind, row = "digest", self._conn.execute(
+                    "SELECT digest, payload, sent_bytes, created FROM entries WHERE digest = ?", (digest,)).fetchone()
+            if row is None and phash is not None and self.perceptual:
+                kind, row = "perceptual", self._nearest(phash)
+            if row is not None and now - row[3] > self.ttl_seconds:
+                self._delete(row[0])
+                row = None
+            if row is None:
+                if record_miss:
+                    self.misses += 1
+                    metrics.increment("receipt_cache.miss")
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE digest = ?", (now, row[0]))
+            if kind != "upload":
+                self._conn.execute("INSERT OR REPLACE INTO aliases (upload_digest, digest) VALUES (?, ?)",
+                                   (upload_digest, row[0]))
+            self.hits += 1
+            self.bytes_saved += row[2]
+        metrics.increment("receipt_cache.hit")
+        metrics.increment(f"receipt_cache.hit.{kind}")
+        metrics.increment("receipt_cache.bytes_saved", row[2])
+        cache_logger.info(f"Receipt cache hit ({kind}) for {upload_digest[:12]}")
+        return json.loads(row[1])
+
+    def put(self, payload: Dict[str, Any], upload_digest: str, digest: str,
+            phash: Optional[str] = None, sent_bytes: int = 0) -> bool:
+        """
+        Store a payload if it validates, then evict expired and least recently used entries
+
+        Args:
+            payload: Extracted receipt data
+            upload_digest: image_digest of the raw upload
+            digest: image_digest of the normalized image
+            phash: perceptual_hash of the normalized image
+            sent_bytes: Image bytes sent to the model, counted as saved on every later hit
+
+        Returns:
+            True when the payload was stored
+        """
+        if self.validate is not None and not self.validate(payload):
+            metrics.increment("receipt_cache.rejected")
+            return False
+        encoded = json.dumps(payload, default=str)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (digest, payload, size, sent_bytes, phash, created, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (digest, encoded, len(encoded), sent_bytes, phash, now, now))
+                self._conn.execute("INSERT OR REPLACE INTO aliases (upload_digest, digest) VALUES (?, ?)",
+                                   (upload_digest, digest))
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        metrics.increment("receipt_cache.stores")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, bytes saved and the current size"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "entries": entries,
+                "size_bytes": size,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _nearest(self, phash: str):
+        best, best_distance = None, self.max_distance + 1
+        for row in self._conn.execute(
+                "SELECT digest, payload, sent_bytes, created, phash FROM entries WHERE phash IS NOT NULL"):
+            distance = hamming_distance(phash, row[4])
+            if distance < best_distance:
+                best, best_distance = row[:4], distance
+        return best
+
+    def _delete(self, digest: str) -> None:
+        self._conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+        self._conn.execute("DELETE FROM aliases WHERE digest = ?", (digest,))
+
+    def _evict(self, now: float) -> None:
+        expired = self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_seconds,)).rowcount
+        evicted = 0
+        size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if size > self.max_bytes:
+            for digest, entry_size in self._conn.execute(
+                    "SELECT digest, size FROM entries ORDER BY accessed").fetchall():
+                if size <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+                size -= entry_size
+                evicted += 1
+        if expired or evicted:
+            self._conn.execute("DELETE FROM aliases WHERE digest NOT IN (SELECT digest FROM entries)")
+            metrics.increment("receipt_cache.evictions", expired + evicted)
@@ -0,0 +1,275 @@
+"""
+Asynchronous receipt processing jobs.
+
+Submitting a receipt stores the image in an embedded SQLite queue and
+returns a job id at once. Worker tasks on the application's event loop
+claim jobs, run them through the handler with bounded concurrency, and
+record the result or error for status polling. A failed attempt is retried
+with exponential backoff, up to max_attempts.
+
+A claimed job carries a lease. Jobs whose lease ran out, for example because
+the worker process was killed mid-job, go back to the queue when any worker
+starts or polls. Queue state therefore survives restarts. Several API worker
+processes can share one queue file, because claims are made in IMMEDIATE
+transactions. Finished jobs and their images are deleted after the
+retention period.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple, Type, Union
+
+from logger import setup_logger
+from metrics import metrics
+
+jobs_logger = setup_logger("receipt_jobs")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipt_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    image BLOB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS receipt_jobs_queue ON receipt_jobs (status, run_after);
+"""
+
+# Bytes copied at a time when an image file is stored
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+Handler = Callable[[bytes, str, str], Awaitable[Dict[str, Any]]]
+
+class ReceiptJobQueue:
+    """SQLite-backed receipt job queue with an in-process worker pool"""
+
+    def __init__(self, path: str, handler: Handler, concurrency: int = 4, max_attempts: int = 3,
+                 retry_delay: float = 2.0, lease_seconds: float = 300.0, poll_interval: float = 1.0,
+                 retention_seconds: float = 24 * 3600, no_retry: Tuple[Type[BaseException], ...] = ()):
+        """
+        Open (or create) the queue file
+
+        Args:
+            path: SQLite file holding the queue
+            handler: Coroutine (image_data, content_type, job_id) -> result payload
+            concurrency: Jobs processed at once by this process
+            max_attempts: Attempts before a job is marked failed
+            retry_delay: Delay before the first retry, doubled on each later retry
+            lease_seconds: How long a claimed job may run before another worker may take it over
+            poll_interval: Seconds between queue polls when idle
+            retention_seconds: Finished jobs older than this are deleted
+            no_retry: Exception types that fail a job without retrying
+        """
+        self.path = path
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.no_retry = no_retry
+        self._lock = threading.Lock()
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def submit(self, image_data: Union[bytes, BinaryIO], content_type: str, size: Optional[int] = None) -> str:
+        """
+        Queue a receipt image
+
+        Args:
+            image_data: Image bytes, or a binary file positioned at the start of the image
+            content_type: MIME type of the image
+            size: Length of a file image in bytes (required for files)
+
+        Returns:
+            The job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            if isinstance(image_data, (bytes, bytearray)):
+                size = len(image_data)
+                self._conn.execute(
+                    "INSERT INTO receipt_jobs (id, status, content_type, image, created_at, updated_at, run_after) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, QUEUED, content_type, sqlite3.Binary(image_data), now, now, now))
+            else:
+                # Reserve the blob and copy the file into it chunk by chunk, so the image is never
+                # loaded into memory; workers only see the job once the transaction commits
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    rowid = self._conn.execute(
+                        "INSERT INTO receipt_jobs (id, status, content_type, image, created_at, updated_at, run_after) "
+                        "VALUES (?, ?, ?, zeroblob(?), ?, ?, ?)",
+                        (job_id, QUEUED, content_type, size, now, now, now)).lastrowid
+                    with self._conn.blobopen("receipt_jobs", "image", rowid) as blob:
+                        written = 0
+                        while written < size:
+                            chunk = image_data.read(min(BLOB_CHUNK_SIZE, size - written))
+                            if not chunk:
+                                raise ValueError(f"Image is shorter than the expected {size} bytes")
+                            blob.write(chunk)
+                            written += len(chunk)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        metrics.increment("receipt_jobs.submitted")
+        jobs_logger.info(f"Queued receipt job {job_id} ({size} bytes)")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status, attempts, result and error, or None for an unknown id"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, attempts, result, error, created_at, updated_at FROM receipt_jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "attempts": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM receipt_jobs GROUP BY status").fetchall()
+        return {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0, **dict(rows)}
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop"""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work(), name=f"receipt-job-worker-{i}")
+                         for i in range(self.concurrency)]
+        jobs_logger.info(f"Started {self.concurrency} receipt job workers")
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs they were running go back to the queue"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._wakeup = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _claim(self) -> Optional[Tuple[str, str, bytes, int]]:
+        """Atomically take the next runnable job, first re-queueing jobs whose lease ran out"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute(
+                    "UPDATE receipt_jobs SET status = ?, lease_until = NULL, updated_at = ? "
+                    "WHERE status = ? AND lease_until < ?", (QUEUED, now, RUNNING, now)).rowcount
+                if expired:
+                    metrics.increment("receipt_jobs.lease_expired", expired)
+                    jobs_logger.warning(f"Re-queued {expired} receipt jobs whose worker stopped")
+                if now - self._last_purge > 60:
+                    self._conn.execute("DELETE FROM receipt_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                                       (SUCCEEDED, FAILED, now - self.retention_seconds))
+                    self._last_purge = now
+                row = self._conn.execute(
+                    "UPDATE receipt_jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                    "WHERE id = (SELECT id FROM receipt_jobs WHERE status = ? AND run_after <= ? "
+                    "ORDER BY run_after LIMIT 1) RETURNING id, content_type, image, attempts",
+                    (RUNNING, now + self.lease_seconds, now, QUEUED, now)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _finish(self, job_id: str, result: Optional[Dict[str, Any]], error: Optional[str],
+                retry_after: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            if retry_after is not None:
+                self._conn.execute(
+                    "UPDATE receipt_jobs SET status = ?, error = ?, run_after = ?, lease_until = NULL, "
+                    "updated_at = ? WHERE id = ?", (QUEUED, error, now + retry_after, now, job_id))
+            else:
+                # The image is no longer needed once the job is finished
+                self._conn.execute(
+                    "UPDATE receipt_jobs SET status = ?, result = ?, error = ?, image = NULL, lease_until = NULL, "
+                    "updated_at = ? WHERE id = ?",
+                    (SUCCEEDED if error is None else FAILED, json.dumps(result, default=str) if result else None,
+                     error, now, job_id))
+
+    def _release(self, job_id: str) -> None:
+        """Put a job back without counting the interrupted attempt"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE receipt_jobs SET status = ?, attempts = attempts - 1, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ?", (QUEUED, now, job_id, RUNNING))
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                jobs_logger.error(f"Could not claim a receipt job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*job)
+
+    async def _run(self, job_id: str, content_type: str, image_data: bytes, attempts: int) -> None:
+        start = time.perf_counter()
+        try:
+            result = await self.handler(image_data, content_type, job_id)
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(self._release, job_id))
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if isinstance(e, self.no_retry) or attempts >= self.max_attempts:
+                await asyncio.to_thread(self._finish, job_id, None, error)
+                metrics.increment("receipt_jobs.failed")
+                jobs_logger.error(f"Receipt job {job_id} failed after {attempts} attempts: {error}")
+            else:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                await asyncio.to_thread(self._finish, job_id, None, error, delay)
+                metrics.increment("receipt_jobs.retried")
+                jobs_logger.warning(f"Receipt job {job_id} attempt {attempts} failed, retrying in {delay:.1f}s: {error}")
+            return
+        await asyncio.to_thread(self._finish, job_id, result, None)
+        metrics.increment("receipt_jobs.succeeded")
+        metrics.observe("receipt_jobs.run.seconds", time.perf_counter() - start)
+        jobs_logger.info(f"Receipt job {job_id} succeeded")
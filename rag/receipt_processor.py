@@ -1,28 +1,95 @@
 import json
-import base64
-from typing import List, Dict, Any, TypedDict, Annotated
+import asyncio
+import contextlib
+from typing import List, Dict, Any, TypedDict, Annotated, Optional, Tuple, AsyncIterator
 from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.graph import StateGraph, add_messages
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, END, add_messages
 from logger import logger, log_processing_error
+from metrics import metrics
+from instrumentation import trace_request, node_span, record_llm_usage, message_text
+from image_preprocess import ImagePreprocessor, PreparedImage
+from receipt_cache import ReceiptCache, image_digest, perceptual_hash
+from receipt_upload import ReceiptUpload
+from receipt_validation import ReceiptValidator
+from json_stream import IncrementalJSONParser, NotJSONError
+from text_receipts import TextReceiptParser
+
+EXTRACTION_PROMPT = """
+                        Analyze this receipt {source} and extract the following information in JSON format:
+                        
+                        1. merchant_name: The name of the store or business
+                        2. date: The date of the transaction (in YYYY-MM-DD format)
+                        3. items: An array of items purchased, each with:
+                           - name: The name of the item
+                           - price: The price of the item (as a float)
+                           - quantity: The quantity purchased (if available, default to 1)
+                        4. total: The total bill amount (as a float)
+                        5. category: The expense category, which must be ONE of the following values:
+                           "food", "transportation", "housing", "utilities", "entertainment", 
+                           "healthcare", "shopping", "education", "personal", "savings", 
+                           "investments", "other"
+                        6. description: A brief description of what kind of bill this is (e.g., "Lunch at Chipotle", "Monthly gym membership", "Groceries at Whole Foods")
+                        
+                        Return ONLY the JSON object with no explanations before or after.
+                        """
+
+REPAIR_PROMPT = """
+You extracted this JSON from a receipt:
+
+{previous}
+
+It fails these checks:
+{problems}
+
+Correct only the values involved and keep everything else unchanged. If a price or the total was misread,
+fix it. If the receipt has a charge or discount that is not an item (tax, tip, service fee, coupon), add it
+as an item, with a negative price for a discount. Dates use YYYY-MM-DD. category must be ONE of: {categories}.
+
+Return ONLY the corrected JSON object with no explanations before or after.
+"""
 
 class State(TypedDict):
     """State schema for the receipt processing workflow"""
     messages: Annotated[List[Any], add_messages]
     receipt_data: Dict[str, Any]
+    problems: List[str]
+    repair_attempts: int
 
 class ReceiptProcessor:
     """Handles receipt processing with LangGraph and Anthropic Claude"""
     
-    def __init__(self, api_key: str, model_name: str = "claude-3-7-sonnet-20250219"):
+    def __init__(self, api_key: str, model_name: str = "claude-3-7-sonnet-20250219",
+                 model: Optional[BaseChatModel] = None,
+                 preprocessor: Optional[ImagePreprocessor] = None,
+                 cache: Optional[ReceiptCache] = None,
+                 validator: Optional[ReceiptValidator] = None,
+                 max_repairs: int = 1,
+                 text_parser: Optional[TextReceiptParser] = None,
+                 text_confidence: float = 0.8):
         """
         Initialize the receipt processor
         
         Args:
             api_key: Anthropic API key
             model_name: Claude model name to use
+            model: Optional pre-built chat model to share (skips creating a new client)
+            preprocessor: Optional image preprocessing (orientation, resizing, recompression) before upload
+            cache: Optional content-addressed cache of extractions, checked before the model is called
+            validator: Optional local checks of the extraction; failures trigger a text-only repair prompt
+            max_repairs: Repair prompts sent per receipt before the extraction is returned as it is
+            text_parser: Optional local parser for text receipts, tried before the model
+            text_confidence: Lowest parser confidence accepted without calling the model
         """
-        self.model = ChatAnthropic(
+        self.preprocessor = preprocessor
+        self.cache = cache
+        self.validator = validator
+        self.max_repairs = max_repairs
+        self.text_parser = text_parser
+        self.text_confidence = text_confidence
+        self.model = model if model is not None else ChatAnthropic(
             model=model_name,
             temperature=0,
             anthropic_api_key=api_key,
@@ -41,33 +108,140 @@ class ReceiptProcessor:
             Updated state with Claude's response and parsed receipt data
         """
         try:
-            response = self.model.invoke(state["messages"])
+            with node_span("process_receipt"):
+                response = self.model.invoke(state["messages"])
+                record_llm_usage(response)
+            return self._parse_response(response)
+        except Exception as e:
+            log_processing_error(f"Error in receipt processing: {str(e)}")
+            raise
+    
+    async def _aprocess_receipt(self, state: State) -> Dict[str, Any]:
+        """Async twin of _process_receipt"""
+        try:
+            with node_span("process_receipt"):
+                response = await self.model.ainvoke(state["messages"])
+                record_llm_usage(response)
+            return self._parse_response(response)
+        except Exception as e:
+            log_processing_error(f"Error in receipt processing: {str(e)}")
+            raise
+    
+    def _validate_receipt(self, state: State) -> Dict[str, Any]:
+        """
+        Check the extraction locally (item sum against total, date, category)
+        
+        Args:
+            state: Current state with the parsed receipt data
             
-            # Try to parse the response as JSON
-            try:
-                json_start = response.content.find('{')
-                json_end = response.content.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = response.content[json_start:json_end]
-                    receipt_data = json.loads(json_str)
-                else:
-                    # Fallback: assume the entire response might be JSON
-                    receipt_data = json.loads(response.content)
-            except json.JSONDecodeError as e:
-                log_processing_error(f"Failed to parse response as JSON: {str(e)}")
-                receipt_data = {
-                    "error": "Failed to parse response as JSON",
-                    "raw_response": response.content
-                }
+        Returns:
+            Updated state with the normalized receipt data and the problems found
+        """
+        with node_span("validate_receipt"):
+            receipt_data = dict(state["receipt_data"])
+            problems = self.validator.check(receipt_data)
+        repaired = state.get("repair_attempts", 0) > 0
+        if problems:
+            metrics.increment("receipt.validation.failed")
+            logger.warning(f"Receipt extraction failed validation: {'; '.join(problems)}")
+        elif repaired:
+            metrics.increment("receipt.repair.fixed")
+        else:
+            metrics.increment("receipt.validation.passed")
+        return {"receipt_data": receipt_data, "problems": problems}
+    
+    def _after_validation(self, state: State) -> str:
+        """Send a failed extraction to the repair node while repairs are left"""
+        if not state["problems"]:
+            return END
+        if state.get("repair_attempts", 0) < self.max_repairs:
+            return "repair_receipt"
+        metrics.increment("receipt.repair.unresolved")
+        return END
+    
+    def _repair_messages(self, state: State) -> List[HumanMessage]:
+        """Text-only prompt with the earlier answer and the failed checks (the image is not sent again)"""
+        receipt_data = state["receipt_data"]
+        # The best extraction so far, or the model's raw answer when it was not valid JSON
+        previous = receipt_data["raw_response"] if "raw_response" in receipt_data else json.dumps(receipt_data)
+        return [HumanMessage(content=REPAIR_PROMPT.format(
+            previous=previous,
+            problems="\n".join(f"- {problem}" for problem in state["problems"]),
+            categories=", ".join(f'"{category}"' for category in sorted(self.validator.categories))
+        ))]
+    
+    def _repaired(self, state: State, response: AIMessage) -> Dict[str, Any]:
+        update = self._parse_response(response)
+        if "error" in update["receipt_data"]:
+            # Unparseable repair: keep the earlier extraction
+            update["receipt_data"] = state["receipt_data"]
+        update["repair_attempts"] = state.get("repair_attempts", 0) + 1
+        return update
+    
+    def _repair_receipt(self, state: State) -> Dict[str, Any]:
+        """
+        Ask the model to correct the fields that failed validation
+        
+        Args:
+            state: Current state with the earlier answer and the problems found
             
-            return {
-                "messages": [AIMessage(content=response.content)],
-                "receipt_data": receipt_data
-            }
+        Returns:
+            Updated state with the corrected receipt data
+        """
+        metrics.increment("receipt.repair.attempts")
+        try:
+            with node_span("repair_receipt"):
+                response = self.model.invoke(self._repair_messages(state))
+                record_llm_usage(response)
+            return self._repaired(state, response)
         except Exception as e:
-            log_processing_error(f"Error in receipt processing: {str(e)}")
+            log_processing_error(f"Error in receipt repair: {str(e)}")
+            raise
+    
+    async def _arepair_receipt(self, state: State) -> Dict[str, Any]:
+        """Async twin of _repair_receipt"""
+        metrics.increment("receipt.repair.attempts")
+        try:
+            with node_span("repair_receipt"):
+                response = await self.model.ainvoke(self._repair_messages(state))
+                record_llm_usage(response)
+            return self._repaired(state, response)
+        except Exception as e:
+            log_processing_error(f"Error in receipt repair: {str(e)}")
             raise
     
+    def _parse_response(self, response: AIMessage) -> Dict[str, Any]:
+        """
+        Parse Claude's response into receipt data
+        
+        Args:
+            response: The model's reply
+            
+        Returns:
+            Updated state with Claude's response and parsed receipt data
+        """
+        # Try to parse the response as JSON
+        try:
+            json_start = response.content.find('{')
+            json_end = response.content.rfind('}') + 1
+            if json_start >= 0 and json_end > json_start:
+                json_str = response.content[json_start:json_end]
+                receipt_data = json.loads(json_str)
+            else:
+                # Fallback: assume the entire response might be JSON
+                receipt_data = json.loads(response.content)
+        except json.JSONDecodeError as e:
+            log_processing_error(f"Failed to parse response as JSON: {str(e)}")
+            receipt_data = {
+                "error": "Failed to parse response as JSON",
+                "raw_response": response.content
+            }
+        
+        return {
+            "messages": [AIMessage(content=response.content)],
+            "receipt_data": receipt_data
+        }
+    
     def _create_workflow(self):
         """
         Create the LangGraph workflow for receipt processing
@@ -79,79 +253,316 @@ class ReceiptProcessor:
         workflow = StateGraph(State)
         
         # Add the processing node
-        workflow.add_node("process_receipt", self._process_receipt)
+        workflow.add_node("process_receipt", RunnableLambda(
+            self._process_receipt, afunc=self._aprocess_receipt, name="process_receipt"))
         
-        # Define the edges - simple linear flow in this case
         workflow.set_entry_point("process_receipt")
-        workflow.set_finish_point("process_receipt")
+        if self.validator is None:
+            workflow.set_finish_point("process_receipt")
+            return workflow.compile()
+        
+        # Check the extraction locally and repair it with a text-only prompt when a check fails
+        workflow.add_node("validate_receipt", RunnableLambda(self._validate_receipt, name="validate_receipt"))
+        workflow.add_node("repair_receipt", RunnableLambda(
+            self._repair_receipt, afunc=self._arepair_receipt, name="repair_receipt"))
+        workflow.add_edge("process_receipt", "validate_receipt")
+        workflow.add_conditional_edges("validate_receipt", self._after_validation,
+                                       {"repair_receipt": "repair_receipt", END: END})
+        workflow.add_edge("repair_receipt", "validate_receipt")
         
         # Compile the graph
         return workflow.compile()
     
-    def process_image(self, image_data: bytes, content_type: str) -> Dict[str, Any]:
+    def _initial_state(self, image: ReceiptUpload) -> Dict[str, Any]:
+        """
+        Build the workflow input: the image and the extraction instructions
+        
+        Args:
+            image: Image to send
+            
+        Returns:
+            Initial workflow state
+        """
+        # Encode the image to base64 (streamed from the spooled upload when it is sent unchanged)
+        base64_image = image.base64()
+        
+        # Construct the prompt with the image
+        prompt = [
+            HumanMessage(
+                content=[
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": image.content_type,
+                            "data": base64_image
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": EXTRACTION_PROMPT.format(source="image")
+                    }
+                ]
+            )
+        ]
+        
+        # Initialize state with the prompt
+        return {
+            "messages": prompt,
+            "receipt_data": {},
+            "problems": [],
+            "repair_attempts": 0
+        }
+    
+    def _lookup_upload(self, upload: ReceiptUpload) -> Optional[Dict[str, Any]]:
+        """Look the raw upload up in the cache (a miss is counted after normalization)"""
+        return self.cache.lookup(upload.digest(), record_miss=False)
+    
+    def _lookup_normalized(self, upload: ReceiptUpload,
+                           image: ReceiptUpload) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """Hash the image that would be sent to the model and look it up in the cache"""
+        phash = perceptual_hash(image.open()) if self.cache.perceptual else None
+        return phash, self.cache.lookup(upload.digest(), image.digest(), phash)
+    
+    @staticmethod
+    def _prepared(upload: ReceiptUpload, prepared: PreparedImage) -> ReceiptUpload:
+        """The image to send: the upload itself when the preprocessor passed it through"""
+        if prepared.data is upload.source:
+            return upload
+        return ReceiptUpload(prepared.data, prepared.content_type)
+    
+    def process_image(self, image_data: bytes, content_type: str,
+                      request_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process a receipt image and extract structured data
         
         Args:
             image_data: Raw image bytes
             content_type: MIME type of the image
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
+            
+        Returns:
+            Structured receipt data
+        """
+        return self.process_upload(ReceiptUpload(image_data, content_type), request_id)
+    
+    def process_upload(self, upload: ReceiptUpload, request_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Process a receipt upload (bytes or a spooled file) and extract structured data
+        
+        Args:
+            upload: The uploaded image
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
             
         Returns:
             Structured receipt data
         """
         try:
-            # Encode the image to base64
-            base64_image = base64.b64encode(image_data).decode("utf-8")
+            with trace_request("receipt", request_id) as trace:
+                try:
+                    cached, image = None, upload
+                    if self.cache is not None:
+                        with node_span("receipt_cache"):
+                            cached = self._lookup_upload(upload)
+                    if cached is None and self.preprocessor is not None:
+                        with node_span("preprocess_image"):
+                            image = self._prepared(upload, self.preprocessor.preprocess(
+                                upload.source, upload.content_type))
+                    if cached is None and self.cache is not None:
+                        with node_span("receipt_cache"):
+                            phash, cached = self._lookup_normalized(upload, image)
+                    if cached is not None:
+                        return cached
+                    
+                    # Execute the workflow
+                    logger.info("Sending receipt to Claude for processing")
+                    result = self.workflow.invoke(self._initial_state(image))
+                    if self.cache is not None:
+                        self.cache.put(result["receipt_data"], upload.digest(), image.digest(), phash, image.size)
+                finally:
+                    trace.log(logger)
             
-            # Construct the prompt with the image
-            prompt = [
-                HumanMessage(
-                    content=[
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": content_type,
-                                "data": base64_image
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": """
-                            Analyze this receipt image and extract the following information in JSON format:
-                            
-                            1. merchant_name: The name of the store or business
-                            2. date: The date of the transaction (in YYYY-MM-DD format)
-                            3. items: An array of items purchased, each with:
-                               - name: The name of the item
-                               - price: The price of the item (as a float)
-                               - quantity: The quantity purchased (if available, default to 1)
-                            4. total: The total bill amount (as a float)
-                            5. category: The expense category, which must be ONE of the following values:
-                               "food", "transportation", "housing", "utilities", "entertainment", 
-                               "healthcare", "shopping", "education", "personal", "savings", 
-                               "investments", "other"
-                            6. description: A brief description of what kind of bill this is (e.g., "Lunch at Chipotle", "Monthly gym membership", "Groceries at Whole Foods")
-                            
-                            Return ONLY the JSON object with no explanations before or after.
-                            """
-                        }
-                    ]
-                )
-            ]
+            # Return the receipt data
+            return result["receipt_data"]
+        except Exception as e:
+            log_processing_error(str(e))
+            raise
+    
+    async def aprocess_image(self, image_data: bytes, content_type: str,
+                             request_id: Optional[str] = None) -> Dict[str, Any]:
+        """Async twin of process_image"""
+        return await self.aprocess_upload(ReceiptUpload(image_data, content_type), request_id)
+    
+    async def aprocess_upload(self, upload: ReceiptUpload, request_id: Optional[str] = None,
+                              model_slots: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+        """
+        Async twin of process_upload: hashing, cache access, preprocessing and base64
+        encoding run in worker threads and the model call does not block the event loop
+        
+        Args:
+            upload: The uploaded image
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
+            model_slots: Semaphore bounding concurrent model calls across a batch (cache
+                lookups and preprocessing are not held back by it)
             
-            # Initialize state with the prompt
-            initial_state = {
-                "messages": prompt,
-                "receipt_data": {}
-            }
+        Returns:
+            Structured receipt data
+        """
+        try:
+            with trace_request("receipt", request_id) as trace:
+                try:
+                    image, phash, cached = await self._aprepare(upload)
+                    if cached is not None:
+                        return cached
+                    
+                    logger.info("Sending receipt to Claude for processing")
+                    state = await asyncio.to_thread(self._initial_state, image)
+                    async with model_slots or contextlib.nullcontext():
+                        result = await self.workflow.ainvoke(state)
+                    await self._astore(result["receipt_data"], upload, image, phash)
+                finally:
+                    trace.log(logger)
             
-            # Execute the workflow
-            logger.info("Sending receipt to Claude for processing")
-            result = self.workflow.invoke(initial_state)
+            return result["receipt_data"]
+        except Exception as e:
+            log_processing_error(str(e))
+            raise
+    
+    async def astream_upload(self, upload: ReceiptUpload,
+                             request_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the extraction of a receipt upload as the model writes it
+        
+        The model's JSON is parsed incrementally, so each field and item is
+        reported as soon as it is complete. When the output is clearly not
+        JSON the model call is stopped early. Validation and repair still run
+        on the complete answer before the final event.
+        
+        Args:
+            upload: The uploaded image
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
+            
+        Yields:
+            Event dicts: {"event": "field", "name": ..., "value": ...} per top-level field,
+            {"event": "item", "field": "items", "index": ..., "value": ...} per item,
+            {"event": "validation", "problems": [...]} when a local check fails,
+            then {"event": "done", "receipt": ...} or {"event": "error", "detail": ...}
+        """
+        with trace_request("receipt", request_id) as trace:
+            try:
+                image, phash, cached = await self._aprepare(upload)
+                if cached is not None:
+                    for event in IncrementalJSONParser().feed(json.dumps(cached)):
+                        yield event
+                    yield {"event": "done", "receipt": cached}
+                    return
+                
+                logger.info("Streaming receipt extraction from Claude")
+                state = await asyncio.to_thread(self._initial_state, image)
+                parser, result = IncrementalJSONParser(), {}
+                async with contextlib.aclosing(self.workflow.astream(
+                        state, stream_mode=["updates", "messages"])) as stream:
+                    async for mode, chunk in stream:
+                        if mode == "messages":
+                            message, metadata = chunk
+                            if metadata.get("langgraph_node") == "process_receipt" and not parser.done:
+                                for event in parser.feed(message_text(message)):
+                                    yield event
+                            continue
+                        for node, update in chunk.items():
+                            result.update(update or {})
+                            if node == "validate_receipt" and update["problems"]:
+                                yield {"event": "validation", "problems": update["problems"]}
+                await self._astore(result["receipt_data"], upload, image, phash)
+                yield {"event": "done", "receipt": result["receipt_data"]}
+            except NotJSONError as e:
+                # Leaving the stream closes it, which cancels the model call
+                metrics.increment("receipt.stream.aborted")
+                log_processing_error(f"Receipt extraction is not JSON, stopped early: {str(e)}")
+                yield {"event": "error", "detail": f"The model did not return receipt data: {str(e)}"}
+            except Exception as e:
+                log_processing_error(str(e))
+                yield {"event": "error", "detail": f"Error processing receipt: {str(e)}"}
+            finally:
+                trace.log(logger)
+    
+    def _text_state(self, text: str) -> Dict[str, Any]:
+        """Workflow input for a text receipt: the text and the extraction instructions, no image"""
+        prompt = f"<receipt>\n{text}\n</receipt>\n" + EXTRACTION_PROMPT.format(source="text")
+        return {
+            "messages": [HumanMessage(content=prompt)],
+            "receipt_data": {},
+            "problems": [],
+            "repair_attempts": 0
+        }
+    
+    async def aprocess_text(self, text: str, request_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Extract structured data from a plaintext or emailed receipt
+        
+        The local parser is tried first; the model is only called (through the same
+        validate and repair steps as images) when the parser's confidence is too low.
+        
+        Args:
+            text: Receipt text or HTML email body
+            request_id: Id the per-node breakdown is logged under (generated when omitted)
+            
+        Returns:
+            Structured receipt data
+        """
+        try:
+            with trace_request("receipt_text", request_id) as trace:
+                try:
+                    if self.text_parser is not None:
+                        with node_span("parse_text"):
+                            parsed = await asyncio.to_thread(self.text_parser.parse, text)
+                        metrics.observe("receipt.text.confidence", parsed.confidence,
+                                        buckets=(0.2, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+                        if parsed.confidence >= self.text_confidence:
+                            metrics.increment("receipt.text.local")
+                            return parsed.data
+                        logger.info(f"Text receipt parsed with confidence {parsed.confidence:.2f}, "
+                                    f"falling back to Claude")
+                    metrics.increment("receipt.text.llm_fallback")
+                    
+                    digest = image_digest(text.encode("utf-8"))
+                    if self.cache is not None:
+                        with node_span("receipt_cache"):
+                            cached = await asyncio.to_thread(self.cache.lookup, digest)
+                        if cached is not None:
+                            return cached
+                    result = await self.workflow.ainvoke(self._text_state(text))
+                    if self.cache is not None:
+                        await asyncio.to_thread(self.cache.put, result["receipt_data"], digest, digest)
+                finally:
+                    trace.log(logger)
             
-            # Return the receipt data
             return result["receipt_data"]
         except Exception as e:
             log_processing_error(str(e))
-            raise
\ No newline at end of file
+            raise
+    
+    async def _aprepare(self, upload: ReceiptUpload) -> Tuple[ReceiptUpload, Optional[str], Optional[Dict[str, Any]]]:
+        """Cache lookups and preprocessing: returns the image to send, its perceptual hash and any cached result"""
+        cached, image, phash = None, upload, None
+        if self.cache is not None:
+            with node_span("receipt_cache"):
+                cached = await asyncio.to_thread(self._lookup_upload, upload)
+        if cached is None and self.preprocessor is not None:
+            with node_span("preprocess_image"):
+                image = self._prepared(upload, await self.preprocessor.apreprocess(
+                    upload.source, upload.content_type))
+        if cached is None and self.cache is not None:
+            with node_span("receipt_cache"):
+                phash, cached = await asyncio.to_thread(self._lookup_normalized, upload, image)
+        return image, phash, cached
+    
+    async def _astore(self, receipt_data: Dict[str, Any], upload: ReceiptUpload, image: ReceiptUpload,
+                      phash: Optional[str]) -> None:
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, receipt_data, upload.digest(), image.digest(), phash, image.size)
+    
+    def close(self) -> None:
+        """Stop the preprocessing thread pool"""
+        if self.preprocessor is not None:
+            self.preprocessor.close()
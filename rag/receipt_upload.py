@@ -0,0 +1,275 @@
+"""
+Streaming intake of receipt uploads.
+
+Starlette spools multipart files larger than 1 MB to a temporary file, so
+the upload does not have to be loaded into memory to be processed.
+read_upload reads the spooled file once, in chunks, in a worker thread. It
+sniffs the image type from the magic bytes, enforces the size cap and
+computes the SHA-256 used by the receipt cache along the way. The resulting
+ReceiptUpload keeps a reference to the file instead of the bytes. Pillow
+decodes directly from it, and when the image is sent unchanged,
+encode_base64 streams it into a preallocated base64 buffer. The raw upload
+is therefore never held in memory next to its base64 copy. The message
+payload needs the base64 as text, so encode_base64 converts the buffer to a
+str once before returning it. While that copy is made, memory briefly holds
+two base64-sized buffers, and the bytearray is freed on return.
+
+UploadLimitMiddleware caps the request body before any of this: it rejects
+a too-large Content-Length up front, and counts the bytes of chunked
+uploads (which have no Content-Length) as they arrive, so an oversized body
+is cut off instead of being spooled in full.
+"""
+import io
+import json
+import asyncio
+import hashlib
+import binascii
+from typing import BinaryIO, Callable, Optional, Union
+
+from logger import setup_logger
+from metrics import metrics
+
+upload_logger = setup_logger("receipt_upload")
+
+# Image formats accepted by the model, by their leading bytes
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# Bytes read at a time (a multiple of 3, so base64 blocks never need padding mid-stream)
+CHUNK_SIZE = 3 * 256 * 1024
+
+class UploadRejected(Exception):
+    """The upload is not an accepted image or exceeds the size cap"""
+
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that refuses request bodies over a size limit while they arrive
+
+    The Content-Length header is checked first. Chunked uploads carry no length,
+    so the body is also counted as it is received: past the limit, receiving raises
+    UploadRejected, and whatever response the application produces instead (usually
+    a body parsing error) is replaced by a 413. Starlette therefore never spools
+    more than the limit to disk, whatever the client sends.
+    """
+
+    def __init__(self, app, limit_for: Callable[[str], Optional[int]]):
+        """
+        Args:
+            app: The ASGI application
+            limit_for: Body size limit in bytes for a request path, or None for no limit
+        """
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        rejection = UploadRejected(413, f"Upload is larger than {limit // (1024 * 1024)} MB")
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, rejection)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise rejection
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadRejected:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(send, rejection)
+
+    @staticmethod
+    async def _reject(send, rejection: "UploadRejected") -> None:
+        metrics.increment("receipt.upload.rejected.size")
+        body = json.dumps({"detail": rejection.reason}).encode("utf-8")
+        await send({"type": "http.response.start", "status": rejection.status_code,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode("ascii")),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """MIME type of an image from its first 12 bytes, or None when it is not an accepted format"""
+    for signature, content_type in SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def _read_full(source: BinaryIO, size: int) -> bytes:
+    """Read size bytes, or fewer only at the end of the file"""
+    chunk = source.read(size)
+    while 0 < len(chunk) < size:
+        more = source.read(size - len(chunk))
+        if not more:
+            break
+        chunk += more
+    return chunk
+
+def encode_base64(source: BinaryIO, size: int) -> str:
+    """
+    Base64-encode a binary file chunk by chunk into a preallocated buffer
+
+    The raw bytes are read CHUNK_SIZE at a time, so only the base64 is held in full. It is
+    returned as a str (the form the message payload takes), which copies the buffer once;
+    the buffer itself is released when this returns.
+
+    Args:
+        source: Seekable binary file (io.BytesIO(data) for bytes, which does not copy them)
+        size: Number of bytes in source
+
+    Returns:
+        The base64 text
+    """
+    encoded = bytearray(4 * ((size + 2) // 3))
+    view = memoryview(encoded)
+    position = 0
+    source.seek(0)
+    while True:
+        chunk = _read_full(source, CHUNK_SIZE)
+        if not chunk:
+            break
+        block = binascii.b2a_base64(chunk, newline=False)
+        if position + len(block) > len(encoded):
+            raise ValueError(f"Upload is longer than the expected {size} bytes")
+        view[position:position + len(block)] = block
+        position += len(block)
+    view.release()
+    if position != len(encoded):
+        raise ValueError(f"Upload is shorter than the expected {size} bytes")
+    return encoded.decode("ascii")
+
+class ReceiptUpload:
+    """A receipt image held as bytes or as a reference to a spooled upload file"""
+
+    def __init__(self, source: Union[bytes, BinaryIO], content_type: str,
+                 size: Optional[int] = None, digest: Optional[str] = None):
+        """
+        Args:
+            source: Image bytes, or a seekable binary file containing them
+            content_type: MIME type of the image
+            size: Length in bytes (measured when omitted)
+            digest: SHA-256 hex digest, if already known
+        """
+        self.source = source
+        self.content_type = content_type
+        if size is None:
+            if isinstance(source, (bytes, bytearray)):
+                size = len(source)
+            else:
+                size = source.seek(0, io.SEEK_END)
+        self.size = size
+        self._digest = digest
+
+    def open(self) -> BinaryIO:
+        """The image as a file positioned at the start"""
+        if isinstance(self.source, (bytes, bytearray)):
+            return io.BytesIO(self.source)
+        self.source.seek(0)
+        return self.source
+
+    def read(self) -> bytes:
+        """The image bytes (loads a file source into memory)"""
+        if isinstance(self.source, bytes):
+            return self.source
+        return self.open().read()
+
+    def digest(self) -> str:
+        """SHA-256 hex digest of the image"""
+        if self._digest is None:
+            if isinstance(self.source, (bytes, bytearray)):
+                self._digest = hashlib.sha256(self.source).hexdigest()
+            else:
+                self._digest = hashlib.file_digest(self.open(), "sha256").hexdigest()
+        return self._digest
+
+    def base64(self) -> str:
+        """The image as base64 text for the model"""
+        return encode_base64(self.open(), self.size)
+
+def scan_upload(file: BinaryIO, max_bytes: int, declared_type: Optional[str] = None) -> ReceiptUpload:
+    """
+    Check an upload file chunk by chunk without loading it into memory
+
+    Args:
+        file: Seekable binary file holding the upload
+        max_bytes: Largest accepted upload
+        declared_type: Content type sent by the client, used only in log messages
+
+    Returns:
+        A ReceiptUpload referencing the file, with the sniffed type, size and SHA-256
+
+    Raises:
+        UploadRejected: If the file is empty, not an accepted image, or larger than max_bytes
+    """
+    file.seek(0)
+    header = file.read(CHUNK_SIZE)
+    content_type = sniff_image_type(header[:12])
+    if content_type is None:
+        metrics.increment("receipt.upload.rejected.type")
+        upload_logger.warning(f"Rejected upload declared as {declared_type}: not a JPEG, PNG, GIF or WebP image")
+        raise UploadRejected(400, "File must be a JPEG, PNG, GIF or WebP image")
+    digest = hashlib.sha256()
+    size, chunk = 0, header
+    while chunk:
+        size += len(chunk)
+        if size > max_bytes:
+            metrics.increment("receipt.upload.rejected.size")
+            upload_logger.warning(f"Rejected upload larger than {max_bytes} bytes")
+            raise UploadRejected(413, f"File is larger than {max_bytes // (1024 * 1024)} MB")
+        digest.update(chunk)
+        chunk = file.read(CHUNK_SIZE)
+    metrics.increment("receipt.upload.bytes", size)
+    return ReceiptUpload(file, content_type, size, digest.hexdigest())
+
+async def read_upload(file, max_bytes: int) -> ReceiptUpload:
+    """
+    Validate a FastAPI UploadFile in a worker thread
+
+    Args:
+        file: The UploadFile (its spooled file stays open until the response is sent)
+        max_bytes: Largest accepted upload
+
+    Returns:
+        A ReceiptUpload referencing the spooled file
+
+    Raises:
+        UploadRejected: If the upload is not an accepted image or is too large
+    """
+    if file.size is not None and file.size > max_bytes:
+        metrics.increment("receipt.upload.rejected.size")
+        raise UploadRejected(413, f"File is larger than {max_bytes // (1024 * 1024)} MB")
+    return await asyncio.to_thread(scan_upload, file.file, max_bytes, file.content_type)
@@ -0,0 +1,136 @@
+"""
+Local checks of extracted receipt data.
+
+The vision model sometimes returns a receipt whose items do not add up to
+the total, a date in another format, or a category outside the enum.
+ReceiptValidator catches these without another model call. Harmless gaps
+are filled in place: a missing quantity becomes 1, and "$4.50" becomes
+4.5. Anything else is reported as a problem. ReceiptProcessor then sends
+the problems, together with the model's earlier answer, in a short
+text-only repair prompt instead of repeating the vision call.
+
+Receipts often add tax, tips or fees that are not itemized, and the model
+may give line totals or unit prices. The item sum therefore passes when
+either sum(price) or sum(price * quantity) is within the tolerance below
+the total.
+"""
+import re
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+REQUIRED_FIELDS = ("merchant_name", "date", "items", "total", "category", "description")
+
+_AMOUNT_RE = re.compile(r"^\s*([-+]?)\s*[$€£]?\s*([-+]?)(\d[\d,.]*)\s*[$€£]?\s*$")
+# "1,234.50" and "12.5": commas are thousands separators
+_POINT_DECIMAL_RE = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?")
+# "4,50" and "1.234,50": the comma is the decimal separator
+_COMMA_DECIMAL_RE = re.compile(r"\d{1,3}(?:\.\d{3})*,\d{1,2}|\d+,\d{1,2}")
+
+def parse_amount(value: Any) -> Optional[float]:
+    """
+    A number from an int, float or currency string, or None
+
+    Both "$1,234.50" and "1.234,50 €" are read as 1234.5, and "4,50" as 4.5. Strings
+    that fit neither convention ("1,2,3", "1.234.5") are not amounts.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _AMOUNT_RE.match(value) if isinstance(value, str) else None
+    if match is None:
+        return None
+    digits = match.group(3)
+    if _POINT_DECIMAL_RE.fullmatch(digits):
+        number = float(digits.replace(",", ""))
+    elif _COMMA_DECIMAL_RE.fullmatch(digits):
+        number = float(digits.replace(".", "").replace(",", "."))
+    else:
+        return None
+    return -number if "-" in (match.group(1) + match.group(2)) else number
+
+class ReceiptValidator:
+    """Arithmetic, date and category checks of extracted receipt data"""
+
+    def __init__(self, categories: Iterable[str], tax_tolerance: float = 0.15,
+                 absolute_tolerance: float = 0.05, max_age_days: int = 3650):
+        """
+        Args:
+            categories: Accepted category values
+            tax_tolerance: How far the total may exceed the item sum, as a fraction of the sum (tax, tip, fees)
+            absolute_tolerance: Rounding slack in currency units, in either direction
+            max_age_days: Oldest accepted receipt date
+        """
+        self.categories = set(categories)
+        self.tax_tolerance = tax_tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.max_age_days = max_age_days
+
+    def check(self, receipt_data: Dict[str, Any], today: Optional[date] = None) -> List[str]:
+        """
+        Normalize receipt data in place and list what is still wrong with it
+
+        Args:
+            receipt_data: Receipt data as parsed from the model's answer
+            today: Reference date for the date check (defaults to today)
+
+        Returns:
+            Problem descriptions, phrased for the repair prompt (empty when the receipt passes)
+        """
+        problems = [f"missing field {field!r}" for field in REQUIRED_FIELDS if field not in receipt_data]
+        today = today or date.today()
+
+        total = parse_amount(receipt_data.get("total"))
+        if "total" in receipt_data:
+            if total is None:
+                problems.append(f"total {receipt_data['total']!r} is not a number")
+            else:
+                receipt_data["total"] = total
+
+        known_problems = len(problems)
+        items = receipt_data.get("items")
+        if "items" in receipt_data and not isinstance(items, list):
+            problems.append("items is not a list")
+            items = None
+        unit_sum = line_sum = 0.0
+        for index, item in enumerate(items or []):
+            if not isinstance(item, dict) or not item.get("name"):
+                problems.append(f"item {index} has no name")
+                continue
+            price = parse_amount(item.get("price"))
+            if price is None:
+                problems.append(f"item {index} ({item['name']!r}) has no numeric price")
+                continue
+            item["price"] = price
+            quantity = parse_amount(item.get("quantity", 1))
+            if quantity is None or quantity <= 0:
+                quantity = 1.0
+            item["quantity"] = int(quantity) if quantity.is_integer() else quantity
+            unit_sum += price
+            line_sum += price * quantity
+
+        if items and total is not None and len(problems) == known_problems:
+            if not any(self._sums_to_total(candidate, total) for candidate in {round(unit_sum, 2), round(line_sum, 2)}):
+                problems.append(f"items add up to {line_sum:.2f} (or {unit_sum:.2f} if prices are line totals), "
+                                f"which does not match total {total:.2f} even allowing for tax and tips")
+
+        if "date" in receipt_data:
+            try:
+                parsed = datetime.strptime(str(receipt_data["date"]), "%Y-%m-%d").date()
+            except ValueError:
+                problems.append(f"date {receipt_data['date']!r} is not a valid YYYY-MM-DD date")
+            else:
+                # One day ahead is allowed for receipts from time zones east of the server
+                if (parsed - today).days > 1 or (today - parsed).days > self.max_age_days:
+                    problems.append(f"date {receipt_data['date']} is implausible for a receipt processed on {today}")
+
+        if "category" in receipt_data and receipt_data["category"] not in self.categories:
+            category = str(receipt_data["category"]).strip().lower()
+            if category in self.categories:
+                receipt_data["category"] = category
+            else:
+                problems.append(f"category {receipt_data['category']!r} is not one of {', '.join(sorted(self.categories))}")
+        return problems
+
+    def _sums_to_total(self, item_sum: float, total: float) -> bool:
+        return item_sum - self.absolute_tolerance <= total <= item_sum * (1 + self.tax_tolerance) + self.absolute_tolerance
@@ -0,0 +1,158 @@
+import threading
+import time
+from typing import Optional, Dict, Any, Callable
+
+from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models import BaseChatModel
+
+from logger import logger
+from metrics import metrics
+from budget_planner import BudgetPlanner
+from receipt_processor import ReceiptProcessor
+
+DEFAULT_MODEL_NAME = "claude-3-7-sonnet-20250219"
+
+class ServiceRegistry:
+    """
+    Process-wide holder for the chat model, BudgetPlanner, ReceiptProcessor and
+    the receipt cache.
+
+    Each component is built once per worker and then reused by every request,
+    so the Anthropic HTTP connection pool and the compiled LangGraph workflows
+    are shared instead of being recreated per call. Components that open files
+    (the receipt cache) are built from factories on first use, so constructing
+    the registry has no side effects, and they are closed on shutdown.
+    """
+
+    def __init__(self, api_key: str, postgres_connection: Optional[str] = None,
+                 model_name: str = DEFAULT_MODEL_NAME, llm: Optional[BaseChatModel] = None,
+                 planner_options: Optional[Dict[str, Any]] = None,
+                 receipt_options: Optional[Dict[str, Any]] = None,
+                 receipt_cache_factory: Optional[Callable[[], Any]] = None):
+        """
+        Initialize the registry (components are built lazily or by warm_up)
+
+        Args:
+            api_key: Anthropic API key
+            postgres_connection: PostgreSQL connection string
+            model_name: Claude model name to use
+            llm: Optional pre-built chat model to share between components
+            planner_options: Extra keyword arguments for BudgetPlanner
+            receipt_options: Extra keyword arguments for ReceiptProcessor
+            receipt_cache_factory: Builds the ReceiptCache handed to ReceiptProcessor (returns None when disabled)
+        """
+        self.api_key = api_key
+        self.postgres_connection = postgres_connection
+        self.model_name = model_name
+        self.planner_options = planner_options or {}
+        self.receipt_options = receipt_options or {}
+        self.receipt_cache_factory = receipt_cache_factory
+        self._receipt_cache = None
+        self._injected_llm = llm
+        self._llm = llm
+        self._budget_planner: Optional[BudgetPlanner] = None
+        self._receipt_processor: Optional[ReceiptProcessor] = None
+        self._lock = threading.Lock()
+
+    def _build_llm(self) -> BaseChatModel:
+        return ChatAnthropic(
+            model=self.model_name,
+            temperature=0,
+            anthropic_api_key=self.api_key,
+            max_tokens=1000
+        )
+
+    def get_llm(self) -> BaseChatModel:
+        """Return the shared chat model, creating it on first use"""
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    with metrics.timer("registry.build.llm.seconds"):
+                        self._llm = self._build_llm()
+        return self._llm
+
+    def get_budget_planner(self) -> BudgetPlanner:
+        """Return the shared BudgetPlanner, building it on first use"""
+        if self._budget_planner is None:
+            llm = self.get_llm()
+            with self._lock:
+                if self._budget_planner is None:
+                    with metrics.timer("registry.build.budget_planner.seconds"):
+                        self._budget_planner = BudgetPlanner(
+                            api_key=self.api_key,
+                            model_name=self.model_name,
+                            postgres_connection=self.postgres_connection,
+                            llm=llm,
+                            **self.planner_options
+                        )
+        return self._budget_planner
+
+    def get_receipt_cache(self):
+        """Return the shared ReceiptCache (None when disabled), opening it on first use"""
+        if self._receipt_cache is None and self.receipt_cache_factory is not None:
+            with self._lock:
+                if self._receipt_cache is None:
+                    self._receipt_cache = self.receipt_cache_factory()
+        return self._receipt_cache
+
+    @property
+    def receipt_cache(self):
+        """The receipt cache if it has been opened (None otherwise), without opening it"""
+        return self._receipt_cache
+
+    def get_receipt_processor(self) -> ReceiptProcessor:
+        """Return the shared ReceiptProcessor, building it on first use"""
+        if self._receipt_processor is None:
+            llm = self.get_llm()
+            cache = self.get_receipt_cache()
+            with self._lock:
+                if self._receipt_processor is None:
+                    with metrics.timer("registry.build.receipt_processor.seconds"):
+                        options = dict(self.receipt_options)
+                        if cache is not None:
+                            options["cache"] = cache
+                        self._receipt_processor = ReceiptProcessor(
+                            api_key=self.api_key,
+                            model_name=self.model_name,
+                            model=llm,
+                            **options
+                        )
+        return self._receipt_processor
+
+    def warm_up(self) -> None:
+        """Build every component and open the model's HTTP clients ahead of traffic"""
+        start = time.perf_counter()
+        llm = self.get_llm()
+        # ChatAnthropic creates its (pooled) sync and async clients lazily
+        for attr in ("_client", "_async_client"):
+            try:
+                getattr(llm, attr)
+            except AttributeError:
+                pass
+        self.get_budget_planner()
+        self.get_receipt_processor()
+        elapsed = time.perf_counter() - start
+        metrics.observe("registry.warm_up.seconds", elapsed)
+        logger.info(f"Service registry warmed up in {elapsed * 1000:.1f} ms")
+
+    async def aclose(self) -> None:
+        """Release async resources (connection pools, the chat session store) and drop the shared components"""
+        if self._budget_planner is not None:
+            await self._budget_planner.aclose()
+        session_store = self.planner_options.get("session_store")
+        if session_store is not None:
+            await session_store.aclose()
+        self.close()
+
+    def close(self) -> None:
+        """Drop the shared components and close the receipt cache (called on application shutdown)"""
+        with self._lock:
+            if self._receipt_processor is not None:
+                self._receipt_processor.close()
+            if self._receipt_cache is not None:
+                self._receipt_cache.close()
+            self._budget_planner = None
+            self._receipt_processor = None
+            self._receipt_cache = None
+            self._llm = self._injected_llm
+        logger.info("Service registry closed")
@@ -0,0 +1,117 @@
+"""
+Bounded accumulation of database results before they reach a prompt.
+
+Rows are consumed one at a time (typically from a server-side cursor). The
+first max_rows rows are kept verbatim; past that only running aggregates are
+updated, so memory use and the size of db_data stay bounded however many rows
+the query returns.
+"""
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Union
+
+class ResultAccumulator:
+    """Keeps up to max_rows rows plus counts, sums, date ranges and top-N values for all rows"""
+
+    def __init__(self, max_rows: int = 200, top_n: int = 5, max_distinct: int = 100,
+                 sample_size: int = 20):
+        """
+        Initialize the accumulator
+
+        Args:
+            max_rows: Rows kept verbatim; larger results are summarised
+            top_n: Number of most frequent values reported per text column
+            max_distinct: Distinct values tracked per text column before it is
+                treated as high-cardinality and dropped from the top-N report
+            sample_size: Rows included as a sample when the result is summarised
+        """
+        self.max_rows = max_rows
+        self.top_n = top_n
+        self.max_distinct = max_distinct
+        self.sample_size = sample_size
+        self.rows: List[Dict[str, Any]] = []
+        self.total_rows = 0
+        self._numeric: Dict[str, Dict[str, float]] = {}
+        self._dates: Dict[str, Dict[str, date]] = {}
+        self._values: Dict[str, Counter] = {}
+        self._high_cardinality = set()
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Consume one row"""
+        self.total_rows += 1
+        if len(self.rows) < self.max_rows:
+            self.rows.append(row)
+        for column, value in row.items():
+            if value is None:
+                continue
+            if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+                self._add_numeric(column, float(value))
+            elif isinstance(value, date):
+                self._add_date(column, value)
+            elif column not in self._high_cardinality:
+                self._add_value(column, str(value))
+
+    def _add_numeric(self, column: str, value: float) -> None:
+        stats = self._numeric.get(column)
+        if stats is None:
+            self._numeric[column] = {"count": 1, "sum": value, "min": value, "max": value}
+            return
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+
+    def _add_date(self, column: str, value: date) -> None:
+        stats = self._dates.get(column)
+        if stats is None:
+            self._dates[column] = {"min": value, "max": value}
+            return
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+
+    def _add_value(self, column: str, value: str) -> None:
+        counter = self._values.setdefault(column, Counter())
+        counter[value] += 1
+        if len(counter) > self.max_distinct:
+            self._high_cardinality.add(column)
+            del self._values[column]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_rows > self.max_rows
+
+    def result(self) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Return the rows unchanged when within the cap, otherwise a summary
+
+        The summary keeps the first sample_size rows and adds the total row
+        count, per-column sum/min/max/avg for numeric columns, the range of
+        date columns and the top-N
+        most frequent values for low-cardinality text columns.
+        """
+        if not self.truncated:
+            return self.rows
+        numeric = {
+            column: {
+                "sum": round(stats["sum"], 2),
+                "min": stats["min"],
+                "max": stats["max"],
+                "avg": round(stats["sum"] / stats["count"], 2),
+            }
+            for column, stats in self._numeric.items()
+        }
+        date_ranges = {
+            column: {"min": stats["min"].isoformat(), "max": stats["max"].isoformat()}
+            for column, stats in self._dates.items()
+        }
+        top_values = {
+            column: counter.most_common(self.top_n)
+            for column, counter in self._values.items()
+        }
+        return {
+            "truncated": True,
+            "total_rows": self.total_rows,
+            "sample_rows": self.rows[:self.sample_size],
+            "summary": {"numeric": numeric, "date_ranges": date_ranges, "top_values": top_values},
+        }
@@ -0,0 +1,81 @@
+"""
+Identify the user a budget chat request acts for.
+
+Generated SQL is bound to the requesting user's id, including writes, so the
+id must not come from the request body. The RAG service sits behind the
+backend, which authenticates users. The backend forwards the user's id in the
+X-User-ID header and proves it is the caller with
+"Authorization: Bearer <RAG_SERVICE_TOKEN>". Requests without the token
+are refused.
+
+Without a service token the service can run in single-user mode for local
+development (RAG_SINGLE_USER_ID): every request acts as that one user and
+X-User-ID is ignored. With neither setting, budget chat is refused.
+"""
+import hmac
+from typing import Optional
+
+from logger import setup_logger
+from metrics import metrics
+
+auth_logger = setup_logger("service_auth")
+
+USER_HEADER = "X-User-ID"
+
+class AuthRejected(Exception):
+    """Raised when a request does not identify its user in a trusted way"""
+
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+class UserResolver:
+    """Resolves the acting user from the service token and X-User-ID header"""
+
+    def __init__(self, service_token: Optional[str] = None, single_user_id: Optional[int] = None):
+        """
+        Args:
+            service_token: Shared secret the backend sends as a bearer token (multi-user mode)
+            single_user_id: User every request acts as when no service token is set (development)
+        """
+        self.service_token = service_token or None
+        self.single_user_id = single_user_id
+        if self.service_token:
+            auth_logger.info(f"Budget chat acts for the user in {USER_HEADER}, authenticated by the service token")
+        elif single_user_id is not None:
+            auth_logger.warning(f"No service token set: every budget chat request acts as user {single_user_id}")
+        else:
+            auth_logger.warning("Neither a service token nor a single user id is set: budget chat is disabled")
+
+    def resolve(self, authorization: Optional[str], user_header: Optional[str]) -> int:
+        """
+        Return the id of the user a request acts for
+
+        Args:
+            authorization: The Authorization header
+            user_header: The X-User-ID header
+
+        Returns:
+            The user id
+
+        Raises:
+            AuthRejected: If the caller is not the trusted backend or the user id is missing or invalid
+        """
+        if not self.service_token:
+            if self.single_user_id is None:
+                raise AuthRejected(503, "Budget chat is not configured: set RAG_SERVICE_TOKEN or RAG_SINGLE_USER_ID")
+            return self.single_user_id
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), self.service_token.encode()):
+            metrics.increment("service_auth.rejected.token")
+            raise AuthRejected(401, "Invalid or missing service token")
+        try:
+            user_id = int(user_header or "")
+        except ValueError:
+            metrics.increment("service_auth.rejected.user")
+            raise AuthRejected(400, f"{USER_HEADER} must be the user's numeric id")
+        if user_id <= 0:
+            metrics.increment("service_auth.rejected.user")
+            raise AuthRejected(400, f"{USER_HEADER} must be the user's numeric id")
+        return user_id
@@ -0,0 +1,332 @@
+"""
+Precomputed per-user spending rollups for common budget chat questions.
+
+spending_rollups holds the total and item count per user, category, source
+table and day or month. A PostgreSQL trigger on expenses keeps it current:
+every insert, update or delete adds or subtracts its amount in the same
+transaction, whichever service wrote the row. Days are UTC dates.
+
+match_question recognises "how much did I spend (on <category>) <period>"
+questions and returns a parameterized query against the rollups, so
+BudgetPlanner can answer them without generating SQL.
+
+Install the table and triggers, backfill existing rows and check the
+rollups against the source tables from the command line:
+    python spending_rollups.py install --dsn $POSTGRESQL_URL
+    python spending_rollups.py backfill --dsn $POSTGRESQL_URL [--user-id 7]
+    python spending_rollups.py check --dsn $POSTGRESQL_URL [--user-id 7] [--repair]
+"""
+import os
+import re
+import json
+import calendar
+import argparse
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from logger import setup_logger
+from metrics import metrics
+from db_pool import PostgresPool
+from sql_cache import EXPENSE_CATEGORIES
+
+rollup_logger = setup_logger("spending_rollups")
+
+# Source table -> timestamp column the rollup day is taken from. Only expenses is rolled up: it is the one
+# spending table in the schema the generated SQL answers from, and transactions (per-item shares of split bills)
+# can record the same purchase again, so adding both would count it twice. Rollup queries filter on
+# SPENDING_SOURCE, so rows left by an install that also covered transactions are ignored.
+SOURCES: Dict[str, str] = {"expenses": "date"}
+SPENDING_SOURCE = "expenses"
+
+TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS spending_rollups (
+    user_id integer NOT NULL,
+    period text NOT NULL CHECK (period IN ('day', 'month')),
+    period_start date NOT NULL,
+    category text NOT NULL,
+    source text NOT NULL,
+    total numeric NOT NULL DEFAULT 0,
+    item_count integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, period, period_start, category, source)
+);
+
+CREATE OR REPLACE FUNCTION spending_rollup_apply(p_user_id integer, p_category text, p_day date,
+                                                 p_source text, p_amount numeric, p_count integer)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO spending_rollups AS r (user_id, period, period_start, category, source, total, item_count)
+    VALUES (p_user_id, 'day', p_day, p_category, p_source, p_amount, p_count),
+           (p_user_id, 'month', date_trunc('month', p_day)::date, p_category, p_source, p_amount, p_count)
+    ON CONFLICT (user_id, period, period_start, category, source)
+    DO UPDATE SET total = r.total + EXCLUDED.total, item_count = r.item_count + EXCLUDED.item_count;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGER_DDL = """
+CREATE OR REPLACE FUNCTION spending_rollup_{source}() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM spending_rollup_apply(OLD.user_id, OLD.category::text, (OLD.{column} AT TIME ZONE 'UTC')::date,
+                                      '{source}', -OLD.amount::numeric, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM spending_rollup_apply(NEW.user_id, NEW.category::text, (NEW.{column} AT TIME ZONE 'UTC')::date,
+                                      '{source}', NEW.amount::numeric, 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS spending_rollup_{source} ON {source};
+CREATE TRIGGER spending_rollup_{source} AFTER INSERT OR UPDATE OR DELETE ON {source}
+    FOR EACH ROW EXECUTE FUNCTION spending_rollup_{source}();
+"""
+
+ROLLUP_COLUMNS = "user_id, period, period_start, category, source, total, item_count"
+
+def _aggregate_sql(sources: Sequence[str], user_filter: bool) -> str:
+    """SELECT that recomputes the rollup rows from the source tables"""
+    where = " WHERE user_id = %(user_id)s" if user_filter else ""
+    rows = " UNION ALL ".join(
+        f"SELECT user_id, category::text AS category, ({SOURCES[source]} AT TIME ZONE 'UTC')::date AS day, "
+        f"amount::numeric AS amount, '{source}' AS source FROM {source}{where}"
+        for source in sources
+    )
+    return f"""
+    SELECT s.user_id, p.period,
+           CASE WHEN p.period = 'day' THEN s.day ELSE date_trunc('month', s.day)::date END AS period_start,
+           s.category, s.source, SUM(s.amount) AS total, COUNT(*) AS item_count
+    FROM ({rows}) s CROSS JOIN (VALUES ('day'), ('month')) AS p(period)
+    GROUP BY 1, 2, 3, 4, 5
+    """
+
+class SpendingRollups:
+    """Installs, backfills and checks the spending_rollups table"""
+
+    def __init__(self, db_pool: PostgresPool, sources: Sequence[str] = tuple(SOURCES)):
+        """
+        Initialize the rollup tooling
+
+        Args:
+            db_pool: Pool for the budget database
+            sources: Source tables to roll up
+        """
+        unknown = set(sources) - set(SOURCES)
+        if unknown:
+            raise ValueError(f"Unknown rollup sources: {', '.join(sorted(unknown))}")
+        self.db_pool = db_pool
+        self.sources = list(sources)
+
+    def install(self) -> None:
+        """Create the rollup table, the update function and a trigger on every source table"""
+        with self.db_pool.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(TABLE_DDL)
+                for source in self.sources:
+                    cursor.execute(TRIGGER_DDL.format(source=source, column=SOURCES[source]))
+        rollup_logger.info(f"Installed spending rollups on {', '.join(self.sources)}")
+
+    def backfill(self, user_id: Optional[int] = None) -> int:
+        """
+        Rebuild rollup rows from the source tables
+
+        Writes to the source tables wait until the rebuild commits, so no insert
+        is counted twice or missed.
+
+        Args:
+            user_id: Only rebuild this user's rows (all users when None)
+
+        Returns:
+            Number of rollup rows written
+        """
+        user_filter = user_id is not None
+        with self.db_pool.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {', '.join(self.sources)} IN SHARE MODE")
+                scope = "source = ANY(%(sources)s)" + (" AND user_id = %(user_id)s" if user_filter else "")
+                cursor.execute(f"DELETE FROM spending_rollups WHERE {scope}",
+                               {"user_id": user_id, "sources": self.sources})
+                cursor.execute(f"INSERT INTO spending_rollups ({ROLLUP_COLUMNS}) "
+                               + _aggregate_sql(self.sources, user_filter), {"user_id": user_id})
+                written = cursor.rowcount
+        metrics.increment("spending_rollups.backfill.rows", written)
+        rollup_logger.info(f"Backfilled {written} rollup rows" + (f" for user {user_id}" if user_filter else ""))
+        return written
+
+    def check(self, user_id: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+        """
+        Compare the rollups with totals recomputed from the source tables
+
+        Args:
+            user_id: Only check this user's rows (all users when None)
+            limit: Maximum number of mismatched rows returned
+
+        Returns:
+            {"mismatches": total count, "rows": up to limit mismatched rows}
+        """
+        user_filter = user_id is not None
+        query = f"""
+        WITH expected AS ({_aggregate_sql(self.sources, user_filter)}),
+        actual AS (
+            SELECT {ROLLUP_COLUMNS} FROM spending_rollups
+            WHERE source = ANY(%(sources)s) AND NOT (total = 0 AND item_count = 0)
+            {"AND user_id = %(user_id)s" if user_filter else ""}
+        )
+        SELECT user_id, period, period_start, category, source,
+               e.total AS expected_total, a.total AS rollup_total,
+               e.item_count AS expected_count, a.item_count AS rollup_count,
+               COUNT(*) OVER () AS mismatches
+        FROM expected e FULL OUTER JOIN actual a USING (user_id, period, period_start, category, source)
+        WHERE e.total IS DISTINCT FROM a.total OR e.item_count IS DISTINCT FROM a.item_count
+        ORDER BY user_id, period, period_start, category, source
+        LIMIT %(limit)s
+        """
+        with self.db_pool.transaction(read_only=True) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, {"user_id": user_id, "sources": self.sources, "limit": limit})
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        mismatches = rows[0].pop("mismatches") if rows else 0
+        for row in rows[1:]:
+            row.pop("mismatches")
+        if mismatches:
+            metrics.increment("spending_rollups.check.mismatches", mismatches)
+            rollup_logger.warning(f"Found {mismatches} spending rollup rows that differ from the source tables")
+        return {"mismatches": mismatches, "rows": rows}
+
+# Questions the rollups can answer: a spending total, optionally per category, over a known period
+_SPEND_RE = re.compile(r"\b(spend|spent|spending|expenses|expenditure)\b", re.I)
+# Anything finer-grained than category totals goes to ad-hoc SQL
+_UNSUPPORTED_RE = re.compile(
+    r"\b(merchant|store|restaurant|average|avg|mean|largest|biggest|smallest|highest|lowest|most|least|list|"
+    r"which|where|what did i buy|budget|goal|left|remaining|compare|vs|versus|per day|daily|each day|trend|"
+    r"split|owe)\b", re.I)
+_CATEGORY_RE = re.compile(r"\b(" + "|".join(EXPENSE_CATEGORIES) + r")\b", re.I)
+# "on groceries", "at Starbucks": what follows must be a category, or the rollup total would be wrong
+_TARGET_RE = re.compile(r"\b(?:on|at|from|with)\s+(\w+)", re.I)
+_TARGET_WORDS = set(EXPENSE_CATEGORIES) | {"my", "the", "all", "everything", "each", "every"}
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+# A month name needs a date context ("in May", "May 2024"), so the verb in "may I spend..." is not a period
+_MONTH_NAMES = "|".join(_MONTHS)
+_MONTH_RE = re.compile(rf"\b(?:(?:in|during|for)\s+({_MONTH_NAMES})(?:,?\s+(\d{{4}}))?|({_MONTH_NAMES}),?\s+(\d{{4}}))\b",
+                       re.I)
+_LAST_DAYS_RE = re.compile(r"\b(?:last|past)\s+(\d{1,3})\s+days\b", re.I)
+_RELATIVE_RE = re.compile(r"\b(today|yesterday|this week|last week|this month|last month|this year|last year)\b",
+                          re.I)
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def question_period(prompt: str, today: Optional[date] = None) -> Optional[Tuple[str, date, date]]:
+    """
+    Find the period a question asks about
+
+    Args:
+        prompt: The user's question
+        today: Reference date (today in UTC when None)
+
+    Returns:
+        (rollup period "day" or "month", first day, day after the last day), or None
+    """
+    today = today or datetime.now(timezone.utc).date()
+    match = _LAST_DAYS_RE.search(prompt)
+    if match:
+        days = int(match.group(1))
+        return ("day", today - timedelta(days=days - 1), today + timedelta(days=1)) if days else None
+    match = _RELATIVE_RE.search(prompt)
+    if match:
+        phrase = match.group(1).lower()
+        month_start = today.replace(day=1)
+        week_start = today - timedelta(days=today.weekday())
+        return {
+            "today": ("day", today, today + timedelta(days=1)),
+            "yesterday": ("day", today - timedelta(days=1), today),
+            "this week": ("day", week_start, today + timedelta(days=1)),
+            "last week": ("day", week_start - timedelta(days=7), week_start),
+            "this month": ("month", month_start, _add_months(month_start, 1)),
+            "last month": ("month", _add_months(month_start, -1), month_start),
+            "this year": ("month", date(today.year, 1, 1), date(today.year + 1, 1, 1)),
+            "last year": ("month", date(today.year - 1, 1, 1), date(today.year, 1, 1)),
+        }[phrase]
+    match = _MONTH_RE.search(prompt)
+    if match:
+        name, year = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+        month = _MONTHS[name.lower()]
+        year = int(year) if year else today.year - (month > today.month)
+        start = date(year, month, 1)
+        return "month", start, _add_months(start, 1)
+    return None
+
+def match_question(prompt: str, today: Optional[date] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Build a rollup query for a spending question, if the rollups can answer it
+
+    Args:
+        prompt: The user's question
+        today: Reference date for relative periods (today in UTC when None)
+
+    Returns:
+        (SQL with a %(user_id)s placeholder, parameters without user_id), or None
+    """
+    if not _SPEND_RE.search(prompt) or _UNSUPPORTED_RE.search(prompt):
+        return None
+    if any(target.lower() not in _TARGET_WORDS for target in _TARGET_RE.findall(prompt)):
+        return None
+    period = question_period(prompt, today)
+    if period is None:
+        return None
+    rollup_period, start, end = period
+    params: Dict[str, Any] = {"rollup_period": rollup_period, "rollup_start": start, "rollup_end": end,
+                              "rollup_last_day": end - timedelta(days=1), "rollup_source": SPENDING_SOURCE}
+    categories = sorted({category.lower() for category in _CATEGORY_RE.findall(prompt)})
+    category_filter = ""
+    if categories:
+        params["rollup_categories"] = categories
+        category_filter = "AND category = ANY(%(rollup_categories)s)"
+    sql = f"""
+    SELECT category, SUM(total) AS total, SUM(item_count) AS items,
+           %(rollup_start)s::date AS period_start, %(rollup_last_day)s::date AS period_end
+    FROM spending_rollups
+    WHERE user_id = %(user_id)s AND source = %(rollup_source)s AND period = %(rollup_period)s
+      AND period_start >= %(rollup_start)s AND period_start < %(rollup_end)s {category_filter}
+    GROUP BY category
+    HAVING SUM(item_count) > 0
+    ORDER BY total DESC
+    """
+    return " ".join(sql.split()), params
+
+def main():
+    parser = argparse.ArgumentParser(description="Install, backfill and check the spending rollups")
+    parser.add_argument("command", choices=["install", "backfill", "check"])
+    parser.add_argument("--dsn", default=os.getenv("POSTGRESQL_URL"), help="PostgreSQL DSN (default $POSTGRESQL_URL)")
+    parser.add_argument("--sources", nargs="+", default=list(SOURCES), choices=list(SOURCES))
+    parser.add_argument("--user-id", type=int, default=None, help="Only backfill or check this user")
+    parser.add_argument("--limit", type=int, default=20, help="Mismatched rows to print")
+    parser.add_argument("--repair", action="store_true", help="Backfill when check finds mismatches")
+    parser.add_argument("--timeout-ms", type=int, default=600000, help="Statement timeout")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or POSTGRESQL_URL is required")
+
+    pool = PostgresPool(args.dsn, max_size=1, statement_timeout_ms=args.timeout_ms)
+    rollups = SpendingRollups(pool, sources=args.sources)
+    try:
+        if args.command == "install":
+            rollups.install()
+            print(f"Installed spending rollups on {', '.join(args.sources)}; run backfill next")
+        elif args.command == "backfill":
+            print(f"Wrote {rollups.backfill(args.user_id)} rollup rows")
+        else:
+            report = rollups.check(args.user_id, limit=args.limit)
+            print(json.dumps(report, indent=2, default=str))
+            if report["mismatches"] and args.repair:
+                print(f"Repaired: wrote {rollups.backfill(args.user_id)} rollup rows")
+            elif report["mismatches"]:
+                raise SystemExit(1)
+    finally:
+        pool.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Parameterized text-to-SQL template cache for BudgetPlanner.
+
+User prompts are normalized into an intent key by replacing amounts, dates and
+expense categories with numbered slots. Generated SQL uses psycopg2 named
+placeholders (%(user_id)s, %(amount_0)s, ...) so a cached template can be
+re-bound safely for any user and any slot values with the same question shape.
+"""
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from logger import setup_logger
+from metrics import metrics
+
+cache_logger = setup_logger("sql_cache")
+
+EXPENSE_CATEGORIES = [
+    "food", "transportation", "housing", "utilities", "entertainment", "healthcare",
+    "shopping", "education", "personal", "savings", "investments", "other"
+]
+
+_AMOUNT_RE = re.compile(r"\$\s?(\d+(?:,\d{3})*(?:\.\d+)?)|\b(\d+(?:\.\d+)?)\s*(?:dollars|usd|bucks)\b", re.I)
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_US_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+_CATEGORY_RE = re.compile(r"\b(" + "|".join(EXPENSE_CATEGORIES) + r")\b", re.I)
+_PLACEHOLDER_RE = re.compile(r"%\((\w+)\)s")
+_PERCENT_RE = re.compile(r"%%|%\(\w+\)s|%")
+_USER_ID_PLACEHOLDER = "%(user_id)s"
+# user_id compared with a literal, in either order, or matched against a list
+_LITERAL_USER_ID_RE = re.compile(
+    r"\buser_id\s*(?:=|<>|!=)\s*'?\d|'?\d+'?\s*(?:=|<>|!=)\s*(?:\w+\.)?user_id\b|"
+    r"\buser_id\s+(?:not\s+)?in\s*\((?!\s*%\(user_id\)s\s*\))", re.I)
+_INSERT_RE = re.compile(r"\binsert\s+into\s+[\w.\"]+\s*\(([^)]*)\)\s*values\s*", re.I)
+_ROW_START_RE = re.compile(r"\s*\(")
+_ROW_SEPARATOR_RE = re.compile(r"\s*,")
+
+def normalize_prompt(prompt: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Replace slot values in a prompt with numbered placeholders
+
+    Args:
+        prompt: The user's request
+
+    Returns:
+        Tuple of (normalized text, slot parameters keyed by placeholder name)
+    """
+    params: Dict[str, Any] = {}
+    counters = {"amount": 0, "date": 0, "category": 0}
+
+    def _slot(kind: str, value: Any) -> str:
+        name = f"{kind}_{counters[kind]}"
+        counters[kind] += 1
+        params[name] = value
+        return f"<{name}>"
+
+    # Impossible dates ("2024-02-30") are left in the text instead of becoming a slot
+    def _iso_date(match):
+        year, month, day = (int(g) for g in match.groups())
+        try:
+            return _slot("date", datetime(year, month, day).date().isoformat())
+        except ValueError:
+            return match.group(0)
+
+    def _us_date(match):
+        month, day, year = (int(g) for g in match.groups())
+        try:
+            return _slot("date", datetime(year, month, day).date().isoformat())
+        except ValueError:
+            return match.group(0)
+
+    text = prompt.strip()
+    text = _ISO_DATE_RE.sub(_iso_date, text)
+    text = _US_DATE_RE.sub(_us_date, text)
+    text = _AMOUNT_RE.sub(
+        lambda m: _slot("amount", float((m.group(1) or m.group(2)).replace(",", ""))), text)
+    text = _CATEGORY_RE.sub(lambda m: _slot("category", m.group(1).lower()), text)
+    text = re.sub(r"[^\w<>\s]", " ", text.lower())
+    return " ".join(text.split()), params
+
+def prepare_template(sql: str) -> str:
+    """Strip code fences and escape bare % signs so the SQL can be executed with parameters"""
+    sql = sql.strip()
+    if sql.startswith("```"):
+        sql = sql.strip("`")
+        if sql.lower().startswith("sql"):
+            sql = sql[3:]
+        sql = sql.strip()
+    return _PERCENT_RE.sub(lambda m: "%%" if m.group(0) == "%" else m.group(0), sql)
+
+def _split_top_level(text: str) -> List[str]:
+    """Split a comma-separated SQL list, ignoring commas inside parentheses and string literals"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for index, ch in enumerate(text):
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(text[start:index].strip())
+            start = index + 1
+    parts.append(text[start:].strip())
+    return parts
+
+def _values_rows(sql: str, start: int) -> List[str]:
+    """The parenthesized rows of a VALUES list starting at start"""
+    rows = []
+    while True:
+        match = _ROW_START_RE.match(sql, start)
+        if not match:
+            return rows
+        depth, quoted = 0, False
+        for index in range(match.end() - 1, len(sql)):
+            ch = sql[index]
+            if ch == "'":
+                quoted = not quoted
+            elif not quoted and ch == "(":
+                depth += 1
+            elif not quoted and ch == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+        else:
+            return rows
+        rows.append(sql[match.end():index])
+        comma = _ROW_SEPARATOR_RE.match(sql, index + 1)
+        if not comma:
+            return rows
+        start = comma.end()
+
+def _hard_codes_user_id(sql: str) -> bool:
+    """Whether the SQL compares user_id with a literal or inserts a user_id other than the placeholder"""
+    if _LITERAL_USER_ID_RE.search(sql):
+        return True
+    for insert in _INSERT_RE.finditer(sql):
+        columns = [column.strip().strip('"').lower() for column in _split_top_level(insert.group(1))]
+        if "user_id" not in columns:
+            continue
+        position = columns.index("user_id")
+        for row in _values_rows(sql, insert.end()):
+            values = _split_top_level(row)
+            if position >= len(values) or values[position] != _USER_ID_PLACEHOLDER:
+                return True
+    return False
+
+def is_cacheable(sql: str, params: Dict[str, Any]) -> bool:
+    """
+    Whether generated SQL is safe to reuse for other users and slot values
+
+    A template is reusable only if every slot is a placeholder, it is scoped to the
+    requesting user with %(user_id)s, and no user id is hard-coded anywhere (in a
+    comparison, an IN list or an INSERT ... VALUES row).
+    """
+    placeholders = set(_PLACEHOLDER_RE.findall(sql))
+    if not placeholders.issubset(set(params) | {"user_id"}):
+        return False
+    if not set(params).issubset(placeholders):
+        return False
+    if "user_id" not in placeholders:
+        return False
+    return not _hard_codes_user_id(sql)
+
+class SQLTemplateCache:
+    """LRU cache of parameterized SQL templates, persisted to a JSON file"""
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 512):
+        """
+        Initialize the cache and load any persisted templates
+
+        Args:
+            path: JSON file used to persist templates across restarts (memory only when None)
+            max_entries: Maximum number of templates kept before evicting the least recently used
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def make_key(intent: str, prompt: str) -> Tuple[str, Dict[str, Any]]:
+        """Return the cache key for an intent/prompt pair and the extracted slot parameters"""
+        normalized, params = normalize_prompt(prompt)
+        return f"{intent}|{normalized}", params
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached template for key, or None"""
+        with self._lock:
+            template = self._entries.get(key)
+            if template is None:
+                self.misses += 1
+                metrics.increment("sql_cache.miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        metrics.increment("sql_cache.hit")
+        return template
+
+    def put(self, key: str, template: str) -> None:
+        """Store a template, evicting the least recently used entry when full"""
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.increment("sql_cache.evictions")
+            self._save()
+
+    def invalidate(self, key: str) -> None:
+        """Drop a template, e.g. after the SQL guard rejected it"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                metrics.increment("sql_cache.invalidations")
+                self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            for key, template in entries[-self.max_entries:]:
+                self._entries[key] = template
+            cache_logger.info(f"Loaded {len(self._entries)} SQL templates from {self.path}")
+        except (OSError, ValueError) as e:
+            cache_logger.error(f"Could not load SQL template cache from {self.path}: {str(e)}")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            cache_logger.error(f"Could not persist SQL template cache to {self.path}: {str(e)}")
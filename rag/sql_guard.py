@@ -0,0 +1,162 @@
+"""
+Pre-execution guard for generated SQL.
+
+Generated statements are checked in two stages before BudgetPlanner runs
+them. A static check enforces a single statement, a per-intent allow-list
+of statement types and tables, and no DDL. A plan check runs
+EXPLAIN (FORMAT JSON) inside the request's transaction and rejects plans
+whose estimated cost or row count is above the configured limits. A
+rejection carries a reason that is fed back into SQL regeneration.
+"""
+import re
+from typing import Any, Dict, FrozenSet, Optional, Set
+
+from metrics import metrics
+
+# Statement types and tables each intent may touch. users is left out of
+# every intent because it holds password hashes and Plaid tokens.
+READ_TABLES = frozenset({"expenses", "budgets", "goals", "transactions", "spending_rollups"})
+DEFAULT_ALLOW_LIST: Dict[str, Dict[str, FrozenSet[str]]] = {
+    "GET": {"statements": frozenset({"SELECT"}), "write_tables": frozenset(), "read_tables": READ_TABLES},
+    "Readjust budget": {"statements": frozenset({"UPDATE", "INSERT"}), "write_tables": frozenset({"budgets"}),
+                        "read_tables": READ_TABLES},
+    "New Expense": {"statements": frozenset({"INSERT"}), "write_tables": frozenset({"expenses"}),
+                    "read_tables": READ_TABLES},
+    "Create Goals": {"statements": frozenset({"INSERT"}), "write_tables": frozenset({"goals", "budgets"}),
+                     "read_tables": READ_TABLES},
+}
+
+_DML = ("SELECT", "INSERT", "UPDATE", "DELETE", "MERGE")
+# Keywords that never belong inside a single DML statement
+_FORBIDDEN = ("DROP", "ALTER", "TRUNCATE", "CREATE", "GRANT", "REVOKE", "COPY", "VACUUM")
+_LEADING = ("SELECT", "INSERT", "UPDATE", "DELETE", "MERGE", "WITH")
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+# Functions whose arguments use FROM/IN without referring to a table
+_FROM_FUNCTION_RE = re.compile(r"\b(?:EXTRACT|SUBSTRING|TRIM|OVERLAY|POSITION)\s*\([^()]*\)", re.IGNORECASE)
+_KEYWORD_RE = re.compile(r"\b(" + "|".join(_DML + _FORBIDDEN) + r")\b", re.IGNORECASE)
+_CTE_RE = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*(\w+)\s+AS\s*\(", re.IGNORECASE)
+_READ_RE = re.compile(r"\b(?:FROM|JOIN)\s+((?:[\w.\"]+(?:\s+(?:AS\s+)?\w+)?\s*,\s*)*[\w.\"]+)(?![\w.\"(])(?!\s*\()",
+                      re.IGNORECASE)
+# "UPDATE SET" (from ON CONFLICT DO UPDATE SET) names no table
+_WRITE_RE = re.compile(r"\b(?:INSERT\s+INTO|UPDATE)\s+(?!SET\b)([\w.\"]+)", re.IGNORECASE)
+
+class SQLRejected(Exception):
+    """Raised when a generated statement fails the guard"""
+
+    def __init__(self, kind: str, reason: str):
+        super().__init__(reason)
+        self.kind = kind
+        self.reason = reason
+
+def _table_name(token: str) -> str:
+    return token.strip().split()[0].strip('"').split(".")[-1].strip('"').lower()
+
+def _strip(sql: str) -> str:
+    """Remove comments, string literals and FROM-taking function calls"""
+    sql = _COMMENT_RE.sub(" ", sql)
+    sql = _LITERAL_RE.sub("''", sql)
+    previous = None
+    while previous != sql:
+        previous, sql = sql, _FROM_FUNCTION_RE.sub("f()", sql)
+    return sql
+
+class SQLGuard:
+    """Static allow-list and EXPLAIN cost checks for generated SQL"""
+
+    def __init__(self, max_cost: float = 100000.0, max_rows: float = 100000.0,
+                 allow_list: Optional[Dict[str, Dict[str, FrozenSet[str]]]] = None):
+        """
+        Initialize the guard
+
+        Args:
+            max_cost: Highest planner total cost (PostgreSQL cost units) allowed
+            max_rows: Highest estimated row count allowed for the top plan node
+            allow_list: Per-intent statement types, writable tables and readable tables
+        """
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.allow_list = allow_list or DEFAULT_ALLOW_LIST
+
+    def check_statement(self, sql: str, intent: str) -> None:
+        """
+        Enforce a single statement and the intent's allow-list
+
+        Args:
+            sql: Generated statement
+            intent: "GET" or a WhatType value
+
+        Raises:
+            SQLRejected: If the statement is not allowed
+        """
+        rules = self.allow_list.get(intent)
+        if rules is None:
+            self._reject("intent", f"no SQL is allowed for intent {intent!r}")
+        stripped = _strip(sql).strip().rstrip(";").strip()
+        if not stripped:
+            self._reject("empty", "the query is empty")
+        if ";" in stripped:
+            self._reject("multiple_statements", "only a single statement is allowed")
+
+        leading = stripped.lstrip("(").split(None, 1)[0].upper()
+        if leading not in _LEADING:
+            self._reject("statement", f"{leading} statements are not allowed")
+        keywords = {keyword.upper() for keyword in _KEYWORD_RE.findall(stripped)}
+        forbidden = keywords.intersection(_FORBIDDEN)
+        if forbidden:
+            self._reject("statement", f"{', '.join(sorted(forbidden))} statements are not allowed")
+        writes = keywords.intersection(_DML) - {"SELECT"}
+        not_allowed = writes - rules["statements"]
+        if not_allowed or (not writes and "SELECT" not in rules["statements"]):
+            kinds = ", ".join(sorted(not_allowed or {"SELECT"}))
+            self._reject("statement", f"{kinds} is not allowed for {intent} requests "
+                                      f"(allowed: {', '.join(sorted(rules['statements']))})")
+
+        ctes = {name.lower() for name in _CTE_RE.findall(stripped)}
+        written = {_table_name(token) for token in _WRITE_RE.findall(stripped)}
+        read: Set[str] = set()
+        for clause in _READ_RE.findall(stripped):
+            read.update(_table_name(part) for part in clause.split(","))
+        bad_writes = written - ctes - rules["write_tables"]
+        if bad_writes:
+            self._reject("table", f"writing to {', '.join(sorted(bad_writes))} is not allowed for {intent} requests")
+        bad_reads = read - ctes - written - rules["read_tables"]
+        if bad_reads:
+            self._reject("table", f"reading {', '.join(sorted(bad_reads))} is not allowed "
+                                  f"(allowed tables: {', '.join(sorted(rules['read_tables']))})")
+
+    @staticmethod
+    def explain_sql(sql: str) -> str:
+        """Return the EXPLAIN statement for sql (estimates only, the statement is not executed)"""
+        return "EXPLAIN (FORMAT JSON) " + sql.strip().rstrip(";")
+
+    def check_plan(self, plan: Any) -> Dict[str, float]:
+        """
+        Reject plans above the cost or row limits
+
+        Args:
+            plan: The EXPLAIN (FORMAT JSON) result (a list with one {"Plan": ...} object)
+
+        Returns:
+            The estimated total cost and rows
+
+        Raises:
+            SQLRejected: If an estimate exceeds its limit
+        """
+        root = (plan[0] if isinstance(plan, list) else plan)["Plan"]
+        cost, rows = float(root["Total Cost"]), float(root["Plan Rows"])
+        metrics.observe("sql_guard.plan.cost", cost, buckets=(10, 100, 1000, 10000, 100000, 1000000, 10000000))
+        if cost > self.max_cost:
+            self._reject("cost", f"the estimated cost {cost:.0f} exceeds the limit of {self.max_cost:.0f}; "
+                                 f"filter by user_id and date or aggregate instead of joining whole tables")
+        if rows > self.max_rows:
+            self._reject("rows", f"the query would return about {rows:.0f} rows (limit {self.max_rows:.0f}); "
+                                 f"aggregate or filter the result")
+        return {"cost": cost, "rows": rows}
+
+    @staticmethod
+    def _reject(kind: str, reason: str) -> None:
+        metrics.increment("sql_guard.rejected")
+        metrics.increment(f"sql_guard.rejected.{kind}")
+        raise SQLRejected(kind, reason)
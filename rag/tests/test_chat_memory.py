@@ -0,0 +1,131 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import asyncio
+from chat_memory import ConversationMemory, InMemorySessionStore
+from fake_llm import FakeChatModel
+
+
+class YieldingSessionStore(InMemorySessionStore):
+    """In-memory store that yields to the event loop before every operation, like a network store."""
+
+    async def load(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        return await super().load(*args, **kwargs)
+
+    async def messages(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        return await super().messages(*args, **kwargs)
+
+    async def append(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        return await super().append(*args, **kwargs)
+
+    async def update_context(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        return await super().update_context(*args, **kwargs)
+
+
+class TestConversationMemory:
+    """Test turn recording and summarization."""
+
+    def test_concurrent_turns_are_all_counted(self):
+        """Concurrent turns in one session each add their messages to message_count."""
+        store = YieldingSessionStore()
+        memory = ConversationMemory(store, FakeChatModel(rules=[], default_response="summary"),
+                                    recent_messages=2, summarize_batch=2)
+
+        async def run():
+            await asyncio.gather(*(memory.record_turn(1, "s", f"question {i}", f"answer {i}") for i in range(5)))
+            return await store.load(1, "s", 100)
+
+        document = asyncio.run(run())
+        assert len(document["messages"]) == 10
+        assert document["context"]["message_count"] == 10
+        # Every aged-out message is summarized exactly once
+        assert document["context"]["summarized_count"] <= 10 - 2
+
+    def test_summary_folds_aged_out_messages(self):
+        """Messages beyond recent_messages are folded into the summary and not loaded verbatim."""
+        store = InMemorySessionStore()
+        memory = ConversationMemory(store, FakeChatModel(rules=[], default_response="user asked about food"),
+                                    recent_messages=2, summarize_batch=2)
+
+        async def run():
+            for i in range(3):
+                await memory.record_turn(1, "s", f"question {i}", f"answer {i}")
+            return await memory.load(1, "s")
+
+        context = asyncio.run(run())
+        assert context.summary == "user asked about food"
+        assert [m["content"] for m in context.messages] == ["question 2", "answer 2"]
+
+    def test_stale_summary_update_is_discarded(self):
+        """A summary based on an outdated summarized_count is not written."""
+        store = InMemorySessionStore()
+
+        async def run():
+            await store.append(1, "s", [{"role": "user", "content": "hi"}], {})
+            assert await store.update_context(1, "s", {"summary": "a", "summarized_count": 1}, 0)
+            return await store.update_context(1, "s", {"summary": "b", "summarized_count": 1}, 0)
+
+        assert asyncio.run(run()) is False
+
+
+class TestInMemorySessionStore:
+    """Test the bounds of the process-local store."""
+
+    def turn(self, i):
+        return [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]
+
+    def test_least_recently_used_session_evicted(self):
+        store = InMemorySessionStore(max_sessions=2)
+
+        async def run():
+            await store.append(1, "a", self.turn(0), {})
+            await store.append(1, "b", self.turn(0), {})
+            await store.load(1, "a", 2)
+            await store.append(1, "c", self.turn(0), {})
+            return [await store.load(1, session, 2) is not None for session in ("a", "b", "c")]
+
+        assert asyncio.run(run()) == [True, False, True]
+
+    def test_idle_session_expires(self):
+        store = InMemorySessionStore(idle_seconds=0.01)
+
+        async def run():
+            await store.append(1, "a", self.turn(0), {})
+            await asyncio.sleep(0.02)
+            return await store.load(1, "a", 2)
+
+        assert asyncio.run(run()) is None
+
+    def test_messages_capped_and_indices_kept(self):
+        """Old messages are dropped, and messages() still addresses the rest by their original index."""
+        store = InMemorySessionStore(max_messages=4)
+
+        async def run():
+            for i in range(5):
+                context = await store.append(1, "a", self.turn(i), {})
+            return context, await store.messages(1, "a", 6, 2), await store.messages(1, "a", 0, 4)
+
+        context, recent, dropped = asyncio.run(run())
+        assert context["message_count"] == 10
+        assert [m["content"] for m in recent] == ["q3", "a3"]
+        assert dropped == []
+
+    def test_memory_keeps_working_past_the_cap(self):
+        """Summaries still fold aged-out messages when the store keeps only a few."""
+        store = InMemorySessionStore(max_messages=6)
+        memory = ConversationMemory(store, FakeChatModel(rules=[], default_response="summary"),
+                                    recent_messages=2, summarize_batch=2)
+
+        async def run():
+            for i in range(10):
+                await memory.record_turn(1, "s", f"question {i}", f"answer {i}")
+            return await memory.load(1, "s")
+
+        context = asyncio.run(run())
+        assert context.summary == "summary"
+        assert [m["content"] for m in context.messages][-2:] == ["question 9", "answer 9"]
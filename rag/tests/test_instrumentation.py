@@ -0,0 +1,22 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from langchain_core.messages import AIMessageChunk
+from instrumentation import message_text
+
+
+class TestMessageText:
+    """Test text extraction from streamed model chunks."""
+
+    def test_plain_string(self):
+        assert message_text(AIMessageChunk(content="Spent $42")) == "Spent $42"
+
+    def test_content_blocks(self):
+        """Anthropic chunks can carry a list of blocks; only the text blocks are kept."""
+        chunk = AIMessageChunk(content=[{"type": "text", "text": "Spent ", "index": 0},
+                                        {"type": "tool_use", "id": "t1", "name": "lookup", "input": {}},
+                                        {"type": "text", "text": "$42", "index": 0}])
+        assert message_text(chunk) == "Spent $42"
+
+    def test_empty(self):
+        assert message_text(AIMessageChunk(content=[])) == ""
@@ -0,0 +1,71 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from intent_classifier import IntentClassifier, evaluate
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "intent_model.json")
+
+
+class TestWriteRules:
+    """Write rules only match imperative requests."""
+
+    @pytest.mark.parametrize("prompt, label", [
+        ("increase my savings budget to 25%", "readjust_budget"),
+        ("please set entertainment budget to 50 dollars", "readjust_budget"),
+        ("create a goal to save $800 for a bike", "create_goals"),
+        ("save $500 for a vacation", "create_goals"),
+        ("add $18 pizza at Dominos", "new_expense"),
+    ])
+    def test_imperatives(self, prompt, label):
+        assert IntentClassifier().predict_rule(prompt).label == label
+
+    @pytest.mark.parametrize("prompt", [
+        "did my spending increase over my budget last month?",
+        "what happens if I lower my food budget",
+        "how do I set a budget",
+        "should I change my budget?",
+        "how do I set a savings goal?",
+        "set my food budget to 400?",
+    ])
+    def test_questions_do_not_match(self, prompt):
+        prediction = IntentClassifier().predict_rule(prompt)
+        assert prediction is None or prediction.label not in ("readjust_budget", "create_goals")
+
+
+class TestClassify:
+    """The fast path only routes read intents."""
+
+    def test_write_rule_deferred(self):
+        """A write rule hit still goes through the LLM router."""
+        classifier = IntentClassifier()
+        assert classifier.predict("set entertainment budget to 50 dollars").source == "rule"
+        assert classifier.classify("set entertainment budget to 50 dollars") is None
+        assert classifier.classify("add $18 pizza at Dominos") is None
+
+    def test_read_rule_routed(self):
+        prediction = IntentClassifier().classify("how much did I spend on coffee this week")
+        assert (prediction.label, prediction.source) == ("get_data", "rule")
+
+    def test_write_model_prediction_deferred(self):
+        classifier = IntentClassifier.load(MODEL, threshold=0.0)
+        assert classifier.predict_model("I want to save up for a new tv $900").label == "create_goals"
+        assert classifier.classify("I want to save up for a new tv $900") is None
+
+
+class TestEvaluate:
+    """Rules and model are scored separately."""
+
+    def test_sources_reported_separately(self):
+        examples = [("how much did I spend on coffee", "get_data"), ("what does investing mean", "get_no_data"),
+                    ("set entertainment budget to 50 dollars", "readjust_budget")]
+        report = evaluate(IntentClassifier.load(MODEL), examples)
+        assert report["rules"]["hits"] == 2
+        # The model is scored on every example, including those a rule already answers
+        assert report["model"]["overall_accuracy"] == pytest.approx(1.0)
+        # The budget change is a write, so it is a hit of the rules but is not routed locally
+        assert report["routed"]["hits"] == report["combined"]["hits"] - 1
+
+    def test_rules_only(self):
+        report = evaluate(IntentClassifier(), [("hey", "get_no_data")])
+        assert report["model"] is None and report["rules"]["hits"] == 0
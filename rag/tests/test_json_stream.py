@@ -0,0 +1,109 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import pytest
+from json_stream import IncrementalJSONParser, NotJSONError
+
+RECEIPT = {
+    "merchant_name": "Café \"Le {Coin}\"",
+    "date": "2026-10-17",
+    "items": [{"name": "Soup [large]", "price": 6.5, "tags": ["hot", "veg"]}, {"name": "Bread", "price": 2}],
+    "total": 8.5,
+    "category": "food",
+}
+
+
+def feed_all(chunks, parser=None):
+    parser = parser or IncrementalJSONParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class TestChunkBoundaries:
+    """Events do not depend on where the stream is cut."""
+
+    def test_any_chunk_size(self):
+        text = json.dumps(RECEIPT, ensure_ascii=False)
+        _, expected = feed_all([text])
+        assert [e.get("name") or e["field"] for e in expected] == ["merchant_name", "date", "items", "items",
+                                                                    "total", "category"]
+        for size in (1, 2, 3, 7, 16):
+            parser, events = feed_all(split(text, size))
+            assert events == expected, size
+            assert parser.done
+
+    def test_escape_split_across_chunks(self):
+        """A backslash at the end of a chunk still escapes the quote that starts the next one."""
+        _, events = feed_all(['{"merchant_name": "A\\', '"B", "total": 1}'])
+        assert events == [{"event": "field", "name": "merchant_name", "value": 'A"B'},
+                          {"event": "field", "name": "total", "value": 1}]
+
+    def test_field_reported_once_complete(self):
+        parser = IncrementalJSONParser()
+        assert parser.feed('{"total": 12.') == []
+        assert parser.feed('5, "cat') == [{"event": "field", "name": "total", "value": 12.5}]
+        assert parser.feed('egory": "food"}') == [{"event": "field", "name": "category", "value": "food"}]
+
+    def test_preamble_and_trailing_text(self):
+        _, events = feed_all(["Here is the receipt:\n```json\n{\"to", "tal\": 3}\n```\nDone."])
+        assert events == [{"event": "field", "name": "total", "value": 3}]
+
+
+class TestArrays:
+    """Top-level arrays are reported element by element."""
+
+    def test_items_indexed(self):
+        _, events = feed_all([json.dumps({"items": [{"name": "a"}, {"name": "b"}]})])
+        assert events == [{"event": "item", "field": "items", "index": 0, "value": {"name": "a"}},
+                          {"event": "item", "field": "items", "index": 1, "value": {"name": "b"}}]
+
+    def test_nested_arrays(self):
+        """Only the top-level array is split; nested arrays stay whole inside their element."""
+        _, events = feed_all(split('{"items": [[1, [2, 3]], [], [4]], "total": 0}', 3))
+        assert [e["value"] for e in events if e["event"] == "item"] == [[1, [2, 3]], [], [4]]
+        assert events[-1] == {"event": "field", "name": "total", "value": 0}
+
+    def test_empty_array(self):
+        _, events = feed_all(['{"items": [], "total": 0}'])
+        assert events == [{"event": "field", "name": "total", "value": 0}]
+
+    def test_index_restarts_per_array(self):
+        _, events = feed_all(['{"a": [1, 2], "b": [3]}'])
+        assert [(e["field"], e["index"]) for e in events] == [("a", 0), ("a", 1), ("b", 0)]
+
+
+class TestNotJSON:
+    """Malformed or missing objects raise NotJSONError."""
+
+    def test_no_object_in_preamble(self):
+        parser = IncrementalJSONParser(max_preamble=20)
+        with pytest.raises(NotJSONError):
+            parser.feed("I cannot read this receipt, the image is too blurry.")
+
+    def test_late_brace_in_a_later_chunk(self):
+        parser = IncrementalJSONParser(max_preamble=10)
+        parser.feed("Sorry, ")
+        with pytest.raises(NotJSONError):
+            parser.feed("no receipt here {")
+
+    @pytest.mark.parametrize("text", [
+        '{"total" 5}',
+        '{total: 5}',
+        '{"total": }',
+        '{"items": [1, 2}',
+        '{"total": 5x, "date": "2026-10-17"}',
+    ])
+    def test_malformed(self, text):
+        with pytest.raises(NotJSONError):
+            feed_all(split(text, 2))
+
+    def test_is_value_error(self):
+        """Callers that catch ValueError from json.loads also catch NotJSONError."""
+        assert issubclass(NotJSONError, ValueError)
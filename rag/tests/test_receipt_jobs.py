@@ -0,0 +1,41 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import io
+import pytest
+import receipt_jobs
+from receipt_jobs import ReceiptJobQueue
+
+
+async def handler(image_data, content_type, job_id):
+    return {}
+
+
+class TestSubmit:
+    """Test queueing receipt images."""
+
+    def test_file_copied_in_chunks(self, tmp_path, monkeypatch):
+        """A file image is stored in chunks and claimed back unchanged."""
+        monkeypatch.setattr(receipt_jobs, "BLOB_CHUNK_SIZE", 1000)
+        queue = ReceiptJobQueue(str(tmp_path / "jobs.sqlite3"), handler)
+        image = bytes(range(256)) * 20
+        job_id = queue.submit(io.BytesIO(image), "image/png", len(image))
+        claimed = queue._claim()
+        queue.close()
+        assert claimed[:3] == (job_id, "image/png", image)
+
+    def test_bytes(self, tmp_path):
+        queue = ReceiptJobQueue(str(tmp_path / "jobs.sqlite3"), handler)
+        job_id = queue.submit(b"\xff\xd8\xffdata", "image/jpeg")
+        claimed = queue._claim()
+        queue.close()
+        assert claimed[:3] == (job_id, "image/jpeg", b"\xff\xd8\xffdata")
+
+    def test_short_file_not_queued(self, tmp_path):
+        """A file shorter than its declared size leaves no job behind."""
+        queue = ReceiptJobQueue(str(tmp_path / "jobs.sqlite3"), handler)
+        with pytest.raises(ValueError):
+            queue.submit(io.BytesIO(b"abc"), "image/png", 10)
+        assert queue.stats() == {} or sum(queue.stats().values()) == 0
+        assert queue._claim() is None
+        queue.close()
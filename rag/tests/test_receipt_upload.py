@@ -0,0 +1,76 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi import FastAPI, File, UploadFile
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.testclient import TestClient
+from receipt_upload import UploadLimitMiddleware, sniff_image_type
+
+LIMIT = 64 * 1024
+
+
+def build_client():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    # Same order as api.py: CORS is added last, so it wraps the upload limit
+    app.add_middleware(UploadLimitMiddleware, limit_for=lambda path: LIMIT if path == "/upload" else None)
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+    return TestClient(app)
+
+
+def multipart(size):
+    """A multipart body with one file of size bytes, generated in chunks (sent without Content-Length)."""
+    yield (b'--b\r\nContent-Disposition: form-data; name="file"; filename="r.jpg"\r\n'
+           b'Content-Type: image/jpeg\r\n\r\n')
+    for offset in range(0, size, 8192):
+        yield b"\0" * min(8192, size - offset)
+    yield b"\r\n--b--\r\n"
+
+
+class TestUploadLimitMiddleware:
+    """Test the request body cap."""
+
+    def test_small_upload_passes(self):
+        """Bodies under the limit reach the endpoint."""
+        response = build_client().post("/upload", files={"file": ("r.jpg", b"\0" * 1000, "image/jpeg")})
+        assert response.status_code == 200 and response.json() == {"size": 1000}
+
+    def test_content_length_over_limit(self):
+        """A declared length over the limit is refused before the body is read."""
+        response = build_client().post("/upload", files={"file": ("r.jpg", b"\0" * (LIMIT * 2), "image/jpeg")})
+        assert response.status_code == 413
+
+    def test_chunked_upload_over_limit(self):
+        """A chunked body without Content-Length is cut off once it passes the limit."""
+        response = build_client().post("/upload", content=multipart(LIMIT * 4),
+                                       headers={"content-type": "multipart/form-data; boundary=b"})
+        assert response.status_code == 413
+        assert "larger than" in response.json()["detail"]
+
+    def test_rejection_carries_cors_headers(self):
+        """Browsers can read the 413 because CORS wraps the upload limit."""
+        response = build_client().post("/upload", content=multipart(LIMIT * 4),
+                                       headers={"content-type": "multipart/form-data; boundary=b",
+                                                "origin": "https://app.example"})
+        assert response.status_code == 413
+        assert response.headers["access-control-allow-origin"] == "*"
+
+    def test_chunked_upload_under_limit(self):
+        """A chunked body under the limit is processed normally."""
+        response = build_client().post("/upload", content=multipart(LIMIT // 2),
+                                       headers={"content-type": "multipart/form-data; boundary=b"})
+        assert response.status_code == 200 and response.json() == {"size": LIMIT // 2}
+
+
+class TestSniffImageType:
+    """Test image type detection from magic bytes."""
+
+    def test_formats(self):
+        assert sniff_image_type(b"\xff\xd8\xff\xe0" + b"\0" * 8) == "image/jpeg"
+        assert sniff_image_type(b"\x89PNG\r\n\x1a\n\0\0\0\0") == "image/png"
+        assert sniff_image_type(b"RIFF\0\0\0\0WEBP") == "image/webp"
+        assert sniff_image_type(b"%PDF-1.7\n\0\0\0") is None
@@ -0,0 +1,101 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from datetime import date
+from receipt_validation import ReceiptValidator, parse_amount
+
+CATEGORIES = ["food", "transportation", "shopping", "other"]
+TODAY = date(2025, 6, 1)
+
+
+def receipt(**fields):
+    data = {
+        "merchant_name": "Corner Cafe",
+        "date": "2025-05-30",
+        "items": [{"name": "Latte", "price": 4.5, "quantity": 2}, {"name": "Bagel", "price": 3.25}],
+        "total": 12.25,
+        "category": "food",
+        "description": "Breakfast at Corner Cafe",
+    }
+    data.update(fields)
+    return data
+
+
+class TestParseAmount:
+    """Test reading amounts from model output."""
+
+    @pytest.mark.parametrize("value, expected", [
+        (12, 12.0),
+        (4.5, 4.5),
+        ("$1,234.50", 1234.5),
+        ("12,500", 12500.0),
+        ("-3.00", -3.0),
+        ("$-3", -3.0),
+        ("4,50", 4.5),
+        ("12,50", 12.5),
+        ("1.234,50 €", 1234.5),
+    ])
+    def test_amounts(self, value, expected):
+        """Point and comma decimal conventions are both read correctly."""
+        assert parse_amount(value) == expected
+
+    @pytest.mark.parametrize("value", ["abc", "1,2,3", "1.234.5", "", None, True, [4.5]])
+    def test_not_amounts(self, value):
+        """Values that are not amounts give None."""
+        assert parse_amount(value) is None
+
+
+class TestReceiptValidator:
+    """Test the local checks of extracted receipts."""
+
+    def setup_method(self):
+        self.validator = ReceiptValidator(CATEGORIES)
+
+    def test_valid_receipt_is_normalized(self):
+        """A consistent receipt passes and gets a default quantity."""
+        data = receipt()
+        assert self.validator.check(data, TODAY) == []
+        assert data["items"][1]["quantity"] == 1
+
+    def test_comma_decimal_amounts(self):
+        """Decimal-comma prices and totals are converted, not multiplied by 100."""
+        data = receipt(items=[{"name": "Brezel", "price": "1,60"}, {"name": "Kaffee", "price": "2,50"}],
+                       total="4,10")
+        assert self.validator.check(data, TODAY) == []
+        assert data["total"] == 4.1
+        assert [item["price"] for item in data["items"]] == [1.6, 2.5]
+
+    def test_tax_within_tolerance(self):
+        """A total above the item sum by less than the tax tolerance passes."""
+        assert self.validator.check(receipt(total=13.50), TODAY) == []
+
+    def test_items_do_not_add_up(self):
+        """A total far from the item sum is reported."""
+        problems = self.validator.check(receipt(total=40.0), TODAY)
+        assert len(problems) == 1 and "does not match total 40.00" in problems[0]
+
+    def test_line_totals_accepted(self):
+        """Prices given as line totals (sum of price) also pass."""
+        data = receipt(items=[{"name": "Latte", "price": 9.0, "quantity": 2}, {"name": "Bagel", "price": 3.25}])
+        assert self.validator.check(data, TODAY) == []
+
+    @pytest.mark.parametrize("value", ["30/05/2025", "2025-02-30", "2025-06-05", "1990-01-01"])
+    def test_bad_dates(self, value):
+        """Dates in another format, impossible or implausible dates are reported."""
+        problems = self.validator.check(receipt(date=value), TODAY)
+        assert len(problems) == 1 and "date" in problems[0]
+
+    def test_category(self):
+        """Category case is fixed and unknown categories are reported."""
+        data = receipt(category="Food")
+        assert self.validator.check(data, TODAY) == []
+        assert data["category"] == "food"
+        assert "category" in self.validator.check(receipt(category="groceries"), TODAY)[0]
+
+    def test_missing_fields(self):
+        """Missing required fields are listed."""
+        data = receipt()
+        del data["total"], data["merchant_name"]
+        problems = self.validator.check(data, TODAY)
+        assert "missing field 'merchant_name'" in problems and "missing field 'total'" in problems
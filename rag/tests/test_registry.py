@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import sqlite3
+import pytest
+from receipt_cache import ReceiptCache
+from registry import ServiceRegistry
+from fake_llm import FakeChatModel
+
+
+class TestReceiptCache:
+    """Test the registry's ownership of the receipt cache."""
+
+    def test_opened_on_first_use_and_closed(self, tmp_path):
+        """The cache file is created only when a processor needs it, and closed on shutdown."""
+        path = tmp_path / "cache" / "receipts.sqlite3"
+        registry = ServiceRegistry(api_key="test", postgres_connection="postgresql://unused", llm=FakeChatModel(),
+                                   receipt_cache_factory=lambda: ReceiptCache(str(path)))
+        assert registry.receipt_cache is None
+        assert not path.exists()
+
+        processor = registry.get_receipt_processor()
+        assert processor.cache is registry.receipt_cache
+        assert path.exists()
+
+        cache = registry.receipt_cache
+        registry.close()
+        assert registry.receipt_cache is None
+        with pytest.raises(sqlite3.ProgrammingError):
+            cache.stats()
+
+    def test_disabled(self):
+        """A factory returning None leaves the processor without a cache."""
+        registry = ServiceRegistry(api_key="test", postgres_connection="postgresql://unused", llm=FakeChatModel(),
+                                   receipt_cache_factory=lambda: None)
+        assert registry.get_receipt_processor().cache is None
+        registry.close()
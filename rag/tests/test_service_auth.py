@@ -0,0 +1,41 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from service_auth import AuthRejected, UserResolver
+
+
+def rejection(resolver, authorization, user_header):
+    with pytest.raises(AuthRejected) as excinfo:
+        resolver.resolve(authorization, user_header)
+    return excinfo.value.status_code
+
+
+class TestServiceToken:
+    """With a service token, only the backend can name the user."""
+
+    def test_trusted_user_header(self):
+        assert UserResolver("s3cret").resolve("Bearer s3cret", "42") == 42
+
+    def test_missing_or_wrong_token(self):
+        resolver = UserResolver("s3cret")
+        assert rejection(resolver, None, "42") == 401
+        assert rejection(resolver, "Bearer guess", "42") == 401
+        assert rejection(resolver, "Basic s3cret", "42") == 401
+
+    def test_missing_or_invalid_user(self):
+        resolver = UserResolver("s3cret")
+        assert rejection(resolver, "Bearer s3cret", None) == 400
+        assert rejection(resolver, "Bearer s3cret", "1 OR 1=1") == 400
+        assert rejection(resolver, "Bearer s3cret", "0") == 400
+
+
+class TestWithoutToken:
+    """Without a token, only the configured single user is served."""
+
+    def test_single_user_ignores_header(self):
+        assert UserResolver(single_user_id=7).resolve(None, "42") == 7
+
+    def test_unconfigured_is_refused(self):
+        """No silent fallback to user 1."""
+        assert rejection(UserResolver(), None, "1") == 503
@@ -0,0 +1,54 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import date
+from spending_rollups import SOURCES, SPENDING_SOURCE, SpendingRollups, match_question, question_period
+
+TODAY = date(2026, 10, 18)
+
+
+class TestSources:
+    """Test which tables are rolled up."""
+
+    def test_only_expenses(self):
+        """transactions duplicates expense rows, so only expenses is a rollup source."""
+        assert list(SOURCES) == ["expenses"]
+        assert SpendingRollups(db_pool=None).sources == ["expenses"]
+
+    def test_transactions_rejected(self):
+        try:
+            SpendingRollups(db_pool=None, sources=["expenses", "transactions"])
+        except ValueError as e:
+            assert "transactions" in str(e)
+        else:
+            raise AssertionError("transactions should not be accepted as a rollup source")
+
+    def test_query_filters_source(self):
+        """The rollup query only reads the spending source."""
+        sql, params = match_question("How much did I spend on food this month?", TODAY)
+        assert "source = %(rollup_source)s" in sql
+        assert params["rollup_source"] == SPENDING_SOURCE == "expenses"
+
+
+class TestQuestionPeriod:
+    """Test period detection for month names."""
+
+    def test_in_month(self):
+        assert question_period("What did I spend in May?", TODAY) == ("month", date(2026, 5, 1), date(2026, 6, 1))
+
+    def test_month_and_year(self):
+        assert question_period("spending May 2024", TODAY) == ("month", date(2024, 5, 1), date(2024, 6, 1))
+        assert question_period("spent during march, 2025", TODAY) == ("month", date(2025, 3, 1), date(2025, 4, 1))
+
+    def test_future_month_is_last_year(self):
+        assert question_period("spent in December", TODAY) == ("month", date(2025, 12, 1), date(2026, 1, 1))
+
+    def test_modal_may_is_not_a_month(self):
+        """The verb "may" without a date context is not a period."""
+        assert question_period("How much may I spend on food?", TODAY) is None
+        assert match_question("May I see how much I spent on food?", TODAY) is None
+
+    def test_modal_may_with_other_period(self):
+        """A real period elsewhere in the question still wins over the verb."""
+        sql, params = match_question("May I know how much I spent in March?", TODAY)
+        assert params["rollup_start"] == date(2026, 3, 1)
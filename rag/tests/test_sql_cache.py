@@ -0,0 +1,75 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from sql_cache import SQLTemplateCache, is_cacheable, normalize_prompt
+
+
+class TestNormalizePrompt:
+    """Test slot extraction from prompts."""
+
+    def test_dates_amounts_and_categories_become_slots(self):
+        """Valid dates, amounts and categories are replaced by numbered slots."""
+        text, params = normalize_prompt("How much on food since 03/01/2024, over $1,200.50?")
+        assert text == "how much on <category_0> since <date_0> over <amount_0>"
+        assert params == {"category_0": "food", "date_0": "2024-03-01", "amount_0": 1200.5}
+
+    @pytest.mark.parametrize("prompt", [
+        "how much did I spend on 2024-02-30",
+        "expenses from 13/45/2024",
+        "what about 2023-00-10",
+    ])
+    def test_impossible_dates_stay_in_the_text(self, prompt):
+        """Impossible dates do not raise and are not turned into slots."""
+        text, params = normalize_prompt(prompt)
+        assert "date_0" not in params
+        assert "<date_0>" not in text
+
+    def test_make_key_with_impossible_date(self):
+        """make_key works for every prompt, so SQL generation never fails on it."""
+        key, params = SQLTemplateCache.make_key("GET", "spent on 2024-02-30 on food")
+        assert key.startswith("GET|")
+        assert params == {"category_0": "food"}
+
+
+class TestIsCacheable:
+    """Test which generated SQL may be reused for other users."""
+
+    def test_user_scoped_template(self):
+        """A template filtered on %(user_id)s with every slot as a placeholder is cacheable."""
+        sql = "SELECT SUM(amount) FROM expenses WHERE user_id = %(user_id)s AND category = %(category_0)s"
+        assert is_cacheable(sql, {"category_0": "food"})
+
+    def test_insert_with_user_id_placeholder(self):
+        """An INSERT whose user_id value is the placeholder is cacheable."""
+        sql = ("INSERT INTO expenses (user_id, amount, category, date) "
+               "VALUES (%(user_id)s, %(amount_0)s, 'food', NOW())")
+        assert is_cacheable(sql, {"amount_0": 12.5})
+
+    def test_no_user_filter(self):
+        """SQL without the user id placeholder would return every user's rows."""
+        sql = "SELECT SUM(amount) FROM expenses WHERE category = %(category_0)s"
+        assert not is_cacheable(sql, {"category_0": "food"})
+
+    @pytest.mark.parametrize("sql", [
+        "INSERT INTO expenses (user_id, amount, category) VALUES (1, %(amount_0)s, 'food')",
+        "INSERT INTO expenses (amount, user_id) VALUES (%(amount_0)s, %(user_id)s), (%(amount_0)s, 2)",
+        "SELECT * FROM expenses WHERE user_id = 7 OR user_id = %(user_id)s",
+        "SELECT * FROM expenses e WHERE 7 = e.user_id OR e.user_id = %(user_id)s",
+        "SELECT * FROM expenses WHERE user_id IN (1, 2) AND user_id = %(user_id)s",
+        "SELECT * FROM expenses WHERE user_id = '3' AND user_id = %(user_id)s",
+    ])
+    def test_hard_coded_user_id(self, sql):
+        """A literal user id anywhere makes the template unsafe to share."""
+        params = {"amount_0": 1.0} if "amount_0" in sql else {}
+        assert not is_cacheable(sql, params)
+
+    def test_slot_left_as_literal(self):
+        """A slot value written as a literal would be replayed for other prompts."""
+        sql = "SELECT SUM(amount) FROM expenses WHERE user_id = %(user_id)s AND category = 'food'"
+        assert not is_cacheable(sql, {"category_0": "food"})
+
+    def test_unknown_placeholder(self):
+        """A placeholder that is not a slot of the prompt cannot be bound."""
+        sql = "SELECT * FROM expenses WHERE user_id = %(user_id)s AND amount > %(amount_3)s"
+        assert not is_cacheable(sql, {})
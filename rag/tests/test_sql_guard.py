@@ -0,0 +1,110 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from sql_guard import SQLGuard, SQLRejected
+
+
+def rejection(sql, intent="GET"):
+    with pytest.raises(SQLRejected) as excinfo:
+        SQLGuard().check_statement(sql, intent)
+    return excinfo.value.kind
+
+
+class TestAllowed:
+    """Statements the budget planner generates pass the static check."""
+
+    @pytest.mark.parametrize("sql", [
+        "SELECT category, SUM(amount) FROM expenses WHERE user_id = %(user_id)s GROUP BY category;",
+        "SELECT e.amount FROM expenses e JOIN budgets b ON b.expense_category = e.category",
+        "WITH monthly AS (SELECT amount FROM expenses) SELECT SUM(amount) FROM monthly",
+        "SELECT EXTRACT(MONTH FROM date) AS m, SUM(amount) FROM expenses GROUP BY m",
+        "SELECT description FROM expenses WHERE description = 'drop table users; from users'",
+        "SELECT SUM(total) FROM spending_rollups WHERE user_id = %(user_id)s",
+    ])
+    def test_get(self, sql):
+        SQLGuard().check_statement(sql, "GET")
+
+    def test_new_expense_insert(self):
+        SQLGuard().check_statement("INSERT INTO expenses (user_id, amount, category) "
+                                   "VALUES (%(user_id)s, 12.5, 'food') RETURNING id", "New Expense")
+
+    def test_budget_upsert(self):
+        SQLGuard().check_statement("INSERT INTO budgets (expense_category, amount) VALUES ('food', 300) "
+                                   "ON CONFLICT (expense_category) DO UPDATE SET amount = EXCLUDED.amount",
+                                   "Readjust budget")
+
+
+class TestTableRejections:
+    """Tables outside the intent's allow-list are refused."""
+
+    def test_users_table(self):
+        assert rejection("SELECT hashed_password FROM users") == "table"
+
+    def test_users_in_join(self):
+        assert rejection("SELECT e.amount, u.email FROM expenses e JOIN users u ON u.id = e.user_id") == "table"
+
+    def test_users_in_comma_list(self):
+        assert rejection("SELECT * FROM expenses e, users u") == "table"
+
+    def test_users_in_subquery(self):
+        assert rejection("SELECT amount FROM expenses WHERE user_id IN (SELECT id FROM users)") == "table"
+
+    def test_schema_qualified(self):
+        assert rejection('SELECT * FROM public."users"') == "table"
+
+    def test_write_to_other_table(self):
+        assert rejection("INSERT INTO goals (name) VALUES ('x')", "New Expense") == "table"
+
+    def test_write_on_get(self):
+        assert rejection("UPDATE expenses SET amount = 0") == "statement"
+
+    def test_delete_not_allowed_for_writes(self):
+        assert rejection("DELETE FROM expenses WHERE user_id = %(user_id)s", "New Expense") == "statement"
+
+
+class TestStatementRejections:
+    """DDL, stacked statements and unknown intents are refused."""
+
+    @pytest.mark.parametrize("sql", [
+        "DROP TABLE expenses",
+        "TRUNCATE expenses",
+        "ALTER TABLE expenses ADD COLUMN x int",
+        "CREATE TABLE t (id int)",
+        "GRANT ALL ON expenses TO public",
+        "COPY expenses TO '/tmp/x'",
+        "WITH x AS (SELECT 1) CREATE TABLE y AS SELECT * FROM x",
+    ])
+    def test_ddl(self, sql):
+        assert rejection(sql) == "statement"
+
+    def test_stacked_statements(self):
+        assert rejection("SELECT 1 FROM expenses; DROP TABLE expenses") == "multiple_statements"
+
+    def test_comment_hides_nothing(self):
+        """Comments are stripped before the check, so they cannot hide a second statement or a table."""
+        assert rejection("SELECT 1 FROM expenses /* ok */; DELETE FROM expenses -- done") == "multiple_statements"
+
+    def test_empty(self):
+        assert rejection("  ;  -- nothing") == "empty"
+
+    def test_unknown_intent(self):
+        assert rejection("SELECT 1 FROM expenses", "Delete everything") == "intent"
+
+
+class TestPlanCheck:
+    """EXPLAIN estimates above the limits are refused."""
+
+    def test_within_limits(self):
+        plan = [{"Plan": {"Total Cost": 42.5, "Plan Rows": 12}}]
+        assert SQLGuard().check_plan(plan) == {"cost": 42.5, "rows": 12.0}
+
+    def test_cost(self):
+        with pytest.raises(SQLRejected) as excinfo:
+            SQLGuard(max_cost=1000).check_plan([{"Plan": {"Total Cost": 5000, "Plan Rows": 1}}])
+        assert excinfo.value.kind == "cost"
+
+    def test_rows(self):
+        with pytest.raises(SQLRejected) as excinfo:
+            SQLGuard(max_rows=100).check_plan({"Plan": {"Total Cost": 1, "Plan Rows": 500}})
+        assert excinfo.value.kind == "rows"
@@ -0,0 +1,101 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from datetime import date
+from receipt_validation import ReceiptValidator
+from text_receipts import TextReceiptParser, html_to_text, parse_money
+
+TODAY = date(2026, 10, 18)
+
+CAFE = """CORNER CAFE
+123 Main St, Springfield
+03/14/2026  08:42 AM
+
+2 x Latte @ 4.50          9.00
+Blueberry Muffin          3.25
+Bagel w/ Cream Cheese     3.75
+
+Subtotal                 16.00
+Tax                       1.28
+TOTAL                   $17.28
+VISA ****1234           $17.28
+"""
+
+
+def parse(text, validator=None):
+    return TextReceiptParser(validator=validator).parse(text, today=TODAY)
+
+
+class TestReconciliation:
+    """Items that add up to the total raise the confidence the most."""
+
+    def test_subtotal_matches_items(self):
+        parsed = parse(CAFE)
+        assert parsed.data["total"] == 17.28
+        assert [(i["name"], i["price"], i["quantity"]) for i in parsed.data["items"]] == [
+            ("Latte", 4.5, 2), ("Blueberry Muffin", 3.25, 1), ("Bagel w/ Cream Cheese", 3.75, 1)]
+        assert parsed.data["date"] == "2026-03-14"
+        assert parsed.confidence == 1.0
+
+    def test_charges_and_discounts_without_subtotal(self):
+        """Listed tax, tips and discounts are allowed for when there is no subtotal line."""
+        parsed = parse("Fresh Valley Market\nDate: 2026-10-02\n\nBananas     1.50\nMilk        4.50\n"
+                       "Coupon Milk  -1.00\nTax         0.40\nTip         1.00\nTOTAL       6.40\n")
+        assert len(parsed.data["items"]) == 2
+        assert parsed.confidence == 1.0
+
+    def test_items_not_adding_up(self):
+        """An item sum that misses the total only counts as items found."""
+        parsed = parse(CAFE.replace("Subtotal                 16.00\n", "").replace("$17.28\nVISA", "$25.00\nVISA"))
+        assert parsed.data["total"] == 25.0
+        assert parsed.confidence == 0.8
+
+    def test_missing_total(self):
+        parsed = parse("CORNER CAFE\n03/14/2026\n\nLatte      4.50\nMuffin     3.25\n")
+        assert parsed.data["total"] == 0.0
+        assert parsed.confidence == 0.55
+
+    def test_grand_total_beats_total(self):
+        parsed = parse("Shop\nItem A    10.00\nTotal     10.00\nShipping   5.00\nGrand Total  15.00\n")
+        assert parsed.data["total"] == 15.0
+
+
+class TestConfidence:
+    """Templates, validation and fallbacks."""
+
+    def test_template_total_item(self):
+        """Receipts that only carry a total become one item from the template."""
+        parsed = parse("Thanks for riding with Uber\nOct 12, 2026\nTotal $23.40\n")
+        assert parsed.template == "Uber"
+        assert parsed.data["items"] == [{"name": "Trip fare", "price": 23.4, "quantity": 1}]
+        assert parsed.data["category"] == "transportation"
+        assert parsed.confidence == 1.0
+
+    def test_validator_failure_halves_confidence(self):
+        """A future date fails the validator."""
+        validator = ReceiptValidator(["food", "other"])
+        assert parse(CAFE, validator).confidence == 1.0
+        assert parse(CAFE.replace("03/14/2026", "03/14/2031"), validator).confidence == 0.5
+
+    def test_prose_is_low_confidence(self):
+        parsed = parse("Hi, just checking whether you got my message about dinner next week?")
+        assert parsed.data["items"] == [] and parsed.confidence < 0.5
+
+    def test_html_email(self):
+        text = html_to_text("<html><body><p>Receipt from Corner Cafe</p><p>Date: 2026-10-01</p><table>"
+                            "<tr><td>Latte</td><td>4.50</td></tr><tr><td>Muffin</td><td>3.25</td></tr>"
+                            "<tr><td>Total</td><td>$7.75</td></tr></table></body></html>")
+        parsed = parse(text)
+        assert parsed.data["merchant_name"] == "Corner Cafe"
+        assert [i["name"] for i in parsed.data["items"]] == ["Latte", "Muffin"]
+        assert parsed.data["total"] == 7.75 and parsed.confidence == 1.0
+
+
+class TestParseMoney:
+    """Amount text to float."""
+
+    def test_formats(self):
+        assert parse_money("$1,234.50") == 1234.5
+        assert parse_money("4,50 €") == 4.5
+        assert parse_money("-3.00") == -3.0
+        assert parse_money("$-3.00") == -3.0
@@ -0,0 +1,371 @@
+"""
+Rule-based extraction of plaintext and emailed receipts.
+
+E-receipt emails and pasted order confirmations already contain the
+merchant, date, line items and totals as text, so they do not need a vision
+call. TextReceiptParser finds these with regular expressions and produces
+the same fields as the model (merchant_name, date, items, total, category,
+description). Merchant templates recognise frequent senders. They fix the
+merchant name and category, and can supply an item pattern for layouts the
+line rules do not cover, such as Amazon's name / Qty / price blocks.
+
+Every parse gets a confidence between 0 and 1. Each field found adds to it,
+and an item sum that reconciles with the total (allowing for listed tax,
+tips, fees and discounts) adds the most. A result that fails the
+ReceiptValidator checks has its confidence halved. ReceiptProcessor calls
+the model only when the confidence is below its threshold. HTML emails are
+reduced to text first, with table cells kept apart so item and price
+columns stay separable.
+"""
+import re
+import html
+from datetime import date
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from receipt_validation import ReceiptValidator
+
+# A money amount with two decimals: "$1,234.50", "12.99", "-3.00", "4,50 €"
+AMOUNT = r"-?\s?[$€£]?\s?-?(?:\d{1,3}(?:,\d{3})+|\d+)[.,]\d{2}(?:\s?[€£])?"
+
+MAX_LINE_LENGTH = 200
+
+MONTHS = {name: number for number, names in enumerate((
+    ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",), ("jun", "june"),
+    ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"),
+    ("nov", "november"), ("dec", "december")), start=1) for name in names}
+
+_DATE_PATTERNS = (
+    ("ymd", re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")),
+    ("mdy", re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})\b")),
+    ("dmy", re.compile(r"\b(\d{1,2})\.(\d{1,2})\.(\d{4})\b")),
+    # Any word is accepted as the month and looked up in MONTHS, which is much faster than an alternation
+    ("month_dy", re.compile(r"\b([A-Za-z]{3,9})\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b")),
+    ("d_month_y", re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]{3,9})\.?,?\s+(\d{4})\b")),
+)
+_DATE_LABEL_RE = re.compile(r"\b(date|ordered|placed|issued|purchased|transaction|trip|visit|paid on)\b", re.I)
+
+# Labels of the amount charged, strongest first
+_TOTAL_LABELS = (
+    r"grand\s+total", r"order\s+total", r"total\s+charged", r"amount\s+charged", r"amount\s+paid",
+    r"total\s+paid", r"you\s+paid", r"balance\s+due", r"amount\s+due", r"total\s+due", r"total",
+)
+_TOTAL_RE = re.compile(rf"^\s*({'|'.join(_TOTAL_LABELS)})\b[^\n\d$€£-]*?({AMOUNT})\s*$", re.I | re.M)
+_TOTAL_LABEL_RES = [re.compile(label, re.I) for label in _TOTAL_LABELS]
+_SUBTOTAL_RE = re.compile(rf"^\s*(?:sub\s?-?total|item\(?s\)?\s+subtotal|items)\b[^\n\d$€£-]*?({AMOUNT})\s*$",
+                          re.I | re.M)
+_CHARGE_RE = re.compile(
+    rf"^\s*(?:[\w ,&]*\b(?:tax(?:es)?|vat|gst|hst|pst|tip|gratuity|shipping|delivery|fees?|service charge|"
+    rf"surcharges?|tolls?))\b"
+    rf"[^\n\d$€£-]*?({AMOUNT})\s*$", re.I | re.M)
+_DISCOUNT_RE = re.compile(
+    rf"^\s*(?:[\w ]*\b(?:discount|coupon|promo(?:tion)?|savings|credit applied|offer))\b[^\n\d$€£]*?({AMOUNT})\s*$",
+    re.I | re.M)
+
+# Lines that carry amounts but are not items
+_SUMMARY_RE = re.compile(
+    r"\b(sub\s?-?total|total|tax(?:es)?|vat|gst|hst|pst|tip|gratuity|shipping|delivery|fees?|service charge|"
+    r"surcharges?|tolls?|discount|coupon|promo|savings|balance|change|cash|visa|mastercard|amex|american express|"
+    r"discover|debit|credit|payment|paid|tendered|rounding|amount|refund|points|rewards|you saved|estimated|"
+    r"gift card|store card|summe|gesamt|mwst|ust|iva|tva|ttc)\b", re.I)
+
+_ITEM_RE = re.compile(
+    r"^\s*(?:(?P<qty>\d{1,3})\s*[x×]\s*)?"
+    r"(?P<name>[^\t]*?)"
+    r"(?:\s+[x×]\s*(?P<qty2>\d{1,3}))?"
+    r"(?:\s+(?:qty|quantity)[:\s]*(?P<qty3>\d{1,3}))?"
+    rf"(?:\s*@\s*(?P<unit>{AMOUNT})(?:\s*(?:ea|each))?)?"
+    rf"\s*(?:\.{{2,}}|:|\s)\s*(?P<amount>{AMOUNT})\s*(?:[A-Z]{{1,2}})?\s*$")
+
+_MERCHANT_PHRASE_RE = re.compile(
+    r"(?:thank you for (?:shopping|dining|ordering|visiting|riding|your (?:order|purchase|visit|payment))"
+    r"(?:\s+(?:at|with|from|to))?|your (?:order|receipt|purchase|trip|ride) (?:from|at|with)|receipt from|"
+    r"payment to|"
+    r"purchase at|order from|welcome to)\s+(?P<merchant>[A-Z0-9][\w&'’.\- ]{1,40}?)\s*(?:[.!,:;|]|\s{2,}|$)",
+    re.I | re.M)
+_FROM_HEADER_RE = re.compile(r"^From:\s*\"?(?P<merchant>[^\"<\n@]+?)\"?\s*<", re.I | re.M)
+_SENDER_NOISE_RE = re.compile(r"\s*(?:\b(?:receipts?|orders?|no-?reply|noreply|notifications?|team|support)\b|via\s.*)$",
+                              re.I)
+_HEADER_LINE_RE = re.compile(
+    r"^(subject|to|from|date|sent|order|receipt|invoice|transaction|store|tel|phone|www\.|http|cashier|"
+    r"register|table|server|guest|thank|welcome|your|hi|hello|dear)\b", re.I)
+
+CATEGORY_KEYWORDS = {
+    "food": ("restaurant", "cafe", "café", "coffee", "grocery", "groceries", "market", "pizza", "burger",
+             "bakery", "kitchen", "grill", "deli", "diner", "sushi", "taco", "bistro", "eats", "latte",
+             "sandwich", "bagel", "salad", "noodle", "bar", "brewing", "foods", "supermarket", "bäckerei",
+             "boulangerie", "panadería", "kaffee"),
+    "transportation": ("taxi", "cab", "fuel", "gas station", "gasoline", "parking", "transit", "airline",
+                       "airways", "rail", "train", "metro", "toll", "ride", "trip fare", "unleaded"),
+    "utilities": ("electric", "electricity", "water bill", "internet", "broadband", "power", "energy",
+                  "utility", "wireless", "mobile plan"),
+    "entertainment": ("cinema", "theater", "theatre", "movie", "concert", "tickets", "streaming", "games",
+                      "museum", "bowling"),
+    "healthcare": ("pharmacy", "clinic", "dental", "medical", "hospital", "prescription", "rx ", "doctor",
+                   "vitamin"),
+    "housing": ("rent", "apartment", "hoa", "mortgage", "property"),
+    "education": ("tuition", "course", "school", "university", "textbook", "college", "workshop"),
+    "personal": ("salon", "barber", "spa", "gym", "fitness", "haircut", "cosmetics", "laundry"),
+    "shopping": ("store", "shop", "mall", "outlet", "boutique", "apparel", "electronics", "hardware",
+                 "department", "clothing", "shoes"),
+}
+
+DESCRIPTIONS = {
+    "food": "Food at {merchant}",
+    "transportation": "Transportation with {merchant}",
+    "utilities": "Utility bill from {merchant}",
+    "entertainment": "Entertainment at {merchant}",
+    "healthcare": "Healthcare purchase at {merchant}",
+    "housing": "Housing payment to {merchant}",
+    "education": "Education expense at {merchant}",
+    "personal": "Personal care at {merchant}",
+    "shopping": "Shopping at {merchant}",
+}
+
+# Frequent senders: match (multiline regex on the text), merchant name, category, and optionally
+# a description, an item regex (named groups name, qty, amount) and an item name for
+# receipts that only carry a total
+DEFAULT_TEMPLATES: List[Dict[str, Any]] = [
+    {"merchant": "Uber Eats", "match": r"\buber\s*eats\b", "category": "food",
+     "description": "Food delivery from {merchant}"},
+    {"merchant": "Uber", "match": r"\buber\b", "category": "transportation", "description": "Uber ride",
+     "total_item": "Trip fare"},
+    {"merchant": "Lyft", "match": r"\blyft\b", "category": "transportation", "description": "Lyft ride",
+     "total_item": "Ride fare"},
+    {"merchant": "DoorDash", "match": r"\bdoordash\b", "category": "food",
+     "description": "Food delivery from {merchant}"},
+    {"merchant": "Amazon", "match": r"\bamazon\.(?:com|ca|co\.uk)\b|\bamazon order\b", "category": "shopping",
+     "description": "Amazon order",
+     "item": rf"^\s*(?P<name>[^\n]*[A-Za-z][^\n]*?)\s*\n\s*(?:Qty|Quantity):\s*(?P<qty>\d+)\s*\n\s*(?P<amount>{AMOUNT})\s*$"},
+    {"merchant": "Starbucks", "match": r"\bstarbucks\b", "category": "food", "description": "Coffee at Starbucks"},
+    {"merchant": "Netflix", "match": r"\bnetflix\b", "category": "entertainment",
+     "description": "Netflix subscription", "total_item": "Monthly subscription"},
+    {"merchant": "Spotify", "match": r"\bspotify\b", "category": "entertainment",
+     "description": "Spotify subscription", "total_item": "Premium subscription"},
+    {"merchant": "Walgreens", "match": r"\bwalgreens\b", "category": "healthcare"},
+    {"merchant": "CVS Pharmacy", "match": r"\bcvs\b", "category": "healthcare"},
+    {"merchant": "Shell", "match": r"^\s*shell\b", "category": "transportation", "description": "Fuel at Shell"},
+    {"merchant": "Target", "match": r"^\s*target\b|\btarget\.com\b", "category": "shopping"},
+    {"merchant": "Walmart", "match": r"\bwalmart\b", "category": "shopping"},
+    {"merchant": "Whole Foods Market", "match": r"\bwhole\s*foods\b", "category": "food",
+     "description": "Groceries at Whole Foods"},
+    {"merchant": "Trader Joe's", "match": r"\btrader\s*joe'?s\b", "category": "food",
+     "description": "Groceries at Trader Joe's"},
+]
+
+class ParsedReceipt(NamedTuple):
+    """Result of a local parse"""
+    data: Dict[str, Any]
+    confidence: float
+    template: Optional[str]
+
+def parse_money(text: str) -> float:
+    """Float value of an AMOUNT match ("$1,234.50", "4,50 €", "-3.00")"""
+    value = re.sub(r"[\s$€£]", "", text)
+    negative = value.startswith("-") or "--" in value
+    value = value.lstrip("-").replace("-", "")
+    if re.fullmatch(r"\d+,\d{2}", value):
+        value = value.replace(",", ".")
+    else:
+        value = value.replace(",", "")
+    return -float(value) if negative else float(value)
+
+def html_to_text(text: str) -> str:
+    """Plain text of an HTML email, one line per row or block and cells separated by wide gaps"""
+    if not re.search(r"<(?:html|body|table|tr|td|div|p|br)\b", text, re.I):
+        return text
+    text = re.sub(r"(?is)<(script|style|head)\b.*?</\1>", " ", text)
+    text = re.sub(r"(?i)<br\s*/?>|</(?:p|div|tr|li|h\d|table)>", "\n", text)
+    text = re.sub(r"(?i)</t[dh]>", "    ", text)
+    text = html.unescape(re.sub(r"<[^>]+>", " ", text))
+    lines = (re.sub(r"[ \t ]{4,}", "    ", re.sub(r"[ \t ]+(?= )", "", line)).strip()
+             for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+class TextReceiptParser:
+    """Regex and template extraction of receipt fields from plain text"""
+
+    def __init__(self, categories: Optional[List[str]] = None, templates: Optional[List[Dict[str, Any]]] = None,
+                 validator: Optional[ReceiptValidator] = None):
+        """
+        Args:
+            categories: Accepted category values ("other" is used when nothing matches)
+            templates: Merchant templates (DEFAULT_TEMPLATES when omitted)
+            validator: Local checks applied to the result (failures halve the confidence)
+        """
+        self.categories = set(categories or list(CATEGORY_KEYWORDS) + ["other"])
+        self.templates = [
+            {**template, "_match": re.compile(template["match"], re.I | re.M),
+             "_item": re.compile(template["item"], re.I | re.M) if template.get("item") else None}
+            for template in (DEFAULT_TEMPLATES if templates is None else templates)
+        ]
+        # One pass over the text tells whether any template applies (most receipts match none)
+        self._any_template = re.compile("|".join(f"(?:{t['match']})" for t in self.templates) or "(?!)",
+                                        re.I | re.M)
+        self.validator = validator
+
+    def parse(self, text: str, today: Optional[date] = None) -> ParsedReceipt:
+        """
+        Extract receipt fields from text
+
+        Args:
+            text: Receipt text (plain, or an HTML email body)
+            today: Reference date for the validator
+
+        Returns:
+            The extracted fields, a confidence between 0 and 1, and the merchant template used
+        """
+        # Receipt lines are short: dropping long ones (prose paragraphs, encoded attachments)
+        # keeps the backtracking of the line patterns bounded
+        text = "\n".join(line for line in html_to_text(text).replace("\r\n", "\n").split("\n")
+                         if len(line) <= MAX_LINE_LENGTH)
+        template = None
+        if self._any_template.search(text):
+            template = next((t for t in self.templates if t["_match"].search(text)), None)
+        merchant = template["merchant"] if template else self._merchant(text)
+        receipt_date = self._date(text)
+        total = self._total(text)
+        items = self._items(text, template)
+        category = template["category"] if template else self._category(text, merchant)
+
+        reconciled = bool(items) and total is not None and self._reconciles(text, items, total)
+        confidence = 0.0
+        confidence += 0.2 if merchant else 0.0
+        confidence += 0.2 if receipt_date else 0.0
+        confidence += 0.25 if total is not None else 0.0
+        confidence += 0.05 if category != "other" else 0.0
+        if items:
+            confidence += 0.3 if reconciled else 0.1
+        elif total is not None and template and template.get("total_item"):
+            # Receipts that only carry a total (rides, subscriptions) become one item
+            items = [{"name": template["total_item"], "price": total, "quantity": 1}]
+            confidence += 0.3
+
+        merchant = merchant or "Unknown merchant"
+        description = (template or {}).get("description") or DESCRIPTIONS.get(category, "Purchase at {merchant}")
+        data = {
+            "merchant_name": merchant,
+            "date": receipt_date or "",
+            "items": items,
+            "total": total if total is not None else 0.0,
+            "category": category,
+            "description": description.format(merchant=merchant),
+        }
+        # The validator's item sum check only allows for a share of tax and tips; once the items are
+        # reconciled with the listed charges, only its date, amount and category checks are needed
+        checked = {**data, "items": []} if reconciled else data
+        if self.validator is not None and self.validator.check(checked, today):
+            confidence *= 0.5
+        return ParsedReceipt(data, round(min(confidence, 1.0), 2), template["merchant"] if template else None)
+
+    def _merchant(self, text: str) -> Optional[str]:
+        match = _MERCHANT_PHRASE_RE.search(text)
+        if match:
+            return match.group("merchant").strip(" .-")
+        match = _FROM_HEADER_RE.search(text)
+        if match:
+            name = _SENDER_NOISE_RE.sub("", match.group("merchant")).strip(" .-")
+            if name:
+                return name
+        for line in text.splitlines()[:8]:
+            line = line.strip(" *=-#|")
+            if (re.search(r"[A-Za-z]{2}", line) and len(line) <= 40 and not _HEADER_LINE_RE.match(line)
+                    and not re.search(AMOUNT, line) and not any(p.search(line) for _, p in _DATE_PATTERNS)):
+                return line
+        return None
+
+    def _date(self, text: str) -> Optional[str]:
+        # Dates on a labelled line ("Order date: ...") first, then the earliest one in the text
+        candidates = []
+        for kind, pattern in _DATE_PATTERNS:
+            for match in pattern.finditer(text):
+                parsed = self._to_date(kind, match.groups())
+                if parsed:
+                    line_start = text.rfind("\n", 0, match.start()) + 1
+                    line_end = text.find("\n", match.end())
+                    labelled = _DATE_LABEL_RE.search(text, line_start, line_end if line_end >= 0 else len(text))
+                    candidates.append((0 if labelled else 1, match.start(), parsed))
+        return min(candidates)[2].isoformat() if candidates else None
+
+    @staticmethod
+    def _to_date(kind: str, groups: Tuple[str, ...]) -> Optional[date]:
+        try:
+            if kind == "ymd":
+                year, month, day = (int(g) for g in groups)
+            elif kind == "mdy":
+                month, day, year = (int(g) for g in groups)
+                if month > 12 >= day:
+                    month, day = day, month
+                year += 2000 if year < 100 else 0
+            elif kind == "dmy":
+                day, month, year = (int(g) for g in groups)
+            elif kind == "month_dy":
+                month, day, year = MONTHS[groups[0].lower()], int(groups[1]), int(groups[2])
+            else:
+                day, month, year = int(groups[0]), MONTHS[groups[1].lower()], int(groups[2])
+            return date(year, month, day)
+        except (ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _total(text: str) -> Optional[float]:
+        # The last amount with the strongest label ("Grand total" over "Total")
+        best = None
+        for match in _TOTAL_RE.finditer(text):
+            rank = next(i for i, label in enumerate(_TOTAL_LABEL_RES) if label.fullmatch(match.group(1)))
+            if best is None or rank <= best[0]:
+                best = (rank, match.group(2))
+        return abs(parse_money(best[1])) if best else None
+
+    def _items(self, text: str, template: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if template and template["_item"] is not None:
+            return [self._item(m.group("name"), m.group("qty"), None, m.group("amount"))
+                    for m in template["_item"].finditer(text)]
+        items = []
+        for line in text.splitlines():
+            match = _ITEM_RE.match(line)
+            if match and _SUMMARY_RE.search(match.group("name")):
+                # Payment lines after the totals are not items ("Starbucks Card 10.15")
+                if items and re.search(r"\b(sub\s?-?total|total|summe|gesamt)\b", match.group("name"), re.I):
+                    break
+                continue
+            if not match or not re.search(r"[^\W\d_]", match.group("name")):
+                continue
+            if _HEADER_LINE_RE.match(match.group("name")):
+                continue
+            if any(p.search(match.group("name")) for _, p in _DATE_PATTERNS):
+                continue
+            quantity = match.group("qty") or match.group("qty2") or match.group("qty3")
+            items.append(self._item(match.group("name"), quantity, match.group("unit"), match.group("amount")))
+        return items
+
+    @staticmethod
+    def _item(name: str, quantity: Optional[str], unit: Optional[str], amount: str) -> Dict[str, Any]:
+        name = re.sub(r"\s+", " ", name).strip(" .:-")
+        quantity = int(quantity) if quantity else 1
+        line_total = parse_money(amount)
+        price = parse_money(unit) if unit else round(line_total / quantity, 2)
+        return {"name": name, "price": price, "quantity": quantity}
+
+    @staticmethod
+    def _reconciles(text: str, items: List[Dict[str, Any]], total: float) -> bool:
+        """Whether the items add up to the subtotal or, with listed charges and discounts, to the total"""
+        item_sum = round(sum(item["price"] * item["quantity"] for item in items), 2)
+        charges = sum(abs(parse_money(m.group(1))) for m in _CHARGE_RE.finditer(text)
+                      if not _TOTAL_RE.match(m.group(0)))
+        discounts = sum(abs(parse_money(m.group(1))) for m in _DISCOUNT_RE.finditer(text))
+        subtotal = _SUBTOTAL_RE.search(text)
+        candidates = [item_sum, item_sum + charges - discounts, item_sum - discounts]
+        if subtotal and abs(parse_money(subtotal.group(1)) - item_sum) < 0.02:
+            return True
+        return any(abs(candidate - total) < 0.02 for candidate in candidates)
+
+    def _category(self, text: str, merchant: Optional[str]) -> str:
+        haystack = f" {(merchant or '')} {text} ".lower()
+        scores = {category: sum(haystack.count(keyword) for keyword in keywords)
+                  for category, keywords in CATEGORY_KEYWORDS.items() if category in self.categories}
+        # The merchant name decides ties and outweighs words in the body
+        for category, keywords in CATEGORY_KEYWORDS.items():
+            if category in scores and merchant and any(keyword in merchant.lower() for keyword in keywords):
+                scores[category] += 3
+        best = max(scores.items(), key=lambda entry: entry[1], default=("other", 0))
+        return best[0] if best[1] > 0 else "other"